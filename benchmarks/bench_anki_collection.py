@@ -0,0 +1,304 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Run Merge Notes operations end-to-end against a real, temporary Anki collection.
+Reports wall time, the number of backend calls and memory, so that backend costs the fakes don't have are included.
+Run as: python -m benchmarks.bench_anki_collection [--sizes 1000 10000] [--save results.json]
+"""
+
+import argparse
+import collections
+import gc
+import inspect
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+from typing import Any, Optional
+
+import anki.lang
+from anki._backend_generated import RustBackendGenerated
+from anki.collection import AddNoteRequest, Collection
+from anki.decks import DeckId
+
+from benchmarks.corpus import subs2srs_fields
+from merge_notes.config_types import OriginalNotesAction
+from merge_notes.duplicate_merging import MergeDupes
+from merge_notes.duplicate_notes import NoteDuplicator
+from merge_notes.duplicate_search import DuplicateSearch
+from merge_notes.merging import MergeNotes
+from merge_notes.normalizer import Normalizer
+from merge_notes.progress import ProgressReporter
+from playground.no_anki_config import NoAnkiConfigView
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+DEFAULT_SIZES = (1_000, 10_000)
+NOTE_TYPE_NAME = "subs2srs"
+SEARCH_FIELD = "SentKanji"
+ADD_BATCH_SIZE = 5_000
+
+
+class BackendConfig(NoAnkiConfigView):
+    """Default config that strips HTML with Anki's backend, like the add-on does inside Anki."""
+
+    @property
+    def normalizer(self) -> Normalizer:
+        """Return the field normalizer, using Anki's HTML stripping."""
+        if self._normalizer is None:
+            self._normalizer = Normalizer.from_config(self, anki_html=True)
+        return self._normalizer
+
+
+def backend_method_names() -> dict[tuple[int, int], str]:
+    """Map (service, method) pairs of backend commands to the names of the methods that send them."""
+    names: dict[tuple[int, int], str] = {}
+    method_name = ""
+    for line in inspect.getsource(RustBackendGenerated).splitlines():
+        if match := re.match(r"    def (\w+)\(", line):
+            method_name = match.group(1).removesuffix("_raw")
+        elif match := re.search(r"self\._run_command\((\d+), (\d+),", line):
+            names[int(match.group(1)), int(match.group(2))] = method_name
+    return names
+
+
+class BackendCallCounter:
+    """Counts calls a collection makes to the Rust backend, by method name. Database queries count as db."""
+
+    def __init__(self, col: Collection) -> None:
+        """Start counting calls of the collection's backend."""
+        self.counts: collections.Counter[str] = collections.Counter()
+        self._names = backend_method_names()
+        backend = col._backend
+        run_command, db_command = backend._run_command, backend._db_command
+
+        def counting_run_command(service: int, method: int, input: bytes) -> bytes:
+            """Count a backend command, then send it."""
+            self.counts[self._names.get((service, method), f"{service}.{method}")] += 1
+            return run_command(service, method, input)
+
+        def counting_db_command(input: dict[str, Any]) -> Any:
+            """Count a database command, then send it."""
+            self.counts["db"] += 1
+            return db_command(input)
+
+        backend._run_command = counting_run_command  # type: ignore[method-assign]
+        backend._db_command = counting_db_command  # type: ignore[method-assign]
+
+    def reset(self) -> None:
+        """Forget calls counted so far."""
+        self.counts.clear()
+
+    def total(self) -> int:
+        """Return the number of calls."""
+        return sum(self.counts.values())
+
+
+def add_note_type(col: Collection) -> dict[str, Any]:
+    """Add a note type with the fields of a subs2srs deck and return it."""
+    mm = col.models
+    model = mm.new(NOTE_TYPE_NAME)
+    for field_name in next(subs2srs_fields(1)):
+        mm.add_field(model, mm.new_field(field_name))
+    template = mm.new_template("Sentence")
+    template["qfmt"] = "{{SentKanji}}"
+    template["afmt"] = "{{FrontSide}}<hr>{{SentFurigana}}<br>{{SentEng}}"
+    mm.add_template(model, template)
+    mm.add(model)
+    return mm.by_name(NOTE_TYPE_NAME)
+
+
+def populate(path: str, size: int) -> None:
+    """Create a collection at path with size notes."""
+    col = Collection(path)
+    try:
+        model = add_note_type(col)
+        deck_id = DeckId(col.decks.id("Benchmark"))
+        requests = []
+        for fields in subs2srs_fields(size):
+            note = col.new_note(model)
+            for key, value in fields.items():
+                note[key] = value
+            requests.append(AddNoteRequest(note=note, deck_id=deck_id))
+            if len(requests) >= ADD_BATCH_SIZE:
+                col.add_notes(requests)
+                requests = []
+        col.add_notes(requests)
+    finally:
+        col.close()
+
+
+# A benchmark prepares its input from an open collection and returns a function that runs the measured code once.
+# The function returns the number of items it processed.
+Benchmark = Callable[[Collection, BackendConfig, argparse.Namespace], Callable[[], int]]
+
+
+def all_nids(col: Collection) -> list:
+    """Return IDs of all notes in creation order."""
+    return col.db.list("SELECT id FROM notes ORDER BY id")
+
+
+def bench_merge_notes(col: Collection, cfg: BackendConfig, args: argparse.Namespace) -> Callable[[], int]:
+    """Merge small selections of notes one operation at a time, like a user merging in the browser."""
+    nids = all_nids(col)[: args.selections * args.selection_size]
+    selections = [
+        [col.get_note(nid) for nid in nids[idx : idx + args.selection_size]]
+        for idx in range(0, len(nids) - 1, args.selection_size)
+    ]
+
+    def run() -> int:
+        """Merge every selection in its own operation."""
+        for notes in selections:
+            MergeNotes(col, cfg).op(notes)
+        return len(selections)
+
+    return run
+
+
+def bench_deep_search(col: Collection, cfg: BackendConfig, _args: argparse.Namespace) -> Callable[[], int]:
+    """Search duplicates of the sentence field with Merge Notes comparison."""
+    search = DuplicateSearch(cfg)
+
+    def run() -> int:
+        """Search the duplicates."""
+        search.find(col, SEARCH_FIELD, f'"note:{NOTE_TYPE_NAME}"', ProgressReporter())
+        return col.note_count()
+
+    return run
+
+
+def bench_merge_dupes(col: Collection, cfg: BackendConfig, _args: argparse.Namespace) -> Callable[[], int]:
+    """Merge every duplicate group found by the search."""
+    dupes = DuplicateSearch(cfg).find(col, SEARCH_FIELD, f'"note:{NOTE_TYPE_NAME}"', ProgressReporter())
+    cfg.normalized_values.clear()
+
+    def run() -> int:
+        """Merge the duplicates."""
+        MergeDupes(col, cfg).merge_groups(dupes, ProgressReporter())
+        return len(dupes)
+
+    return run
+
+
+def bench_duplicate_notes(col: Collection, cfg: BackendConfig, args: argparse.Namespace) -> Callable[[], int]:
+    """Duplicate a selection of notes in one operation."""
+    nids = all_nids(col)[: args.duplicate_count]
+
+    def run() -> int:
+        """Duplicate the notes."""
+        NoteDuplicator(col, cfg).op(nids)
+        return len(nids)
+
+    return run
+
+
+BENCHMARKS: dict[str, Benchmark] = {
+    "merge_notes_op": bench_merge_notes,
+    "deep_search_duplicates": bench_deep_search,
+    "merge_dupes_op": bench_merge_dupes,
+    "duplicate_notes_op": bench_duplicate_notes,
+}
+
+
+def max_rss_kib() -> Optional[int]:
+    """Return the peak resident memory of this process so far, where the platform reports it."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(
+    benchmark: Benchmark,
+    template_path: str,
+    work_dir: str,
+    args: argparse.Namespace,
+) -> dict[str, Any]:
+    """Run a benchmark once on a fresh copy of the populated collection."""
+    path = os.path.join(work_dir, "run.anki2")
+    shutil.copyfile(template_path, path)
+    col = Collection(path)
+    try:
+        cfg = BackendConfig()
+        cfg["original_notes_action"] = args.action
+        counter = BackendCallCounter(col)
+        run = benchmark(col, cfg, args)
+        counter.reset()
+        gc.collect()
+        if args.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            items = run()
+            seconds = time.perf_counter() - start
+            result: dict[str, Any] = {"seconds": seconds, "items": items, "items_per_second": items / seconds}
+            if args.trace_memory:
+                result["python_peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+        finally:
+            if args.trace_memory:
+                tracemalloc.stop()
+        result["backend_calls"] = counter.total()
+        result["top_backend_calls"] = dict(counter.counts.most_common(5))
+        result["max_rss_kib"] = max_rss_kib()
+        return result
+    finally:
+        col.close()
+        os.remove(path)
+
+
+def run_benchmarks(args: argparse.Namespace) -> Iterator[dict[str, Any]]:
+    """Yield one result per benchmark and collection size."""
+    with tempfile.TemporaryDirectory(prefix="merge_notes_bench_") as work_dir:
+        for size in args.sizes:
+            template_path = os.path.join(work_dir, f"template_{size}.anki2")
+            populate(template_path, size)
+            for name in args.only:
+                yield {"name": name, "size": size, **measure(BENCHMARKS[name], template_path, work_dir, args)}
+
+
+def main() -> None:
+    """Run the benchmarks and print a table, optionally saving the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument(
+        "--action",
+        choices=[action.name for action in OriginalNotesAction],
+        default=OriginalNotesAction.delete.name,
+    )
+    parser.add_argument("--selections", type=int, default=100, help="selections merged by merge_notes_op")
+    parser.add_argument("--selection-size", type=int, default=3, help="notes per selection")
+    parser.add_argument("--duplicate-count", type=int, default=1_000, help="notes duplicated by duplicate_notes_op")
+    parser.add_argument("--trace-memory", action="store_true", help="trace Python allocations (slows the run down)")
+    parser.add_argument("--save", metavar="FILE", help="write results as JSON")
+    args = parser.parse_args()
+
+    # Anki's HTML stripping and other backend text functions need translations to be set up.
+    anki.lang.set_lang("en")
+    results = []
+    print(f"{'benchmark':<24} {'notes':>8} {'wall, s':>9} {'items/s':>10} {'backend calls':>14} {'max RSS, MiB':>13}")
+    for row in run_benchmarks(args):
+        results.append(row)
+        rss = f"{row['max_rss_kib'] / 1024:>13.0f}" if row["max_rss_kib"] else f"{'-':>13}"
+        print(
+            f"{row['name']:<24} {row['size']:>8} {row['seconds']:>9.3f} {row['items_per_second']:>10.0f} "
+            f"{row['backend_calls']:>14} {rss}"
+        )
+        print(f"{'':<24} top calls: {row['top_backend_calls']}")
+        if "python_peak_kib" in row:
+            print(f"{'':<24} Python peak: {row['python_peak_kib'] / 1024:.1f} MiB")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Time the hot paths of Merge Notes on synthetic subs2srs-style collections.
+Run as: python -m benchmarks.bench_merge_notes [--save results.json] [--compare baseline.json]
+"""
+
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable, Iterator
+
+from benchmarks.corpus import subs2srs_fields
+from merge_notes.config_types import OriginalNotesAction
+from merge_notes.duplicate_merging import MergeDupes
+from merge_notes.duplicate_search import DuplicateSearch
+from merge_notes.merging import MergeNotes
+from merge_notes.normalizer import cfg_strip
+from merge_notes.progress import ProgressReporter
+from playground.no_anki_config import NoAnkiConfigView
+from tests.helpers import FakeNote, FakeSearchCollection
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+# Notes merged together by the merge benchmarks.
+GROUP_SIZE = 3
+SEARCH_FIELD = "SentKanji"
+
+# A benchmark prepares fresh input for a corpus size and returns a function that runs the measured code once.
+# The function returns the number of items it processed. Preparation is not timed.
+Benchmark = Callable[[int], Callable[[], int]]
+
+
+def make_notes(size: int) -> list[FakeNote]:
+    """Return the same notes for the same size on every run."""
+    return [FakeNote(nid, fields) for nid, fields in enumerate(subs2srs_fields(size), start=1)]
+
+
+def make_config(action: OriginalNotesAction = OriginalNotesAction.do_nothing) -> NoAnkiConfigView:
+    """Return the default config with furigana ignored, so that every normalization step runs."""
+    cfg = NoAnkiConfigView()
+    cfg["ignore_furigana"] = True
+    cfg["original_notes_action"] = action.name
+    return cfg
+
+
+def bench_cfg_strip(size: int) -> Callable[[], int]:
+    """Normalize every field of every note."""
+    cfg = make_config()
+    values = [value for note in make_notes(size) for value in note.values()]
+
+    def run() -> int:
+        """Normalize the values."""
+        for value in values:
+            cfg_strip(value, cfg)
+        return len(values)
+
+    return run
+
+
+def bench_do_merge(action: OriginalNotesAction) -> Benchmark:
+    """Return a benchmark that merges consecutive groups of notes in memory with the given action."""
+
+    def setup(size: int) -> Callable[[], int]:
+        """Merge consecutive groups of notes."""
+        cfg = make_config(action)
+        notes = make_notes(size)
+        merger = MergeNotes(FakeSearchCollection(notes), cfg)
+        groups = [notes[idx : idx + GROUP_SIZE] for idx in range(0, len(notes) - 1, GROUP_SIZE)]
+        cfg.normalized_values.clear()
+
+        def run() -> int:
+            """Merge the groups."""
+            for group in groups:
+                merger._do_merge(group)
+            return len(notes)
+
+        return run
+
+    return setup
+
+
+def bench_deep_search(size: int) -> Callable[[], int]:
+    """Search duplicates of the sentence field with Merge Notes comparison."""
+    cfg = make_config()
+    col = FakeSearchCollection(make_notes(size))
+    search = DuplicateSearch(cfg)
+    cfg.normalized_values.clear()
+
+    def run() -> int:
+        """Search the duplicates."""
+        search.find(col, SEARCH_FIELD, "", ProgressReporter())
+        return size
+
+    return run
+
+
+def bench_merge_dupes(size: int) -> Callable[[], int]:
+    """Merge every duplicate group found by the search, reading notes from the database."""
+    cfg = make_config(OriginalNotesAction.delete)
+    col = FakeSearchCollection(make_notes(size))
+    dupes = DuplicateSearch(cfg).find(col, SEARCH_FIELD, "", ProgressReporter())
+    cfg.normalized_values.clear()
+
+    def run() -> int:
+        """Merge the duplicates."""
+        MergeDupes(col, cfg).merge_groups(dupes, ProgressReporter())
+        return sum(len(nids) for _, nids in dupes)
+
+    return run
+
+
+BENCHMARKS: dict[str, Benchmark] = {
+    "cfg_strip": bench_cfg_strip,
+    **{f"do_merge[{action.name}]": bench_do_merge(action) for action in OriginalNotesAction},
+    "deep_search_duplicates": bench_deep_search,
+    "merge_dupes_op": bench_merge_dupes,
+}
+
+
+def measure(benchmark: Benchmark, size: int, repeat: int, memory: bool) -> dict[str, float]:
+    """Return the best time of several runs, throughput, and the peak memory of one more traced run."""
+    best = float("inf")
+    items = 0
+    for _ in range(repeat):
+        run = benchmark(size)
+        gc.collect()
+        start = time.perf_counter()
+        items = run()
+        best = min(best, time.perf_counter() - start)
+    result = {"seconds": best, "items_per_second": items / best if best else 0.0}
+    if memory:
+        run = benchmark(size)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            result["peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_benchmarks(names: list[str], sizes: list[int], repeat: int, memory: bool) -> Iterator[dict]:
+    """Yield one result per benchmark and corpus size."""
+    for size in sizes:
+        for name in names:
+            yield {"name": name, "size": size, **measure(BENCHMARKS[name], size, repeat, memory)}
+
+
+def regressions(results: list[dict], baseline: list[dict], max_slowdown: float) -> list[str]:
+    """Return descriptions of benchmarks that got slower than the baseline by more than max_slowdown times."""
+    old = {(row["name"], row["size"]): row["seconds"] for row in baseline}
+    return [
+        f"{row['name']} at {row['size']} notes: {old[key]:.3f}s → {row['seconds']:.3f}s"
+        for row in results
+        if (key := (row["name"], row["size"])) in old and row["seconds"] > old[key] * max_slowdown
+    ]
+
+
+def main() -> None:
+    """Run the benchmarks, print a table, and optionally save results or compare them with a baseline."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3, help="report the best of this many runs")
+    parser.add_argument("--no-memory", action="store_true", help="skip the extra run that traces memory")
+    parser.add_argument("--save", metavar="FILE", help="write results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="fail if results are slower than this saved run")
+    parser.add_argument("--max-slowdown", type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'benchmark':<28} {'notes':>8} {'best, s':>9} {'items/s':>11} {'peak, KiB':>10}")
+    for row in run_benchmarks(args.only, args.sizes, max(1, args.repeat), not args.no_memory):
+        results.append(row)
+        peak = f"{row['peak_kib']:>10.0f}" if "peak_kib" in row else f"{'-':>10}"
+        print(f"{row['name']:<28} {row['size']:>8} {row['seconds']:>9.3f} {row['items_per_second']:>11.0f} {peak}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            if slower := regressions(results, json.load(f), args.max_slowdown):
+                print("Slower than the baseline:", *slower, sep="\n  ")
+                sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Compare serial and process-pool normalization of a duplicate search.
+Run as: python -m benchmarks.bench_parallel_normalization
+"""
+
+import argparse
+import time
+
+from benchmarks.corpus import sentences
+from merge_notes.bulk_reader import batched
+from merge_notes.duplicate_search import (
+    SEARCH_BATCH_SIZE,
+    group_by_value,
+    normalize_values,
+)
+from merge_notes.normalizer import Normalizer
+from merge_notes.parallel import default_worker_count, group_in_parallel, init_worker
+from merge_notes.progress import ProgressReporter
+from playground.no_anki_config import NoAnkiConfigView
+
+
+def time_serial(pairs: list[tuple[int, str]], normalizer: Normalizer) -> float:
+    """Return the time it takes to normalize and group the pairs in this process."""
+    start = time.perf_counter()
+    group_by_value(normalize_values(pairs, normalizer))
+    return time.perf_counter() - start
+
+
+def time_parallel(pairs: list[tuple[int, str]], normalizer: Normalizer, workers: int) -> float:
+    """Return the time it takes to normalize and group the pairs in a process pool, including its startup."""
+    start = time.perf_counter()
+    group_in_parallel(batched(pairs, SEARCH_BATCH_SIZE), normalizer, ProgressReporter(), workers)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    """Print serial and parallel timings for increasing corpus sizes and the first size where parallel wins."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 25_000, 50_000, 100_000, 200_000])
+    parser.add_argument("--workers", type=int, default=default_worker_count())
+    parser.add_argument(
+        "--regex-html",
+        action="store_true",
+        help="strip HTML with a regex instead of Anki's backend (Anki's is what users get)",
+    )
+    args = parser.parse_args()
+
+    cfg = NoAnkiConfigView()
+    cfg["ignore_furigana"] = True
+    normalizer = Normalizer.from_config(cfg, anki_html=not args.regex_html)
+    init_worker(normalizer.uses_anki_html_stripping)
+    crossover = None
+    print(f"{'notes':>8} {'serial, s':>10} {'parallel, s':>12} {'speedup':>8}  ({args.workers} workers)")
+    for size in args.sizes:
+        pairs = list(enumerate(sentences(size)))
+        serial = time_serial(pairs, normalizer)
+        parallel = time_parallel(pairs, normalizer, args.workers)
+        print(f"{size:>8} {serial:>10.3f} {parallel:>12.3f} {serial / parallel:>8.2f}")
+        if crossover is None and parallel < serial:
+            crossover = size
+    print(f"parallel search is faster from {crossover} notes" if crossover else "parallel search never won")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import random
+from collections.abc import Iterator
+
+WORDS = (
+    ("日本語", "にほんご"),
+    ("勉強", "べんきょう"),
+    ("毎日", "まいにち"),
+    ("先生", "せんせい"),
+    ("電車", "でんしゃ"),
+    ("友達", "ともだち"),
+    ("映画", "えいが"),
+    ("時間", "じかん"),
+    ("学校", "がっこう"),
+    ("天気", "てんき"),
+    ("料理", "りょうり"),
+    ("仕事", "しごと"),
+)
+PARTICLES = ("は", "が", "を", "に", "で", "と", "も", "の")
+ENDINGS = ("です", "でした", "ます", "ません", "だ", "だよ", "かな", "ね")
+PUNCTUATION = ("。", "！", "？", "、", "…", "")
+FULL_WIDTH_DIGITS = "０１２３４５６７８９"
+
+
+def make_sentence(rng: random.Random) -> str:
+    """Return a plain Japanese sentence of a few words."""
+    parts = []
+    for _ in range(rng.randint(2, 5)):
+        word, _reading = rng.choice(WORDS)
+        parts.append(word + rng.choice(PARTICLES))
+    if rng.random() < 0.3:
+        parts.append("".join(rng.choice(FULL_WIDTH_DIGITS) for _ in range(rng.randint(1, 3))))
+    return "".join(parts) + rng.choice(ENDINGS)
+
+
+def decorate(sentence: str, rng: random.Random) -> str:
+    """Return a variant of the sentence that normalizes to the same value under the default config."""
+    if rng.random() < 0.5:
+        sentence = f"<b>{sentence}</b>"
+    if rng.random() < 0.3:
+        sentence = f"<div>{sentence}</div>"
+    return sentence + rng.choice(PUNCTUATION)
+
+
+def with_furigana(sentence: str) -> str:
+    """Add bracketed readings after every known word."""
+    for word, reading in WORDS:
+        sentence = sentence.replace(word, f" {word}[{reading}]")
+    return sentence.strip()
+
+
+def sentences(n: int, seed: int = 0, dupe_ratio: float = 0.2) -> Iterator[str]:
+    """
+    Yield n sentence field values. Roughly dupe_ratio of them repeat an earlier sentence
+    with different markup and punctuation.
+    """
+    rng = random.Random(seed)
+    seen: list[str] = []
+    for _ in range(n):
+        if seen and rng.random() < dupe_ratio:
+            sentence = rng.choice(seen)
+        else:
+            sentence = make_sentence(rng)
+            seen.append(sentence)
+        yield decorate(sentence, rng)
+
+
+def subs2srs_fields(n: int, seed: int = 0, dupe_ratio: float = 0.2) -> Iterator[dict[str, str]]:
+    """Yield field dicts shaped like notes of a subs2srs deck."""
+    rng = random.Random(seed + 1)
+    for idx, sentence in enumerate(sentences(n, seed, dupe_ratio)):
+        yield {
+            "SentKanji": sentence,
+            "SentFurigana": with_furigana(sentence),
+            "SentAudio": f"[sound:episode_{idx // 500:03d}_{idx:06d}.mp3]",
+            "Image": f'<img src="episode_{idx // 500:03d}_{idx:06d}.jpg">',
+            "SentEng": f"Sentence number {idx}." if rng.random() < 0.8 else "",
+        }
@@ -3,13 +3,14 @@
 
 import sys
 
-from aqt import mw
+from .anki_env import anki_mw
 
 
 def start_addon() -> None:
     from . import (
         duplicate_notes,
         find_duplicates,
+        live_duplicates,
         merge_duplicates,
         merge_notes,
         settings_dialog,
@@ -20,7 +21,9 @@ def start_addon() -> None:
     settings_dialog.init()
     duplicate_notes.init()
     find_duplicates.init()
+    live_duplicates.init()
 
 
-if mw and "pytest" not in sys.modules:
+# Worker processes of the parallel duplicate search import the package too, without Anki running.
+if anki_mw() and "pytest" not in sys.modules:
     start_addon()
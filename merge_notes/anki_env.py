@@ -0,0 +1,30 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import functools
+import os
+import sys
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from aqt.main import AnkiQt
+
+
+def anki_mw() -> Optional["AnkiQt"]:
+    """
+    Return Anki's main window, or None if Anki isn't running.
+    aqt is only looked up, never imported, so that worker processes and the command-line tool don't load Qt.
+    """
+    if (aqt := sys.modules.get("aqt")) is None:
+        return None
+    return aqt.mw
+
+
+@functools.cache
+def user_files_dir() -> str:
+    """Return the add-on's user_files folder, which survives add-on updates. Creates it if needed."""
+    mw = anki_mw()
+    assert mw, "Anki should be open."
+    path = os.path.join(mw.addonManager.addonsFolder(mw.addonManager.addon_from_module(__name__)), "user_files")
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,287 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+from collections.abc import Iterator, Sequence
+from typing import Optional, TypeVar
+
+from anki.cards import CardId
+from anki.collection import Collection
+from anki.dbproxy import DBProxy
+from anki.decks import DeckId
+from anki.models import FieldDict, NotetypeDict, NotetypeId
+from anki.notes import Note, NoteId
+from anki.utils import guid64, ids2str
+
+T = TypeVar("T")
+
+BATCH_SIZE = 25_000
+FIELD_SEPARATOR = "\x1f"
+
+
+def database(col: Collection) -> DBProxy:
+    """Return the database of an open collection."""
+    assert col.db is not None, "The collection should be open."
+    return col.db
+
+
+def notetype_of(col: Collection, mid: NotetypeId) -> NotetypeDict:
+    """Return a note type that notes in the collection refer to."""
+    notetype = col.models.get(mid)
+    assert notetype is not None, f"Note type {mid} should exist."
+    return notetype
+
+
+def batched(items: Sequence[T], size: int = BATCH_SIZE) -> Iterator[Sequence[T]]:
+    """Yield consecutive slices of items, each at most size long."""
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+class FieldIndexes:
+    """Resolves a field name to its index in each note type, asking the collection once per note type."""
+
+    def __init__(self, col: Collection, field_name: str) -> None:
+        """Remember the field name to look for."""
+        self._col = col
+        self._field_name = field_name
+        self._indexes: dict[NotetypeId, Optional[int]] = {}
+
+    def __call__(self, mid: NotetypeId) -> Optional[int]:
+        """Return the index of the field in the note type, or None if the note type doesn't have it."""
+        try:
+            return self._indexes[mid]
+        except KeyError:
+            pass
+        idx = self._indexes[mid] = next(
+            (idx for idx, field in enumerate(notetype_of(self._col, mid)["flds"]) if field["name"] == self._field_name),
+            None,
+        )
+        return idx
+
+
+def field_value_batches(
+    col: Collection,
+    nids: Sequence[NoteId],
+    field_name: str,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[list[tuple[NoteId, str]]]:
+    """
+    Yield lists of (note id, field value) pairs, one list per batch_size note IDs.
+    Rows are read straight from the database, no Note objects are constructed.
+    Nonexistent notes and notes that don't have the field are skipped.
+    """
+    index_of = FieldIndexes(col, field_name)
+    for batch in batched(nids, batch_size):
+        yield [
+            (nid, flds.split(FIELD_SEPARATOR)[idx])
+            for nid, mid, flds in database(col).all(f"SELECT id, mid, flds FROM notes WHERE id IN {ids2str(batch)}")
+            if (idx := index_of(mid)) is not None
+        ]
+
+
+def multi_field_value_batches(
+    col: Collection,
+    nids: Sequence[NoteId],
+    field_names: Sequence[str],
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[list[tuple[NoteId, tuple[str, ...]]]]:
+    """
+    Yield lists of (note id, field values) pairs, with values in the order of field_names.
+    All fields are read in the same pass over the notes. Notes that lack any of the fields are skipped.
+    """
+    resolvers = [FieldIndexes(col, field_name) for field_name in field_names]
+    indexes_by_mid: dict[NotetypeId, Optional[tuple[int, ...]]] = {}
+
+    def indexes_of(mid: NotetypeId) -> Optional[tuple[int, ...]]:
+        """Return indexes of all fields in the note type, or None if the note type lacks any of them."""
+        try:
+            return indexes_by_mid[mid]
+        except KeyError:
+            pass
+        indexes = []
+        for index_of in resolvers:
+            if (idx := index_of(mid)) is None:
+                indexes_by_mid[mid] = None
+                return None
+            indexes.append(idx)
+        found = indexes_by_mid[mid] = tuple(indexes)
+        return found
+
+    for batch in batched(nids, batch_size):
+        rows = []
+        for nid, mid, flds in database(col).all(f"SELECT id, mid, flds FROM notes WHERE id IN {ids2str(batch)}"):
+            if (indexes := indexes_of(mid)) is not None:
+                fields = flds.split(FIELD_SEPARATOR)
+                rows.append((nid, tuple(fields[idx] for idx in indexes)))
+        yield rows
+
+
+def field_values(
+    col: Collection,
+    nids: Sequence[NoteId],
+    field_name: str,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[tuple[NoteId, str]]:
+    """Yield (note id, field value) pairs for notes that have the field."""
+    for batch in field_value_batches(col, nids, field_name, batch_size):
+        yield from batch
+
+
+class NoteBuilder:
+    """
+    Builds Note objects without a backend call per note.
+    Anki has no public API for this, so notes get the attributes that Note._load_from_backend_note sets,
+    with the field map computed once per note type instead of once per note.
+    If the running Anki version doesn't load notes that way, the public API is used instead.
+    """
+
+    # If a future Anki version changes how notes are loaded, notes are read through the public API instead.
+    supported = callable(getattr(Note, "_load_from_backend_note", None))
+
+    def __init__(self, col: Collection) -> None:
+        """Remember the collection the notes belong to."""
+        self._col = col
+        self._field_maps: dict[NotetypeId, dict[str, tuple[int, FieldDict]]] = {}
+
+    def _field_map(self, mid: NotetypeId) -> dict[str, tuple[int, FieldDict]]:
+        """Return the field map of a note type, shared by all notes of that type."""
+        try:
+            return self._field_maps[mid]
+        except KeyError:
+            pass
+        fmap = self._field_maps[mid] = self._col.models.field_map(notetype_of(self._col, mid))
+        return fmap
+
+    def _build(
+        self, nid: NoteId, guid: str, mid: NotetypeId, mod: int, usn: int, tags: list[str], fields: list[str]
+    ) -> Note:
+        """Return a note with the given attributes."""
+        note = Note.__new__(Note)
+        note.col = self._col.weakref()
+        note.id = nid
+        note.guid = guid
+        note.mid = mid
+        note.mod = mod
+        note.usn = usn
+        note.tags = tags
+        note.fields = fields
+        note._fmap = self._field_map(mid)
+        return note
+
+    def from_row(self, row: Sequence) -> Note:
+        """
+        Return the note stored in a row of the notes table.
+        The row must contain id, guid, mid, mod, usn, tags, flds.
+        """
+        nid, guid, mid, mod, usn, tags, flds = row
+        if not self.supported:
+            return self._col.get_note(nid)
+        return self._build(nid, guid, mid, mod, usn, self._col.tags.split(tags), flds.split(FIELD_SEPARATOR))
+
+    def copy_of(self, ref_note: Note, tags: list[str]) -> Note:
+        """Return a new note, not yet added to the collection, with the fields of ref_note and the given tags."""
+        if not self.supported:
+            note = Note(self._col, ref_note.mid)
+            note.fields = list(ref_note.fields)
+            note.tags = tags
+            return note
+        return self._build(NoteId(0), guid64(), ref_note.mid, 0, 0, tags, list(ref_note.fields))
+
+
+def load_notes(col: Collection, nids: Sequence[NoteId], batch_size: int = BATCH_SIZE) -> dict[NoteId, Note]:
+    """Return notes by ID, reading them with one query per batch. Nonexistent notes are skipped."""
+    notes: dict[NoteId, Note] = {}
+    builder = NoteBuilder(col)
+    for batch in batched(nids, batch_size):
+        for row in database(col).all(
+            f"SELECT id, guid, mid, mod, usn, tags, flds FROM notes WHERE id IN {ids2str(batch)}"
+        ):
+            notes[row[0]] = builder.from_row(row)
+    return notes
+
+
+class CardRow:
+    """
+    Card attributes read straight from the cards table.
+    Exposes the attributes used to order cards, so the configured ordering key accepts it in place of a Card.
+    """
+
+    __slots__ = ("id", "nid", "did", "ord", "type", "due", "ivl", "_note")
+    id: CardId
+    nid: NoteId
+    did: DeckId
+    ord: int
+    type: int
+    due: int
+    ivl: int
+
+    def __init__(self, row: Sequence, note: Note) -> None:
+        """Store a row of (id, nid, did, ord, type, due, ivl) and the note the card belongs to."""
+        self.id, self.nid, self.did, self.ord, self.type, self.due, self.ivl = row
+        self._note = note
+
+    def note(self) -> Note:
+        """Return the note that owns this card."""
+        return self._note
+
+
+def load_cards(col: Collection, notes: dict[NoteId, Note], batch_size: int = BATCH_SIZE) -> dict[NoteId, list[CardRow]]:
+    """Return card attributes of the given notes, grouped by note ID, with one query per batch."""
+    cards: dict[NoteId, list[CardRow]] = {}
+    for batch in batched(list(notes), batch_size):
+        for row in database(col).all(
+            f"SELECT id, nid, did, ord, type, due, ivl FROM cards WHERE nid IN {ids2str(batch)} ORDER BY nid, ord"
+        ):
+            cards.setdefault(row[1], []).append(CardRow(row, notes[row[1]]))
+    return cards
+
+
+def load_cards_by_id(col: Collection, cids: Sequence[CardId], batch_size: int = BATCH_SIZE) -> list[CardRow]:
+    """
+    Return card attributes of the given cards in the order of cids, with their notes.
+    Cards and notes are read with one query per batch each. Nonexistent cards are skipped.
+    """
+    rows: dict[CardId, Sequence] = {}
+    for batch in batched(cids, batch_size):
+        for row in database(col).all(
+            f"SELECT id, nid, did, ord, type, due, ivl FROM cards WHERE id IN {ids2str(batch)}"
+        ):
+            rows[row[0]] = row
+    notes = load_notes(col, list(dict.fromkeys(row[1] for row in rows.values())), batch_size)
+    return [CardRow(card, notes[card[1]]) for cid in cids if (card := rows.get(cid)) is not None]
+
+
+def card_ids_of_notes(col: Collection, nids: Sequence[NoteId], batch_size: int = BATCH_SIZE) -> list[CardId]:
+    """Return IDs of all cards of the notes, with one query per batch."""
+    cids: list[CardId] = []
+    for batch in batched(nids, batch_size):
+        cids.extend(database(col).list(f"SELECT id FROM cards WHERE nid IN {ids2str(batch)} ORDER BY nid, ord"))
+    return cids
+
+
+def home_deck_ids(col: Collection, nids: Sequence[NoteId], batch_size: int = BATCH_SIZE) -> dict[NoteId, DeckId]:
+    """
+    Return the deck of the first card of each note, with one query per batch.
+    If the card is in a filtered deck, its home deck is returned.
+    """
+    decks: dict[NoteId, DeckId] = {}
+    for batch in batched(nids, batch_size):
+        for nid, did, odid in database(col).all(
+            f"SELECT nid, did, odid FROM cards WHERE nid IN {ids2str(batch)} ORDER BY nid, ord"
+        ):
+            if nid not in decks:
+                decks[nid] = odid or did
+    return decks
+
+
+def note_ids_of_cards(col: Collection, cids: Sequence[CardId], batch_size: int = BATCH_SIZE) -> list[NoteId]:
+    """
+    Return IDs of the notes of the cards, in the order their first card appears in cids.
+    Each note is listed once. Nonexistent cards are skipped.
+    """
+    nid_of_card: dict[CardId, NoteId] = {}
+    for batch in batched(cids, batch_size):
+        nid_of_card.update(
+            (cid, nid) for cid, nid in database(col).all(f"SELECT id, nid FROM cards WHERE id IN {ids2str(batch)}")
+        )
+    return list(dict.fromkeys(nid for cid in cids if (nid := nid_of_card.get(cid)) is not None))
@@ -0,0 +1,181 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Merge duplicate notes of an Anki collection without starting Anki.
+Close Anki (or sync and let it close) before running this on a collection it uses.
+Run as: python -m merge_notes COLLECTION.anki2 --field Front [--search "deck:Mining"] [--config config.json]
+"""
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from collections.abc import Sequence
+from types import FrameType
+from typing import Any, Optional, TextIO
+
+import anki.lang
+from anki.collection import Collection
+
+from .config_view import ACTION_NAME, ConfigView
+from .duplicate_merging import MergeDupes
+from .duplicate_search import DuplicateSearch
+from .instrumentation import summary_text
+from .normalizer import Normalizer
+from .progress import ProgressReporter
+
+# Exit status when the user interrupts the run, following the shell convention for SIGINT.
+EXIT_INTERRUPTED = 130
+
+
+class FileConfig(ConfigView):
+    """
+    Config read from a JSON file in the config.json schema, on top of the add-on's defaults.
+    HTML is stripped by Anki's backend, like inside Anki.
+    """
+
+    default_config_path = os.path.join(os.path.dirname(__file__), "config.json")
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        """Load defaults, then the settings of the file at path, if given."""
+        with open(self.default_config_path, encoding="utf-8") as f:
+            self._config: dict[str, Any] = json.load(f)
+        if path:
+            with open(path, encoding="utf-8") as f:
+                user_config = json.load(f)
+            if unknown := sorted(set(user_config) - set(self._config)):
+                raise ValueError(f"unknown config keys: {', '.join(unknown)}")
+            self._config.update(user_config)
+
+    def __getitem__(self, key: str) -> Any:
+        """Return the value of a setting."""
+        return self._config[key]
+
+    @property
+    def normalizer(self) -> Normalizer:
+        """Return the field normalizer, using Anki's HTML stripping."""
+        if self._normalizer is None:
+            self._normalizer = Normalizer.from_config(self, anki_html=True)
+        return self._normalizer
+
+    @property
+    def persistent_duplicate_index(self) -> bool:
+        """The index is kept per Anki profile, and there is no profile here."""
+        return False
+
+
+class StderrProgress(ProgressReporter):
+    """Prints progress to a stream, at most once per min_interval seconds. Cancelled by Ctrl+C."""
+
+    def __init__(self, stream: TextIO = sys.stderr, min_interval: float = 1.0) -> None:
+        """Print to stream."""
+        self._stream = stream
+        self._min_interval = min_interval
+        self._last_update = 0.0
+        self._total = 0
+
+    def start(self, label: str, total: int) -> None:
+        """Print the label of a new operation."""
+        self._total = total
+        self._last_update = time.monotonic()
+        print(label, file=self._stream, flush=True)
+
+    def update(self, label: str, done: int) -> None:
+        """Print the label, skipping updates that come too often."""
+        if (now := time.monotonic()) - self._last_update < self._min_interval and done < self._total:
+            return
+        self._last_update = now
+        print(label, file=self._stream, flush=True)
+
+    def want_cancel(self) -> bool:
+        """Return whether the user pressed Ctrl+C."""
+        return self.cancelled
+
+    def notify(self, message: str) -> None:
+        """Print the message."""
+        print(message, file=self._stream, flush=True)
+
+    def on_interrupt(self, _signum: int, _frame: Optional[FrameType]) -> None:
+        """Ask the running operation to stop after the current batch. A second Ctrl+C stops at once."""
+        if self.cancelled:
+            raise KeyboardInterrupt
+        self.cancelled = True
+        print("Stopping after the current batch. Press Ctrl+C again to abort.", file=self._stream, flush=True)
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    """Return the command-line arguments."""
+    parser = argparse.ArgumentParser(
+        prog="python -m merge_notes",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("collection", help="path to the .anki2 collection file")
+    parser.add_argument("--field", required=True, help="field searched for duplicates")
+    parser.add_argument("--search", default="", help="limit the search to notes matching this Anki search")
+    parser.add_argument("--config", metavar="FILE", help="settings in the format of the add-on's config.json")
+    parser.add_argument("--dry-run", action="store_true", help="show what would be merged without changing anything")
+    parser.add_argument("--quiet", action="store_true", help="don't print progress")
+    return parser.parse_args(argv)
+
+
+def run(col: Collection, cfg: FileConfig, args: argparse.Namespace, progress: ProgressReporter) -> int:
+    """Search duplicates in an open collection and merge them. Return the exit status."""
+    dupes = DuplicateSearch(cfg).find(col, args.field, args.search, progress)
+    if progress.cancelled:
+        print("Interrupted while searching duplicates. Nothing was changed.")
+        return EXIT_INTERRUPTED
+    print(f"Found {len(dupes)} groups of duplicates ({sum(len(nids) for _, nids in dupes)} notes).")
+    if not dupes:
+        return 0
+    if args.dry_run:
+        print(MergeDupes(col, cfg).preview_groups(dupes, max_diffs=cfg.preview_max_diffs, progress=progress).report())
+        return EXIT_INTERRUPTED if progress.cancelled else 0
+    report = MergeDupes(col, cfg).merge_groups(dupes, progress)
+    print(report.summary())
+    print(
+        f"Notes updated: {report.n_notes_updated}. Notes removed: {report.n_notes_removed}. "
+        f"Notes suspended: {report.n_notes_suspended}."
+    )
+    return EXIT_INTERRUPTED if report.cancelled else 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Run the command line tool. Return the exit status."""
+    args = parse_args(argv)
+    try:
+        cfg = FileConfig(args.config)
+    except (OSError, ValueError) as ex:
+        print(f"Can't read config: {ex}", file=sys.stderr)
+        return 2
+    if not os.path.isfile(args.collection):
+        print(f"Collection not found: {args.collection}", file=sys.stderr)
+        return 2
+    progress: ProgressReporter
+    if args.quiet:
+        progress = ProgressReporter()
+    else:
+        progress = StderrProgress()
+        signal.signal(signal.SIGINT, progress.on_interrupt)
+    # Anki's HTML stripping and other backend text functions need translations to be set up.
+    anki.lang.set_lang("en")
+    col = Collection(args.collection)
+    try:
+        status = run(col, cfg, args, progress)
+    finally:
+        col.close()
+    if cfg.instrumentation:
+        print(summary_text(), file=sys.stderr)
+    return status
+
+
+def console_main() -> None:
+    """Entry point of python -m merge_notes."""
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        print(f"\n{ACTION_NAME}: aborted.", file=sys.stderr)
+        sys.exit(EXIT_INTERRUPTED)
@@ -0,0 +1,443 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import abc
+import functools
+import sys
+from collections.abc import Callable, Mapping
+from typing import Any, Optional, Protocol, TypeVar, Union
+
+from anki.cards import Card
+from anki.notes import Note
+
+from .config_types import OrderingChoice, OriginalNotesAction, SortOrder
+from .normalizer import MiB, NormalizedValueCache, Normalizer
+
+ACTION_NAME = "Merge Notes"
+
+
+class SortableCard(Protocol):
+    """Card attributes read by the ordering keys. Satisfied by Card and by CardRow, which is read in bulk."""
+
+    @property
+    def type(self) -> int: ...
+
+    @property
+    def due(self) -> int: ...
+
+    def note(self) -> Note: ...
+
+
+C = TypeVar("C", bound=SortableCard)
+
+
+def interpret_special_chars(s: str) -> str:
+    """Interpret escaped newline, tab, and carriage-return sequences."""
+    return s.replace(r"\n", "\n").replace(r"\t", "\t").replace(r"\r", "\r")
+
+
+def due_key(card: SortableCard) -> tuple:
+    """Return Anki's due-order sorting key for a card."""
+    # sort cards by their type, then by due number,
+    # so that new cards are always in the beginning of the list,
+    # mimicking the way cards are presented in the Anki Browser
+    return card.type, card.due
+
+
+def sort_field_key(card: SortableCard) -> str:
+    """Return the value of the note type's sort field for a card."""
+    return (note := card.note()).values()[note.model()["sortf"]]
+
+
+def generic_numeric_key(cmp_str_fn: Callable[[C], str]) -> Callable[[C], tuple[int, str]]:
+    """Return a key function that compares field values numerically when possible."""
+
+    def key(card: C) -> tuple[int, str]:
+        """Return a numeric-first sort key for a card."""
+        # Try to imitate sorting Anki does.
+        cmp_str = cmp_str_fn(card)
+        try:
+            return int(cmp_str), cmp_str
+        except ValueError:
+            return sys.maxsize, cmp_str
+
+    return key
+
+
+class ConfigView(abc.ABC):
+    """
+    Typed view of the Merge Notes settings.
+    Subclasses store the settings in the format of config.json and look them up with __getitem__.
+    Doesn't depend on aqt, so that it can be used without Anki.
+    """
+
+    _normalizer: Optional[Normalizer] = None
+    _normalized_values: Optional[NormalizedValueCache] = None
+    _normalization_keys = frozenset((
+        "ignore_html_tags",
+        "ignore_furigana",
+        "ignore_punctuation",
+        "punctuation_characters",
+        "full-width_as_half-width",
+    ))
+
+    @abc.abstractmethod
+    def __getitem__(self, key: str) -> Any:
+        """Return the value of a setting."""
+
+    @functools.cached_property
+    def _ordering_choices(self) -> Mapping[OrderingChoice, Callable[[Card], Any]]:
+        """Return the key functions of all ordering choices."""
+        return {
+            OrderingChoice.due: due_key,
+            OrderingChoice.interval_length: lambda card: card.ivl,
+            OrderingChoice.card_id: lambda card: card.id,
+            OrderingChoice.deck_id: lambda card: card.did,
+            OrderingChoice.sort_field: sort_field_key,
+            OrderingChoice.sort_field_numeric: generic_numeric_key(sort_field_key),
+            OrderingChoice.custom_field: self._custom_field_key,
+            OrderingChoice.custom_field_numeric: generic_numeric_key(self._custom_field_key),
+        }
+
+    def _custom_field_key(self, card: Card) -> str:
+        """Return the configured custom sort field, falling back to the sort field."""
+        if (field := self["custom_sort_field"]) in (note := card.note()):
+            return note[field]
+        else:
+            return sort_field_key(card)  # Last resort
+
+    def _setting_changed(self, key: str) -> None:
+        """Drop the normalizer or the value cache if a setting they depend on has changed."""
+        if key in self._normalization_keys:
+            self._normalizer = None
+        elif key == "normalization_cache_mb":
+            self._normalized_values = None
+
+    def _settings_replaced(self) -> None:
+        """
+        Drop the normalizer if the new settings compare fields differently,
+        and the value cache if its size has changed. Otherwise both are kept.
+        """
+        if self._normalizer is not None and Normalizer.from_config(self).fingerprint != self._normalizer.fingerprint:
+            self._normalizer = None
+        if (
+            self._normalized_values is not None
+            and self._normalized_values.max_bytes != self.normalization_cache_mb * MiB
+        ):
+            self._normalized_values = None
+
+    @property
+    def normalizer(self) -> Normalizer:
+        """Return the field normalizer compiled from the current comparison settings."""
+        if self._normalizer is None:
+            self._normalizer = Normalizer.from_config(self)
+        return self._normalizer
+
+    @property
+    def normalized_values(self) -> NormalizedValueCache:
+        """
+        Return the cache of normalized field values shared by merging and duplicate search.
+        When comparison settings change, a new cache is made, so snapshots keep the cache of their normalizer.
+        """
+        normalizer = self.normalizer
+        if self._normalized_values is None or self._normalized_values.normalizer.fingerprint != normalizer.fingerprint:
+            self._normalized_values = NormalizedValueCache(normalizer, self.normalization_cache_mb * MiB)
+        return self._normalized_values
+
+    @property
+    def ordering_choices(self) -> Mapping[OrderingChoice, Callable[[Card], Any]]:
+        """Return all available card ordering choices."""
+        return self._ordering_choices
+
+    @property
+    def ord_key(self) -> Callable[[Card], Any]:
+        """Return the configured card ordering function."""
+        return self._ordering_choices[self.ordering]
+
+    @property
+    def original_notes_action(self) -> OriginalNotesAction:
+        """Return the action to take on original notes after merging."""
+        try:
+            return OriginalNotesAction[self["original_notes_action"]]
+        except KeyError:
+            return OriginalNotesAction.do_nothing
+
+    @property
+    def merge_notes_shortcut(self) -> str:
+        """Return the keyboard shortcut for merging notes."""
+        return self["merge_notes_shortcut"]
+
+    @property
+    def field_separator(self) -> str:
+        """Return the separator inserted between merged field values."""
+        return self["field_separator"]
+
+    @property
+    def separator(self) -> str:
+        """Return the field separator with escaped special characters interpreted."""
+        return interpret_special_chars(self.field_separator)
+
+    @property
+    def avoid_content_loss(self) -> bool:
+        """Return whether notes should be reordered to reduce content loss."""
+        return bool(self["avoid_content_loss"])
+
+    @property
+    def sort_order(self) -> SortOrder:
+        """Return the configured sort order for cards."""
+        try:
+            return SortOrder[self["sort_order"]]
+        except KeyError:
+            return SortOrder.ascending
+
+    @property
+    def merge_tags(self) -> bool:
+        """Return whether tags should be merged into the recipient note."""
+        return bool(self["merge_tags"])
+
+    @property
+    def skip_if_not_empty(self) -> bool:
+        """Return whether non-empty recipient fields should be left unchanged."""
+        return bool(self["skip_if_not_empty"])
+
+    @property
+    def merge_by_segments(self) -> bool:
+        """Return whether merged fields should be split on the separator and deduplicated part by part."""
+        return bool(self["merge_by_segments"])
+
+    @property
+    def punctuation_characters(self) -> str:
+        """Return characters ignored when comparing fields."""
+        return self["punctuation_characters"]
+
+    @property
+    def ignore_html_tags(self) -> bool:
+        """Return whether HTML tags should be stripped before comparison."""
+        return bool(self["ignore_html_tags"])
+
+    @property
+    def ignore_furigana(self) -> bool:
+        """Return whether furigana should be ignored before comparison."""
+        return bool(self["ignore_furigana"])
+
+    @property
+    def ignore_punctuation(self) -> bool:
+        """Return whether punctuation should be ignored before comparison."""
+        return bool(self["ignore_punctuation"])
+
+    @property
+    def full_width_as_half_width(self) -> bool:
+        """Return whether full-width characters should be normalized."""
+        return bool(self["full-width_as_half-width"])
+
+    @property
+    def duplicate_key_fields(self) -> list[str]:
+        """Return fields that must match, in addition to the searched field, for notes to be duplicates."""
+        return self["duplicate_key_fields"]
+
+    @property
+    def near_duplicate_search(self) -> bool:
+        """Return whether duplicate search should also group similar, but not equal, field values."""
+        return bool(self["near_duplicate_search"])
+
+    @property
+    def near_duplicate_threshold(self) -> float:
+        """Return the minimum similarity (0 to 1) of two field values treated as near duplicates."""
+        return min(1.0, max(0.0, float(self["near_duplicate_threshold"])))
+
+    @property
+    def persistent_duplicate_index(self) -> bool:
+        """Return whether duplicate search should answer from the persistent index of normalized values."""
+        return bool(self["persistent_duplicate_index"])
+
+    @property
+    def parallel_duplicate_search(self) -> bool:
+        """Return whether large duplicate searches should normalize fields in worker processes."""
+        return bool(self["parallel_duplicate_search"])
+
+    @property
+    def parallel_min_notes(self) -> int:
+        """Return the smallest number of notes for which a parallel duplicate search is used."""
+        return int(self["parallel_min_notes"])
+
+    @property
+    def fingerprint_duplicate_search(self) -> bool:
+        """Return whether duplicate search should group fingerprints of normalized values in NumPy arrays."""
+        return bool(self["fingerprint_duplicate_search"])
+
+    @property
+    def live_duplicate_check(self) -> bool:
+        """Return whether the editor should mark fields that duplicate fields of other notes."""
+        return bool(self["live_duplicate_check"])
+
+    @property
+    def live_duplicate_fields(self) -> list[str]:
+        """Return fields checked for duplicates while typing. If empty, the first field is checked."""
+        return self["live_duplicate_fields"]
+
+    @property
+    def merge_duplicates_batch_size(self) -> int:
+        """Return the number of duplicate groups merged and saved at a time."""
+        return max(1, int(self["merge_duplicates_batch_size"]))
+
+    @property
+    def duplicate_notes_batch_size(self) -> int:
+        """Return the number of notes added at a time by Duplicate Notes."""
+        return max(1, int(self["duplicate_notes_batch_size"]))
+
+    @property
+    def preview_max_diffs(self) -> int:
+        """Return the number of changed notes listed in detail by merge previews."""
+        return max(0, int(self["preview_max_diffs"]))
+
+    @property
+    def instrumentation(self) -> bool:
+        """Return whether operations should measure and log the time spent in each phase."""
+        return bool(self["instrumentation"])
+
+    @property
+    def instrumentation_trace_memory(self) -> bool:
+        """Return whether instrumentation should also measure Python memory peaks."""
+        return bool(self["instrumentation_trace_memory"])
+
+    @property
+    def normalization_cache_mb(self) -> int:
+        """Return the memory budget of the normalized value cache, in megabytes."""
+        return max(0, int(self["normalization_cache_mb"]))
+
+    @property
+    def limit_to_fields(self) -> list[str]:
+        """Return field names that should be affected by merging."""
+        return self["limit_to_fields"]
+
+    @property
+    def ordering(self) -> OrderingChoice:
+        """Return the selected card ordering name."""
+        try:
+            return OrderingChoice[self["ordering"]]
+        except KeyError:
+            return OrderingChoice.due
+
+    @property
+    def custom_sort_field(self) -> str:
+        """Return the custom sort field name."""
+        return self["custom_sort_field"]
+
+    @property
+    def show_duplicate_notes_button(self) -> bool:
+        """Return whether the Duplicate Notes browser action is shown."""
+        return bool(self["show_duplicate_notes_button"])
+
+    @property
+    def duplicate_notes_shortcut(self) -> str:
+        """Return the keyboard shortcut for duplicating notes."""
+        return self["duplicate_notes_shortcut"]
+
+    @property
+    def apply_when_searching_duplicates(self) -> bool:
+        """Return whether duplicate search should use Merge Notes comparisons."""
+        return bool(self["apply_when_searching_duplicates"])
+
+    def snapshot(self) -> "ConfigSnapshot":
+        """Return a read-only copy of the current settings, to be used by one operation."""
+        return ConfigSnapshot(self)
+
+
+class ConfigSnapshot:
+    """
+    Read-only copy of the settings used by merging, ordering and duplicate search, taken when an operation starts.
+    Settings are plain attributes named like the properties of ConfigView, with enums already resolved,
+    so inner loops don't look them up in the config dict,
+    and changes made in the settings dialog don't affect an operation that is already running.
+    """
+
+    __slots__ = (
+        "original_notes_action",
+        "field_separator",
+        "separator",
+        "avoid_content_loss",
+        "sort_order",
+        "ordering",
+        "custom_sort_field",
+        "merge_tags",
+        "skip_if_not_empty",
+        "merge_by_segments",
+        "limit_to_fields",
+        "ignore_html_tags",
+        "ignore_furigana",
+        "ignore_punctuation",
+        "punctuation_characters",
+        "full_width_as_half_width",
+        "normalizer",
+        "normalized_values",
+        "duplicate_key_fields",
+        "near_duplicate_search",
+        "near_duplicate_threshold",
+        "persistent_duplicate_index",
+        "parallel_duplicate_search",
+        "parallel_min_notes",
+        "fingerprint_duplicate_search",
+        "live_duplicate_check",
+        "live_duplicate_fields",
+        "merge_duplicates_batch_size",
+        "duplicate_notes_batch_size",
+        "preview_max_diffs",
+        "instrumentation",
+        "instrumentation_trace_memory",
+    )
+    original_notes_action: OriginalNotesAction
+    field_separator: str
+    separator: str
+    avoid_content_loss: bool
+    sort_order: SortOrder
+    ordering: OrderingChoice
+    custom_sort_field: str
+    merge_tags: bool
+    skip_if_not_empty: bool
+    merge_by_segments: bool
+    limit_to_fields: frozenset[str]
+    ignore_html_tags: bool
+    ignore_furigana: bool
+    ignore_punctuation: bool
+    punctuation_characters: str
+    full_width_as_half_width: bool
+    normalizer: Normalizer
+    normalized_values: NormalizedValueCache
+    duplicate_key_fields: tuple[str, ...]
+    near_duplicate_search: bool
+    near_duplicate_threshold: float
+    persistent_duplicate_index: bool
+    parallel_duplicate_search: bool
+    parallel_min_notes: int
+    fingerprint_duplicate_search: bool
+    live_duplicate_check: bool
+    live_duplicate_fields: tuple[str, ...]
+    merge_duplicates_batch_size: int
+    duplicate_notes_batch_size: int
+    preview_max_diffs: int
+    instrumentation: bool
+    instrumentation_trace_memory: bool
+
+    def __init__(self, cfg: ConfigView) -> None:
+        """Copy the settings of cfg."""
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(cfg, name))
+        object.__setattr__(self, "limit_to_fields", frozenset(cfg.limit_to_fields))
+        object.__setattr__(self, "duplicate_key_fields", tuple(cfg.duplicate_key_fields))
+        object.__setattr__(self, "live_duplicate_fields", tuple(cfg.live_duplicate_fields))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        """Refuse changes. The snapshot is shared by everything that runs in one operation."""
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name: str) -> None:
+        """Refuse deleting settings."""
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def snapshot(self) -> "ConfigSnapshot":
+        """Return self, the snapshot can't change."""
+        return self
+
+
+# Operations accept either the live config or a snapshot and take a snapshot of it when they start.
+AnyConfig = Union[ConfigView, ConfigSnapshot]
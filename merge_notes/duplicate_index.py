@@ -0,0 +1,196 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import os
+import sqlite3
+import threading
+from collections.abc import Callable, Sequence
+from typing import Optional
+
+from anki.collection import Collection
+from anki.notes import Note, NoteId
+from anki.utils import ids2str
+
+from .anki_env import anki_mw, user_files_dir
+from .bulk_reader import BATCH_SIZE, batched, database, field_values
+from .progress import ProgressReporter
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS entries (
+    nid INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    mid INTEGER NOT NULL,
+    mod INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (nid, field)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_by_value ON entries (field, value);
+"""
+
+
+class DuplicateIndex:
+    """
+    Sidecar SQLite database that maps (field, normalized value) to note IDs.
+    Each entry remembers the note's modification time, so only notes changed since the last search
+    have to be normalized again. All entries are dropped when the comparison settings change.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Open (or create) the index file."""
+        # Searches run in background threads, while note hooks fire on the main thread.
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(INDEX_SCHEMA)
+        self._db.execute("CREATE TEMP TABLE scope (nid INTEGER PRIMARY KEY, pos INTEGER NOT NULL)")
+
+    def close(self) -> None:
+        """Close the index file."""
+        with self._lock:
+            self._db.close()
+
+    def fingerprint(self) -> Optional[str]:
+        """Return the fingerprint of the normalizer the index was built with."""
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        return row[0] if row else None
+
+    def ensure_fingerprint(self, fingerprint: str) -> None:
+        """Drop all entries if they were computed with different comparison settings."""
+        with self._lock:
+            if self.fingerprint() != fingerprint:
+                self._db.execute("DELETE FROM entries")
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (fingerprint,))
+                self._db.commit()
+
+    def indexed_fields(self) -> list[str]:
+        """Return names of fields that have been indexed."""
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT field FROM entries")]
+
+    def refresh(
+        self,
+        col: Collection,
+        nids: Sequence[NoteId],
+        field_name: str,
+        normalize: Callable[[str], str],
+        progress: ProgressReporter,
+        batch_size: int = BATCH_SIZE,
+    ) -> tuple[int, int]:
+        """
+        Bring entries of the given notes up to date.
+        Return the number of notes that are up to date and the number of notes normalized again.
+        Only notes whose modification time differs from the indexed one are read and normalized.
+        Stop early if the user cancels. Notes are processed in order, so the first notes are the up-to-date ones.
+        """
+        n_stale = 0
+        done = 0
+        for batch in batched(nids, batch_size):
+            if progress.want_cancel():
+                break
+            current = database(col).all(f"SELECT id, mid, mod FROM notes WHERE id IN {ids2str(batch)}")
+            with self._lock:
+                indexed = dict(
+                    self._db.execute(
+                        f"SELECT nid, mod FROM entries WHERE field = ? AND nid IN {ids2str(batch)}",
+                        (field_name,),
+                    )
+                )
+            stale = {nid: (mid, mod) for nid, mid, mod in current if indexed.get(nid) != mod}
+            if stale:
+                # Notes without the field are indexed with an empty value so that they aren't read again.
+                values = dict(field_values(col, list(stale), field_name))
+                with self._lock:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO entries (nid, field, mid, mod, value) VALUES (?, ?, ?, ?, ?)",
+                        (
+                            (nid, field_name, mid, mod, normalize(values[nid]) if nid in values else "")
+                            for nid, (mid, mod) in stale.items()
+                        ),
+                    )
+                    self._db.commit()
+                n_stale += len(stale)
+            done += len(batch)
+            progress.update(f"Updating duplicate index: {done}/{len(nids)} notes", done)
+        return done, n_stale
+
+    def duplicates(self, nids: Sequence[NoteId], field_name: str) -> list[tuple[str, list[NoteId]]]:
+        """
+        Return groups of at least two of the given notes that share a non-empty normalized value.
+        Groups and the notes in them are in the order of nids, like the groups found by scanning the notes.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM scope")
+            self._db.executemany(
+                "INSERT OR IGNORE INTO scope (nid, pos) VALUES (?, ?)", ((nid, pos) for pos, nid in enumerate(nids))
+            )
+            rows = self._db.execute(
+                """
+                SELECT e.value, group_concat(e.nid)
+                FROM entries AS e JOIN scope AS s ON s.nid = e.nid
+                WHERE e.field = ? AND e.value != ''
+                GROUP BY e.value
+                HAVING count(*) >= 2
+                ORDER BY min(s.pos)
+                """,
+                (field_name,),
+            ).fetchall()
+            position = dict(self._db.execute("SELECT nid, pos FROM scope")) if rows else {}
+            self._db.execute("DELETE FROM scope")
+        return [
+            (value, sorted((NoteId(int(nid)) for nid in group.split(",")), key=position.__getitem__))
+            for value, group in rows
+        ]
+
+    def add_note(self, note: Note, mod: int, normalize: Callable[[str], str]) -> None:
+        """Index a newly added note for every field that is already indexed."""
+        fields = [(field_name, note[field_name]) for field_name in self.indexed_fields() if field_name in note]
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO entries (nid, field, mid, mod, value) VALUES (?, ?, ?, ?, ?)",
+                ((note.id, field_name, note.mid, mod, normalize(value)) for field_name, value in fields),
+            )
+            self._db.commit()
+
+    def remove_notes(self, nids: Sequence[NoteId]) -> None:
+        """Forget deleted notes."""
+        with self._lock:
+            self._db.execute(f"DELETE FROM entries WHERE nid IN {ids2str(nids)}")
+            self._db.commit()
+
+
+def index_path() -> str:
+    """Return the path of the index file of the current profile, in the add-on's user_files folder."""
+    mw = anki_mw()
+    assert mw, "Anki should be open."
+    return os.path.join(user_files_dir(), f"duplicate_index_{mw.pm.name}.sqlite")
+
+
+class ProfileIndex:
+    """Opens the index of the current profile on first use and closes it when the profile closes."""
+
+    def __init__(self, path: Callable[[], str] = index_path) -> None:
+        """Start without an open index. The path function is called when the index is opened."""
+        self._path = path
+        self._index: Optional[DuplicateIndex] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> DuplicateIndex:
+        """Return the index of the current profile."""
+        with self._lock:
+            if self._index is None:
+                self._index = DuplicateIndex(self._path())
+            return self._index
+
+    def is_open(self) -> bool:
+        """Return whether the index has been opened."""
+        return self._index is not None
+
+    def close(self) -> None:
+        """Close the index, if it's open."""
+        with self._lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
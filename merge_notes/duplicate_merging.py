@@ -0,0 +1,169 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import time
+from collections.abc import Callable, Sequence
+from typing import Any, Optional
+
+import anki.errors
+from anki.collection import Collection, OpChanges
+from anki.notes import Note, NoteId
+
+from .bulk_reader import CardRow, batched, load_cards, load_notes
+from .config_types import SortOrder
+from .merging import MergeNotes
+from .ordering import CardOrdering
+from .preview import MergePreview, snapshot_notes
+from .progress import ProgressReporter, format_eta, new_progress
+
+
+def carefully_get_notes(col: Collection, nids: Sequence[NoteId], has_field: Optional[str] = None) -> list[Note]:
+    """
+    Returns notes constructed from nids. Skip nonexistent notes.
+    If "has_field" is not None, return notes that contain this field.
+    """
+    ret: list[Note] = []
+    for nid in frozenset(nids):
+        try:
+            note: Note = col.get_note(nid)
+            if not has_field or has_field in note.keys():
+                ret.append(note)
+        except anki.errors.NotFoundError:
+            pass
+    return ret
+
+
+class MergeReport:
+    """Outcome of merging duplicate groups. Anki reads the collection changes from the changes attribute."""
+
+    def __init__(self, n_groups: int) -> None:
+        """Start with nothing merged out of n_groups groups."""
+        self.changes = OpChanges()
+        self.n_groups = n_groups
+        self.n_groups_done = 0
+        self.n_notes_updated = 0
+        self.n_notes_removed = 0
+        self.n_notes_suspended = 0
+        self.cancelled = False
+
+    def summary(self) -> str:
+        """Return a message describing what was merged."""
+        if self.cancelled:
+            return (
+                f"Cancelled. Merged {self.n_groups_done} of {self.n_groups} groups of notes, "
+                f"{self.n_notes_updated} notes updated, {self.n_notes_removed} removed, "
+                f"{self.n_notes_suspended} suspended."
+            )
+        return f"Merged {self.n_groups_done} groups of notes."
+
+
+PREVIEW_ACTION_NAME = "Preview Merge"
+
+
+class MergeDupes(MergeNotes):
+    """Merge duplicate-note groups reported by Anki."""
+
+    action_name = "Merge Duplicates"
+
+    def _sort_key(self, cards: dict[NoteId, list[CardRow]]) -> Callable[[Note], Any]:
+        """Return a key that orders notes by the smallest configured sort key among their cards."""
+        ord_key = CardOrdering(self.col, self._cfg).key
+        return lambda note: min(ord_key(card) for card in cards[note.id])
+
+    def merge_groups(
+        self, dupes: list[tuple[str, list[NoteId]]], progress: Optional[ProgressReporter] = None
+    ) -> MergeReport:
+        """
+        Merge duplicate groups in batches and return a report with the collection changes.
+        Each batch is written before the next one is read, and all batches share one undo entry.
+        If the user cancels, batches that are already written are kept.
+        """
+        progress = progress or new_progress()
+        pos = self.col.add_custom_undo_entry(self.action_name)
+        report = MergeReport(len(dupes))
+        started = time.monotonic()
+        progress.start(f"Merging {len(dupes)} groups of notes", len(dupes))
+        try:
+            for batch in batched(dupes, self._cfg.merge_duplicates_batch_size):
+                if progress.want_cancel():
+                    report.cancelled = True
+                    break
+                self._merge_batch(batch, self._load_batch(batch))
+                self._write_batch(report)
+                report.n_groups_done += len(batch)
+                progress.update(
+                    f"Merged {report.n_groups_done}/{len(dupes)} groups of notes. "
+                    f"{format_eta(time.monotonic() - started, report.n_groups_done, len(dupes))}",
+                    report.n_groups_done,
+                )
+            report.changes = self.col.merge_undo_entries(pos)
+        finally:
+            progress.finish()
+            self._profiler.count("groups", report.n_groups_done)
+            self._profiler.count("notes_updated", report.n_notes_updated)
+            self._profiler.count("notes_removed", report.n_notes_removed)
+            self._profiler.count("notes_suspended", report.n_notes_suspended)
+            self._profiler.finish()
+        return report
+
+    def _load_batch(self, batch: Sequence[tuple[str, list[NoteId]]]) -> dict[NoteId, Note]:
+        """Read all notes of a batch of duplicate groups with one query per batch."""
+        with self._profiler.phase("load_notes"):
+            return load_notes(self.col, list(frozenset(nid for _, dupe_nids in batch for nid in dupe_nids)))
+
+    def _merge_batch(self, batch: Sequence[tuple[str, list[NoteId]]], notes: dict[NoteId, Note]) -> None:
+        """Merge a batch of duplicate groups in memory. Card attributes are read in bulk."""
+        with self._profiler.phase("load_cards"):
+            sort_key = self._sort_key(load_cards(self.col, notes))
+        reverse = self._cfg.sort_order is SortOrder.descending
+        with self._profiler.phase("sort_and_merge"):
+            for _, dupe_nids in batch:
+                # Same order as carefully_get_notes, so that notes with equal sort keys keep their order.
+                if len(chunk := [notes[nid] for nid in frozenset(dupe_nids) if nid in notes]) > 1:
+                    chunk.sort(key=sort_key, reverse=reverse)
+                    self._do_merge(chunk)
+
+    def preview_groups(
+        self,
+        dupes: list[tuple[str, list[NoteId]]],
+        max_diffs: int = 0,
+        progress: Optional[ProgressReporter] = None,
+    ) -> MergePreview:
+        """
+        Return what merging the duplicate groups would change, without writing anything.
+        Stops early if the user cancels, and then covers only the groups processed so far.
+        """
+        progress = progress or new_progress()
+        preview = MergePreview(max_diffs)
+        progress.start(f"Previewing merge of {len(dupes)} groups of notes", len(dupes))
+        try:
+            for batch in batched(dupes, self._cfg.merge_duplicates_batch_size):
+                if progress.want_cancel():
+                    break
+                notes = self._load_batch(batch)
+                before = snapshot_notes(notes.values())
+                self._merge_batch(batch, notes)
+                preview.record(before, self.notes_to_update, self.nids_to_remove, self.nids_to_suspend)
+                self.notes_to_update.clear()
+                self.nids_to_remove.clear()
+                self.nids_to_suspend.clear()
+                preview.n_groups += len(batch)
+                progress.update(f"Previewed {preview.n_groups}/{len(dupes)} groups of notes", preview.n_groups)
+        finally:
+            progress.finish()
+        return preview
+
+    def _write_batch(self, report: MergeReport) -> None:
+        """Save the merged batch and forget it, so that memory use doesn't grow with the number of groups."""
+        with self._profiler.phase("update_notes"):
+            self.col.update_notes(self.notes_to_update)
+        with self._profiler.phase("remove_notes"):
+            self.col.remove_notes(self.nids_to_remove)
+        with self._profiler.phase("suspend_cards"):
+            self._suspend_cards_of_notes()
+        report.n_notes_updated += len(self.notes_to_update)
+        report.n_notes_removed += len(self.nids_to_remove)
+        report.n_notes_suspended += len(self.nids_to_suspend)
+        self.notes_to_update.clear()
+        self.nids_to_remove.clear()
+        self.nids_to_suspend.clear()
@@ -1,68 +1,149 @@
 # Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
+import time
 from collections.abc import Sequence
+from typing import Optional
 
+from anki.cards import CardId
 from anki.collection import AddNoteRequest, Collection, OpChanges
-from anki.decks import DeckId
-from anki.notes import Note
+from anki.notes import Note, NoteId
 from aqt import gui_hooks
 from aqt.browser import Browser
 from aqt.operations import CollectionOp
 from aqt.qt import *
 from aqt.utils import tooltip
 
+from .bulk_reader import (
+    NoteBuilder,
+    batched,
+    home_deck_ids,
+    load_notes,
+    note_ids_of_cards,
+)
 from .config import MergeNotesConfig, get_global_config
-from .merge_notes import notes_by_cards
+from .config_view import AnyConfig
+from .instrumentation import NullProfiler, Profiler, new_profiler
+from .progress import ProgressReporter, format_eta, new_progress
 
+# Tags that mark the state of a particular note and aren't copied.
+NOT_COPIED_TAGS = frozenset(("leech", "marked"))
+MAX_COPIES = 1000
 
-def n_gettext_duplicate(n_notes: int, is_done: bool) -> str:
+
+def n_gettext_duplicate(n_notes: int, is_done: bool, copies: int = 1) -> str:
     """Return the status text for duplicating notes."""
-    return f"Duplicate{'d' if is_done else ''} {n_notes} note{'s' if n_notes > 1 else ''}"
+    return (
+        f"Duplicate{'d' if is_done else ''} {n_notes} note{'s' if n_notes > 1 else ''}"
+        f"{f' {copies} times' if copies > 1 else ''}"
+    )
 
 
-def find_deck_id(note: Note) -> DeckId:
-    """Return the deck ID that should receive a duplicate of the note."""
-    first_card = note.cards()[0]
-    return first_card.odid or first_card.did
+class DuplicateReport:
+    """Outcome of duplicating notes. Anki reads the collection changes from the changes attribute."""
 
+    def __init__(self, n_notes: int, copies: int) -> None:
+        """Start with no copies added out of copies of each of n_notes notes."""
+        self.changes = OpChanges()
+        self.n_notes = n_notes
+        self.copies = copies
+        self.n_added = 0
+        self.cancelled = False
 
-def duplicate_notes_op(col: Collection, notes: Sequence[Note]) -> OpChanges:
-    """Duplicate notes and return the resulting collection changes."""
-    pos = col.add_custom_undo_entry(n_gettext_duplicate(len(notes), is_done=False))
-    requests: list[AddNoteRequest] = []
-    for ref_note in notes:
-        new_note = Note(col, ref_note.note_type())
-        for key in ref_note.keys():
-            new_note[key] = ref_note[key]
-        new_note.tags = [tag for tag in ref_note.tags if tag != "leech" and tag != "marked"]
-        requests.append(AddNoteRequest(note=new_note, deck_id=find_deck_id(ref_note)))
-    col.add_notes(requests)
-    return col.merge_undo_entries(pos)
+    def summary(self) -> str:
+        """Return a message describing what was added."""
+        if self.cancelled:
+            return f"Cancelled. Added {self.n_added} of {self.n_notes * self.copies} notes."
+        return n_gettext_duplicate(self.n_notes, is_done=True, copies=self.copies)
 
 
-def get_notes_keeping_order(browser: Browser) -> list[Note]:
+class NoteDuplicator:
+    """
+    Adds copies of notes in batches.
+    Notes and their decks are read in bulk, and copies are built without a backend call per note.
     """
-    Retrieve notes in the order they're shown in Browser.
+
+    def __init__(self, col: Collection, cfg: AnyConfig, profiler: Profiler = NullProfiler()) -> None:
+        """Store the collection and a snapshot of the config that sets the batch size."""
+        self.col = col
+        self._cfg = cfg.snapshot()
+        self._profiler = profiler
+        self._builder = NoteBuilder(col)
+
+    def _copy_of(self, ref_note: Note) -> Note:
+        """Return a new note with the fields and tags of ref_note, without a backend call per note."""
+        return self._builder.copy_of(ref_note, [tag for tag in ref_note.tags if tag not in NOT_COPIED_TAGS])
+
+    def op(
+        self, nids: Sequence[NoteId], copies: int = 1, progress: Optional[ProgressReporter] = None
+    ) -> DuplicateReport:
+        """
+        Add copies of each note to the deck of its first card and return a report with the collection changes.
+        The notes are copied in the given order, then in the same order again for each further copy.
+        All batches share one undo entry. If the user cancels, batches that are already added are kept.
+        """
+        progress = progress or new_progress()
+        try:
+            with self._profiler.phase("load_notes"):
+                by_id = load_notes(self.col, nids)
+                notes = [by_id[nid] for nid in nids if nid in by_id]
+            with self._profiler.phase("find_decks"):
+                deck_ids = home_deck_ids(self.col, [note.id for note in notes])
+            report = DuplicateReport(len(notes), copies)
+            total = len(notes) * copies
+            pos = self.col.add_custom_undo_entry(n_gettext_duplicate(len(notes), is_done=False, copies=copies))
+            started = time.monotonic()
+            progress.start(f"Duplicating {len(notes)} notes", total)
+            for batch in batched(range(total), self._cfg.duplicate_notes_batch_size):
+                if progress.want_cancel():
+                    report.cancelled = True
+                    break
+                with self._profiler.phase("build_notes"):
+                    requests: list[AddNoteRequest] = []
+                    for idx in batch:
+                        ref_note = notes[idx % len(notes)]
+                        requests.append(AddNoteRequest(note=self._copy_of(ref_note), deck_id=deck_ids[ref_note.id]))
+                with self._profiler.phase("add_notes"):
+                    self.col.add_notes(requests)
+                report.n_added += len(requests)
+                progress.update(
+                    f"Added {report.n_added}/{total} notes. "
+                    f"{format_eta(time.monotonic() - started, report.n_added, total)}",
+                    report.n_added,
+                )
+            report.changes = self.col.merge_undo_entries(pos)
+            self._profiler.count("notes", report.n_added)
+            return report
+        finally:
+            progress.finish()
+            self._profiler.finish()
+
+
+def duplicate_notes(
+    browser: Browser,
+    cfg: MergeNotesConfig,
+    copies: int = 1,
+    profiler: Profiler = NullProfiler(),
+) -> None:
     """
+    Duplicate notes selected in the browser, keeping the order they're shown in.
+    Only the selection is read on the main thread. Notes are read in the background.
+    """
+    nids: Sequence[NoteId]
+    cids: Sequence[CardId]
     if browser.table.is_notes_mode():
-        return [browser.col.get_note(note_id) for note_id in browser.selected_notes()]
+        nids, cids = browser.selected_notes(), []
     else:
-        return notes_by_cards(browser.col.get_card(card_id) for card_id in browser.selected_cards())
-
+        nids, cids = [], browser.selected_cards()
 
-def duplicate_notes(browser: Browser) -> None:
-    """Duplicate notes selected in the browser."""
-    notes: list[Note] = get_notes_keeping_order(browser)
-
-    if len(notes) > 0:
+    if nids or cids:
         (
             CollectionOp(
                 parent=browser,
-                op=lambda col: duplicate_notes_op(col, notes),
+                op=lambda col: NoteDuplicator(col, cfg, profiler).op(nids or note_ids_of_cards(col, cids), copies),
             )
             .success(
-                lambda out: tooltip(msg=n_gettext_duplicate(len(notes), is_done=True), parent=browser),
+                lambda report: tooltip(msg=report.summary(), parent=browser),
             )
             .run_in_background()
         )
@@ -78,13 +159,26 @@ class ContextMenus:
         self._cfg = cfg
 
     def setup_context_menu(self, browser: Browser) -> None:
-        """Add the Duplicate Notes action to the browser context menu."""
+        """Add the Duplicate Notes actions to the browser context menu."""
         if self._cfg.show_duplicate_notes_button:
             menu = browser.form.menu_Cards
             action = menu.addAction("Duplicate notes")
             if shortcut := self._cfg.duplicate_notes_shortcut:
                 action.setShortcut(QKeySequence(shortcut))
-            qconnect(action.triggered, lambda: duplicate_notes(browser))
+            qconnect(
+                action.triggered,
+                lambda: duplicate_notes(browser, self._cfg, profiler=new_profiler(self._cfg, "Duplicate notes")),
+            )
+            qconnect(
+                menu.addAction("Duplicate notes several times...").triggered,
+                lambda: self._duplicate_several_times(browser),
+            )
+
+    def _duplicate_several_times(self, browser: Browser) -> None:
+        """Ask how many copies of each selected note to add, then add them."""
+        copies, ok = QInputDialog.getInt(browser, "Duplicate notes", "Copies of each note:", 2, 1, MAX_COPIES)
+        if ok:
+            duplicate_notes(browser, self._cfg, copies, new_profiler(self._cfg, "Duplicate notes"))
 
 
 def init() -> None:
@@ -0,0 +1,300 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import hashlib
+import itertools
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from concurrent.futures import BrokenExecutor
+from typing import Optional, TypeVar
+
+from anki.collection import Collection, SearchNode
+from anki.notes import Note, NoteId
+
+from .bulk_reader import (
+    FIELD_SEPARATOR,
+    database,
+    field_value_batches,
+    field_values,
+    multi_field_value_batches,
+)
+from .config_view import AnyConfig, ConfigSnapshot
+from .duplicate_index import ProfileIndex
+from .fingerprints import numpy_available, repeated_fingerprints
+from .instrumentation import Profiler, new_profiler
+from .near_duplicates import find_near_duplicates
+from .parallel import group_in_parallel
+from .progress import ProgressReporter, new_progress
+
+T = TypeVar("T")
+
+# Notes read between two progress updates and cancellation checks.
+SEARCH_BATCH_SIZE = 5_000
+# Values of multi-field keys are joined with this string when shown in the Find Duplicates dialog.
+KEY_DISPLAY_SEPARATOR = " | "
+
+
+def search_note_ids(col: Collection, field_name: str, search: str) -> Sequence[NoteId]:
+    """Return IDs of notes matching the duplicate-search field and query."""
+    return col.find_notes(query=col.build_search_string(search, SearchNode(field_name=field_name)))
+
+
+def report_batches(batches: Iterable[list[T]], total: int, progress: ProgressReporter) -> Iterator[list[T]]:
+    """
+    Pass batches of SEARCH_BATCH_SIZE notes through and report progress after each batch.
+    Stop early if the user cancels.
+    """
+    done = 0
+    for batch in batches:
+        if progress.want_cancel():
+            return
+        yield batch
+        done = min(done + SEARCH_BATCH_SIZE, total)
+        progress.update(f"Searching duplicates: {done}/{total} notes", done)
+
+
+def read_field_batches(
+    col: Collection,
+    nids: Sequence[NoteId],
+    field_name: str,
+    progress: ProgressReporter,
+) -> Iterator[list[tuple[NoteId, str]]]:
+    """Yield batches of (note id, field value) pairs, reporting progress and stopping early if the user cancels."""
+    return report_batches(field_value_batches(col, nids, field_name, batch_size=SEARCH_BATCH_SIZE), len(nids), progress)
+
+
+def normalize_values(
+    pairs: Iterable[tuple[NoteId, str]], normalize: Callable[[str], str]
+) -> Iterator[tuple[NoteId, str]]:
+    """Yield (note id, normalized value) pairs, dropping values that are empty after normalization."""
+    for nid, value in pairs:
+        if val := normalize(value):
+            yield nid, val
+
+
+def read_key_batches(
+    col: Collection,
+    nids: Sequence[NoteId],
+    field_names: Sequence[str],
+    progress: ProgressReporter,
+) -> Iterator[list[tuple[NoteId, tuple[str, ...]]]]:
+    """Yield batches of (note id, values of all key fields) pairs read in a single scan over the notes."""
+    batches = multi_field_value_batches(col, nids, field_names, batch_size=SEARCH_BATCH_SIZE)
+    return report_batches(batches, len(nids), progress)
+
+
+def normalize_keys(
+    records: Iterable[tuple[NoteId, tuple[str, ...]]], normalize: Callable[[str], str]
+) -> Iterator[tuple[NoteId, tuple[str, ...]]]:
+    """
+    Yield (note id, normalized values) pairs.
+    Notes whose first key field is empty after normalization are dropped, the other fields may be empty.
+    """
+    for nid, values in records:
+        if (key := tuple(normalize(value) for value in values))[0]:
+            yield nid, key
+
+
+def key_digest(values: Sequence[str]) -> bytes:
+    """Return a compact hash of a multi-field key. Fields can't contain the field separator, so joining is safe."""
+    return hashlib.blake2b(FIELD_SEPARATOR.join(values).encode("utf-8"), digest_size=16).digest()
+
+
+def group_by_key(records: Iterable[tuple[NoteId, tuple[str, ...]]]) -> list[tuple[str, list[NoteId]]]:
+    """
+    Group note IDs by multi-field key and return (label, note IDs) pairs.
+    Groups are looked up by the key's hash, so the full key is only kept once per group, for display.
+    Different keys can have equal labels, e.g. ("a | b", "c") and ("a", "b | c"), so labels are never used as keys.
+    """
+    labels: dict[bytes, str] = {}
+    groups: dict[bytes, list[NoteId]] = {}
+    for nid, key in records:
+        digest = key_digest(key)
+        if digest not in groups:
+            labels[digest] = KEY_DISPLAY_SEPARATOR.join(key)
+            groups[digest] = []
+        groups[digest].append(nid)
+    return [(labels[digest], nids) for digest, nids in groups.items()]
+
+
+def group_by_value(pairs: Iterable[tuple[NoteId, str]]) -> dict[str, list[NoteId]]:
+    """Group note IDs by value."""
+    vals: dict[str, list[NoteId]] = {}
+    for nid, val in pairs:
+        vals.setdefault(val, []).append(nid)
+    return vals
+
+
+def duplicate_groups(groups: Iterable[tuple[str, list[NoteId]]]) -> list[tuple[str, list[NoteId]]]:
+    """Return the (label, note IDs) groups that have at least two notes."""
+    return [(dupe_str, dupe_list) for dupe_str, dupe_list in groups if len(dupe_list) >= 2]
+
+
+class PartialDuplicateGroups(list[tuple[str, list[NoteId]]]):
+    """Groups found before the user cancelled the search. The Find Duplicates dialog marks them as incomplete."""
+
+
+class DuplicateSearch:
+    """
+    Finds duplicate notes by their normalized field values.
+    Used by the Find Duplicates dialog and by the command-line tool, so it doesn't depend on aqt.
+    """
+
+    def __init__(self, cfg: AnyConfig, index: Optional[ProfileIndex] = None) -> None:
+        """Store the config and the persistent index used by searches."""
+        self._cfg = cfg
+        self._index = index or ProfileIndex()
+
+    def find(
+        self,
+        col: Collection,
+        field_name: str,
+        search: str,
+        progress: Optional[ProgressReporter] = None,
+    ) -> list[tuple[str, list]]:
+        """
+        Find duplicate notes after normalizing field values.
+        Notes are streamed through the pipeline in batches, so only the group map is kept in memory.
+        If the user cancels, groups found so far are returned as PartialDuplicateGroups.
+        """
+        progress = progress or new_progress()
+        cfg = self._cfg.snapshot()
+        profiler = new_profiler(cfg, "Find duplicates")
+        with profiler.phase("search_notes"):
+            nids = search_note_ids(col, field_name, search)
+        profiler.count("notes", len(nids))
+        key_fields = self._key_fields(cfg, field_name)
+        progress.start(f"Searching duplicates in {len(nids)} notes", len(nids))
+        try:
+            with profiler.phase("group"):
+                groups = self._group_duplicates(col, cfg, nids, field_name, key_fields, progress, profiler)
+            return PartialDuplicateGroups(groups) if progress.cancelled else groups
+        finally:
+            progress.finish()
+            profiler.finish()
+
+    def _group_duplicates(
+        self,
+        col: Collection,
+        cfg: ConfigSnapshot,
+        nids: Sequence[NoteId],
+        field_name: str,
+        key_fields: list[str],
+        progress: ProgressReporter,
+        profiler: Profiler,
+    ) -> list[tuple[str, list]]:
+        """Group the found notes with the search mode selected in the config."""
+        if len(key_fields) > 1:
+            return duplicate_groups(
+                group_by_key(
+                    normalize_keys(
+                        itertools.chain.from_iterable(
+                            profiler.iterate("read_fields", read_key_batches(col, nids, key_fields, progress))
+                        ),
+                        cfg.normalized_values,
+                    )
+                )
+            )
+        if cfg.near_duplicate_search:
+            return find_near_duplicates(
+                normalize_values(
+                    itertools.chain.from_iterable(
+                        profiler.iterate("read_fields", read_field_batches(col, nids, field_name, progress))
+                    ),
+                    cfg.normalized_values,
+                ),
+                threshold=cfg.near_duplicate_threshold,
+            )
+        if cfg.persistent_duplicate_index:
+            return self._search_with_index(col, cfg, nids, field_name, progress)
+        if cfg.parallel_duplicate_search and len(nids) >= cfg.parallel_min_notes:
+            try:
+                return duplicate_groups(
+                    group_in_parallel(
+                        profiler.iterate("read_fields", read_field_batches(col, nids, field_name, progress)),
+                        cfg.normalizer,
+                        progress,
+                    ).items()
+                )
+            except (BrokenExecutor, OSError, ImportError):
+                # Worker processes can fail to start or to import the add-on,
+                # e.g. when Anki's executable isn't a plain Python interpreter.
+                # Search in this process instead, through the shared cache of normalized values.
+                profiler.count("parallel_search_failed")
+                progress.notify("Couldn't start worker processes. Searching duplicates in one process.")
+        # NumPy isn't bundled with Anki. Without it, values are grouped as usual.
+        if cfg.fingerprint_duplicate_search and numpy_available():
+            return self._search_with_fingerprints(col, cfg, nids, field_name, progress, profiler)
+        return duplicate_groups(
+            group_by_value(
+                normalize_values(
+                    itertools.chain.from_iterable(
+                        profiler.iterate("read_fields", read_field_batches(col, nids, field_name, progress))
+                    ),
+                    cfg.normalized_values,
+                )
+            ).items()
+        )
+
+    def _search_with_fingerprints(
+        self,
+        col: Collection,
+        cfg: ConfigSnapshot,
+        nids: Sequence[NoteId],
+        field_name: str,
+        progress: ProgressReporter,
+        profiler: Profiler,
+    ) -> list[tuple[str, list]]:
+        """
+        Find notes whose normalized values share a fingerprint, then group only them by their real values.
+        Gives the same groups, in the same order, as grouping all values.
+        """
+        candidates = repeated_fingerprints(
+            normalize_values(
+                itertools.chain.from_iterable(
+                    profiler.iterate("read_fields", read_field_batches(col, nids, field_name, progress))
+                ),
+                cfg.normalized_values,
+            )
+        )
+        profiler.count("candidates", len(candidates))
+        with profiler.phase("verify_candidates"):
+            values = dict(normalize_values(field_values(col, candidates, field_name), cfg.normalized_values))
+            return duplicate_groups(group_by_value((nid, values[nid]) for nid in candidates if nid in values).items())
+
+    def _key_fields(self, cfg: ConfigSnapshot, field_name: str) -> list[str]:
+        """Return the fields compared by the search: the field chosen in the dialog, then the extra key fields."""
+        return list(dict.fromkeys((field_name, *cfg.duplicate_key_fields)))
+
+    def _search_with_index(
+        self,
+        col: Collection,
+        cfg: ConfigSnapshot,
+        nids: Sequence[NoteId],
+        field_name: str,
+        progress: ProgressReporter,
+    ) -> list[tuple[str, list]]:
+        """
+        Update the persistent index for notes that changed since the last search, then group from it.
+        If the user cancels, only the notes that were brought up to date are grouped.
+        """
+        index = self._index.get()
+        index.ensure_fingerprint(repr(cfg.normalizer.fingerprint))
+        n_done, _ = index.refresh(col, nids, field_name, cfg.normalized_values, progress)
+        return index.duplicates(nids[:n_done], field_name)
+
+    def add_note(self, col: Collection, note: Note) -> None:
+        """Add a new note to the persistent index, if the index is used and already open."""
+        if self._cfg.persistent_duplicate_index and self._index.is_open():
+            index = self._index.get()
+            index.ensure_fingerprint(repr(self._cfg.normalizer.fingerprint))
+            mod = database(col).scalar("SELECT mod FROM notes WHERE id = ?", note.id)
+            index.add_note(note, mod, self._cfg.normalized_values)
+
+    def remove_notes(self, nids: Sequence[NoteId]) -> None:
+        """Remove deleted notes from the persistent index."""
+        if self._index.is_open():
+            self._index.get().remove_notes(nids)
+
+    def close_index(self) -> None:
+        """Close the persistent index."""
+        self._index.close()
@@ -1,64 +1,84 @@
 # Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
-from collections.abc import Iterable
+from collections.abc import Callable, Sequence
+from typing import Optional
 
 import aqt
-from anki.collection import Collection, SearchNode
+from anki import hooks
+from anki.collection import Collection
 from anki.hooks import wrap
 from anki.notes import Note, NoteId
+from aqt import gui_hooks
 from aqt.browser import Browser
 from aqt.browser.find_duplicates import FindDuplicatesDialog
 from aqt.qt import *
+from aqt.utils import tooltip
 
-from .config import ACTION_NAME, MergeNotesConfig, get_global_config
-from .merge_duplicates import carefully_get_notes
-from .merge_notes import cfg_strip
+from .config import MergeNotesConfig, get_global_config
+from .config_view import ACTION_NAME
+from .duplicate_index import ProfileIndex
+from .duplicate_search import DuplicateSearch, PartialDuplicateGroups
 
-
-def notes_from_search(col: Collection, field_name: str, search: str) -> Iterable[Note]:
-    """Return notes matching the duplicate-search field and query."""
-    return carefully_get_notes(
-        col,
-        col.find_notes(query=col.build_search_string(search, SearchNode(field_name=field_name))),
-        has_field=field_name,
-    )
+######################################################################
+# Find Duplicates dialog
+######################################################################
 
 
 class FindDuplicatesMenus:
     """Hooks that enhance Anki's Find Duplicates dialog."""
 
-    def __init__(self, cfg: MergeNotesConfig) -> None:
+    def __init__(self, cfg: MergeNotesConfig, index: Optional[ProfileIndex] = None) -> None:
         """Store the config used by duplicate-search hooks."""
         self._cfg = cfg
+        self._search = DuplicateSearch(cfg, index)
 
     def append_apply_checkbox(self, dialog: FindDuplicatesDialog, _browser: Browser, _mw: aqt.AnkiQt) -> None:
-        """Add a checkbox that toggles Merge Notes duplicate comparison."""
-        # row, column, rowSpan, columnSpan
-        dialog.form.verticalLayout.addWidget(c := QCheckBox(f"Search with {ACTION_NAME}"))
-        c.setChecked(self._cfg.apply_when_searching_duplicates)
+        """Add checkboxes that toggle Merge Notes duplicate comparison."""
+        self._append_checkbox(dialog, f"Search with {ACTION_NAME}", "apply_when_searching_duplicates")
+        self._append_checkbox(dialog, "Include near duplicates", "near_duplicate_search")
+
+    def _append_checkbox(self, dialog: FindDuplicatesDialog, text: str, config_key: str) -> None:
+        """Add a checkbox bound to a boolean config key."""
+        dialog.form.verticalLayout.addWidget(c := QCheckBox(text))
+        c.setChecked(bool(self._cfg[config_key]))
 
         def on_state_changed(checked: int) -> None:
             """Persist the checkbox state in the config."""
             # Ref: https://doc.qt.io/qt-6/qt.html#CheckState-enum
-            self._cfg["apply_when_searching_duplicates"] = bool(checked)
+            self._cfg[config_key] = bool(checked)
 
         qconnect(c.stateChanged, on_state_changed)
 
+    def mark_partial_results(self, dialog: FindDuplicatesDialog, dupes: list[tuple[str, list[NoteId]]]) -> None:
+        """Tell the user that the shown duplicates are incomplete if the search was cancelled."""
+        if isinstance(dupes, PartialDuplicateGroups):
+            tooltip("Search cancelled. Only the duplicates found so far are shown.", parent=dialog)
+
     def find_duplicates(self, col: Collection, field_name: str, search: str, _old: Callable) -> list[tuple[str, list]]:
         """Find duplicates using Merge Notes comparison when enabled."""
         if self._cfg.apply_when_searching_duplicates:
-            return self._deep_search_duplicates(col, field_name, search)
+            return self._search.find(col, field_name, search)
         else:
             return _old(col, field_name, search)
 
-    def _deep_search_duplicates(self, col: Collection, field_name: str, search: str) -> list[tuple[str, list]]:
-        """Find duplicate notes after normalizing field values."""
-        vals: dict[str, list[NoteId]] = {}
-        for note in notes_from_search(col, field_name, search):
-            if val := cfg_strip(note[field_name], self._cfg):
-                vals.setdefault(val, []).append(note.id)
-        return [(dupe_str, dupe_list) for dupe_str, dupe_list in vals.items() if len(dupe_list) >= 2]
+    def on_note_added(self, note: Note) -> None:
+        """Add a note created in the Add dialog to the persistent index."""
+        if aqt.mw and aqt.mw.col:
+            self._search.add_note(aqt.mw.col, note)
+
+    def close_index(self) -> None:
+        """Close the persistent index of the profile that is being closed."""
+        self._search.close_index()
+
+    def on_notes_deleted(self, _col: Collection, nids: Sequence[NoteId]) -> None:
+        """Remove deleted notes from the persistent index."""
+        self._search.remove_notes(nids)
+
+
+######################################################################
+# Entry point
+######################################################################
 
 
 def init() -> None:
@@ -66,13 +86,21 @@ def init() -> None:
     assert aqt.mw, "Anki should be open."
     cfg = get_global_config()
     menus = FindDuplicatesMenus(cfg)
-    Collection.find_dupes = wrap(
+    Collection.find_dupes = wrap(  # type: ignore[method-assign]
         Collection.find_dupes,
         menus.find_duplicates,
         pos="around",
     )
-    FindDuplicatesDialog.__init__ = wrap(
+    FindDuplicatesDialog.__init__ = wrap(  # type: ignore[method-assign]
         FindDuplicatesDialog.__init__,
         menus.append_apply_checkbox,
         pos="after",
     )
+    FindDuplicatesDialog.show_duplicates_report = wrap(  # type: ignore[method-assign]
+        FindDuplicatesDialog.show_duplicates_report,
+        menus.mark_partial_results,
+        pos="after",
+    )
+    gui_hooks.add_cards_did_add_note.append(menus.on_note_added)
+    hooks.notes_will_be_deleted.append(menus.on_notes_deleted)
+    gui_hooks.profile_will_close.append(menus.close_index)
@@ -0,0 +1,59 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Duplicate search that keeps a 64-bit fingerprint of each normalized value instead of the value itself.
+Fingerprints and note IDs are stored in NumPy arrays and grouped by sorting,
+so a scan over a big collection only keeps 16 bytes per note.
+Notes whose fingerprint occurs more than once are then grouped by their real values,
+which separates values that only share a fingerprint.
+"""
+
+from array import array
+from collections.abc import Iterable
+
+from anki.notes import NoteId
+
+try:
+    import numpy as np
+except ImportError:  # NumPy isn't bundled with Anki.
+    HAS_NUMPY = False
+else:
+    HAS_NUMPY = True
+
+
+def numpy_available() -> bool:
+    """Return whether NumPy can be imported."""
+    return HAS_NUMPY
+
+
+def fingerprint(value: str) -> int:
+    """
+    Return a 64-bit fingerprint of a normalized value.
+    Python's string hash is only stable within one process, which is enough for one scan.
+    """
+    return hash(value)
+
+
+def repeated_fingerprints(pairs: Iterable[tuple[NoteId, str]]) -> list[NoteId]:
+    """
+    Return IDs of the notes whose value has the same fingerprint as the value of another note, in scan order.
+    Only fingerprints and note IDs are kept while the pairs are read.
+    """
+    assert HAS_NUMPY, "NumPy is required."
+    nid_buffer = array("q")
+    fingerprint_buffer = array("q")
+    for nid, value in pairs:
+        nid_buffer.append(nid)
+        fingerprint_buffer.append(fingerprint(value))
+    if len(nid_buffer) < 2:
+        return []
+    nids = np.frombuffer(nid_buffer, dtype=np.int64)
+    fingerprints = np.frombuffer(fingerprint_buffer, dtype=np.int64)
+    order = np.argsort(fingerprints, kind="stable")
+    sorted_fingerprints = fingerprints[order]
+    same_as_next = sorted_fingerprints[1:] == sorted_fingerprints[:-1]
+    repeated = np.zeros(len(order), dtype=bool)
+    repeated[1:] |= same_as_next
+    repeated[:-1] |= same_as_next
+    return nids[np.sort(order[repeated])].tolist()
@@ -0,0 +1,181 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections.abc import Iterable, Iterator
+from typing import Any, ContextManager, Optional, TypeVar
+
+from .anki_env import anki_mw, user_files_dir
+from .config_view import ACTION_NAME, AnyConfig
+
+T = TypeVar("T")
+
+LOG_FILE_NAME = "instrumentation.jsonl"
+# Operations shown in the settings dialog.
+MAX_RECENT_OPERATIONS = 10
+
+_recent_operations: collections.deque[dict[str, Any]] = collections.deque(maxlen=MAX_RECENT_OPERATIONS)
+_log_lock = threading.Lock()
+
+
+class PhaseStats:
+    """Accumulated measurements of one phase of an operation."""
+
+    __slots__ = ("seconds", "calls", "peak_bytes")
+
+    def __init__(self) -> None:
+        """Start with nothing measured."""
+        self.seconds = 0.0
+        self.calls = 0
+        self.peak_bytes = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return the measurements as a JSON-compatible dict."""
+        result: dict[str, Any] = {"seconds": round(self.seconds, 6), "calls": self.calls}
+        if self.peak_bytes:
+            result["peak_kib"] = round(self.peak_bytes / 1024, 1)
+        return result
+
+
+class Profiler:
+    """
+    Measures wall time, call counts and, optionally, Python memory peaks of the phases of one operation.
+    Phases may repeat (their measurements add up) and nest. A nested phase resets the memory peak,
+    so the peak of the outer phase only covers the part after the nested phase ends.
+    """
+
+    enabled = True
+
+    def __init__(self, operation: str, trace_memory: bool = False) -> None:
+        """Start measuring an operation."""
+        self.operation = operation
+        self.counters: dict[str, int] = {}
+        self._phases: dict[str, PhaseStats] = {}
+        self._started = time.perf_counter()
+        self._trace_memory = trace_memory
+        self._owns_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._owns_tracing:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def _measure(self, name: str) -> Iterator[None]:
+        """Measure the code run inside the with block as one call of the phase."""
+        stats = self._phases.setdefault(name, PhaseStats())
+        if self._trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats.seconds += time.perf_counter() - start
+            stats.calls += 1
+            if self._trace_memory:
+                stats.peak_bytes = max(stats.peak_bytes, tracemalloc.get_traced_memory()[1])
+
+    def phase(self, name: str) -> ContextManager[None]:
+        """Return a context manager that measures one call of the phase."""
+        return self._measure(name)
+
+    def iterate(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        """Yield items, measuring the time spent producing each of them as one call of the phase."""
+        iterator = iter(items)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Add n to a counter of the operation, e.g. the number of notes processed."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def finish(self) -> Optional[dict[str, Any]]:
+        """Stop measuring, record the operation and return its measurements."""
+        if self._owns_tracing:
+            tracemalloc.stop()
+        record = {
+            "operation": self.operation,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seconds": round(time.perf_counter() - self._started, 6),
+            "phases": {name: stats.as_dict() for name, stats in self._phases.items()},
+            "counters": self.counters,
+        }
+        record_operation(record)
+        return record
+
+
+class NullProfiler(Profiler):
+    """Profiler used when instrumentation is off. Does nothing, as cheaply as possible."""
+
+    enabled = False
+    _null_context = contextlib.nullcontext()
+
+    def __init__(self, operation: str = "", trace_memory: bool = False) -> None:
+        """Measure nothing."""
+        self.operation = operation
+
+    def phase(self, name: str) -> ContextManager[None]:
+        """Return a context manager that does nothing."""
+        return self._null_context
+
+    def iterate(self, name: str, items: Iterable[T]) -> Iterator[T]:
+        """Return an iterator over the items as is."""
+        return iter(items)
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Count nothing."""
+
+    def finish(self) -> Optional[dict[str, Any]]:
+        """Record nothing."""
+        return None
+
+
+def new_profiler(cfg: AnyConfig, operation: str) -> Profiler:
+    """Return a profiler for the operation, or one that does nothing if instrumentation is off."""
+    if cfg.instrumentation:
+        return Profiler(operation, trace_memory=cfg.instrumentation_trace_memory)
+    return NullProfiler(operation)
+
+
+def log_path() -> Optional[str]:
+    """Return the path of the instrumentation log, or None if Anki isn't running."""
+    return os.path.join(user_files_dir(), LOG_FILE_NAME) if anki_mw() else None
+
+
+def record_operation(record: dict[str, Any]) -> None:
+    """Remember the measurements of an operation and append them to the log as one JSON line."""
+    _recent_operations.append(record)
+    if path := log_path():
+        line = json.dumps(record, ensure_ascii=False)
+        with _log_lock, open(path, "a", encoding="utf-8") as log:
+            log.write(line + "\n")
+
+
+def recent_operations() -> list[dict[str, Any]]:
+    """Return measurements of the last operations, oldest first."""
+    return list(_recent_operations)
+
+
+def summary_text(records: Optional[list[dict[str, Any]]] = None) -> str:
+    """Return a readable summary of the recorded operations, slowest phase first."""
+    records = recent_operations() if records is None else records
+    if not records:
+        return f"No {ACTION_NAME} operations have been measured yet."
+    lines = []
+    for record in reversed(records):
+        lines.append(f"{record['time']}  {record['operation']}: {record['seconds']:.3f}s")
+        phases = sorted(record["phases"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+        for name, stats in phases:
+            peak = f", peak {stats['peak_kib']:.0f} KiB" if "peak_kib" in stats else ""
+            lines.append(f"    {name}: {stats['seconds']:.3f}s in {stats['calls']} calls{peak}")
+        if record["counters"]:
+            lines.append("    " + ", ".join(f"{name}: {n}" for name, n in record["counters"].items()))
+    return "\n".join(lines)
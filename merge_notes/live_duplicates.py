@@ -0,0 +1,250 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+"""
+Duplicate check in the editor and the Add dialog.
+Fields are compared with the Merge Notes comparison settings,
+and looked up in an in-memory index of normalized values, so a check doesn't scan the collection.
+"""
+
+import json
+import threading
+from collections.abc import Callable, Hashable, Sequence
+from typing import Optional
+
+from anki import hooks
+from anki.collection import Collection, OpChanges
+from anki.hooks import wrap
+from anki.notes import Note, NoteFieldsCheckResult, NoteId
+from aqt import gui_hooks, mw
+from aqt.editor import Editor
+from aqt.operations import QueryOp
+from aqt.utils import tooltip
+
+from .bulk_reader import database, field_values, notetype_of
+from .config import MergeNotesConfig, get_global_config
+from .config_view import ACTION_NAME, ConfigSnapshot
+
+# Field state that the editor shows with a red background.
+DUPE_STATE = "dupe"
+
+
+class LiveIndex:
+    """
+    Normalized values of one field of all notes.
+    Built with one pass over the notes table, then brought up to date by reading only notes modified since.
+    Updated in the background and read on the main thread.
+    """
+
+    def __init__(self, field_name: str, fingerprint: Hashable) -> None:
+        """Start with an empty index of the field, for values normalized by a normalizer with this fingerprint."""
+        self.field_name = field_name
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._nids_by_value: dict[str, set[NoteId]] = {}
+        self._value_of: dict[NoteId, str] = {}
+        # Notes modified at or after this time are read by the next update.
+        self._mod = 0
+        self.is_built = False
+
+    def __len__(self) -> int:
+        """Return the number of indexed notes."""
+        return len(self._value_of)
+
+    def update(self, col: Collection, normalize: Callable[[str], str]) -> int:
+        """
+        Index notes modified since the last update and return their number.
+        The first update reads all notes.
+        """
+        rows = database(col).all("SELECT id, mod FROM notes WHERE mod >= ?", self._mod)
+        # Notes that don't have the field are removed from the index.
+        values = dict.fromkeys((nid for nid, _ in rows), "")
+        for nid, value in field_values(col, list(values), self.field_name):
+            values[nid] = normalize(value)
+        with self._lock:
+            for nid, value in values.items():
+                self._set(nid, value)
+            self._mod = max((mod for _, mod in rows), default=self._mod)
+            self.is_built = True
+        return len(values)
+
+    def set_value(self, nid: NoteId, value: str) -> None:
+        """Index the normalized value of a note. An empty value removes the note."""
+        with self._lock:
+            self._set(nid, value)
+
+    def _set(self, nid: NoteId, value: str) -> None:
+        """Replace the value of a note. The caller holds the lock."""
+        if (old := self._value_of.pop(nid, None)) is not None:
+            if len(nids := self._nids_by_value[old]) > 1:
+                nids.discard(nid)
+            else:
+                del self._nids_by_value[old]
+        if value:
+            self._value_of[nid] = value
+            self._nids_by_value.setdefault(value, set()).add(nid)
+
+    def remove_notes(self, nids: Sequence[NoteId]) -> None:
+        """Forget deleted notes."""
+        with self._lock:
+            for nid in nids:
+                self._set(nid, "")
+
+    def candidates(self, value: str, exclude: Optional[NoteId] = None) -> list[NoteId]:
+        """Return other notes indexed with the normalized value. They may have changed since they were indexed."""
+        with self._lock:
+            return sorted(nid for nid in self._nids_by_value.get(value, ()) if nid != exclude)
+
+
+def find_live_duplicates(
+    col: Collection,
+    index: LiveIndex,
+    value: str,
+    normalize: Callable[[str], str],
+    exclude: Optional[NoteId] = None,
+) -> list[NoteId]:
+    """
+    Return notes whose field has the normalized value.
+    Candidates from the index are read again, so notes that changed or were deleted since the last update
+    aren't reported.
+    """
+    if not value or not (candidates := index.candidates(value, exclude)):
+        return []
+    return [nid for nid, current in field_values(col, candidates, index.field_name) if normalize(current) == value]
+
+
+class LiveDuplicateCheck:
+    """Marks fields of the edited note that duplicate fields of other notes."""
+
+    def __init__(self, cfg: MergeNotesConfig) -> None:
+        """Start without indexes. They are built in the background when a field is first checked."""
+        self._cfg = cfg
+        self._indexes: dict[str, LiveIndex] = {}
+        self._updating: set[LiveIndex] = set()
+        # Set when notes may have changed outside the editor, e.g. by sync, import or the browser.
+        self._stale = False
+
+    def fields_to_check(self, cfg: ConfigSnapshot, note: Note) -> list[str]:
+        """Return the fields of the note that are checked: the configured ones, or the first field."""
+        if cfg.live_duplicate_fields:
+            return [name for name in cfg.live_duplicate_fields if name in note]
+        return note.keys()[:1]
+
+    def duplicate_field_ords(self, col: Collection, note: Note, on_index_ready: Callable[[], None]) -> list[int]:
+        """
+        Return ordinals of the fields of the note that have duplicates.
+        Fields whose index isn't built yet are skipped, and on_index_ready is called once it's built.
+        """
+        cfg = self._cfg.snapshot()
+        field_map = col.models.field_map(notetype_of(col, note.mid))
+        ords = []
+        for field_name in self.fields_to_check(cfg, note):
+            if (index := self._ready_index(cfg, field_name, on_index_ready)) is None:
+                continue
+            value = cfg.normalized_values(note[field_name])
+            if find_live_duplicates(col, index, value, cfg.normalized_values, exclude=note.id or None):
+                ords.append(field_map[field_name][0])
+        return ords
+
+    def _ready_index(
+        self, cfg: ConfigSnapshot, field_name: str, on_index_ready: Callable[[], None]
+    ) -> Optional[LiveIndex]:
+        """Return the index of the field, or None if it's being built. Start an update if notes may have changed."""
+        index = self._indexes.get(field_name)
+        if index is None or index.fingerprint != cfg.normalizer.fingerprint:
+            index = self._indexes[field_name] = LiveIndex(field_name, cfg.normalizer.fingerprint)
+            self._update_in_background(cfg, index, on_index_ready)
+            return None
+        if not index.is_built:
+            return None
+        if self._stale:
+            self._stale = False
+            for stale_index in self._indexes.values():
+                self._update_in_background(cfg, stale_index, lambda: None)
+        return index
+
+    def _update_in_background(self, cfg: ConfigSnapshot, index: LiveIndex, on_done: Callable[[], None]) -> None:
+        """Update the index in a background operation, unless an update is already running."""
+        if index in self._updating:
+            return
+        self._updating.add(index)
+
+        def on_success(_n_notes: int) -> None:
+            """Mark the update as finished and let the caller check again."""
+            self._updating.discard(index)
+            on_done()
+
+        def on_failure(ex: Exception) -> None:
+            """Mark the update as finished, so that the next check tries again."""
+            self._updating.discard(index)
+            tooltip(f"{ACTION_NAME}: can't check duplicates of {index.field_name}: {ex}", parent=mw)
+
+        QueryOp(
+            parent=mw,
+            op=lambda col: index.update(col, cfg.normalized_values),
+            success=on_success,
+        ).failure(on_failure).run_in_background()
+
+    def on_duplicate_display_update(self, editor: Editor, result: int, _old: Callable) -> None:
+        """
+        Let the editor show its own duplicate and cloze state, then add the Merge Notes duplicate marks.
+        The editor updates this state after every pause in typing and when a field loses focus.
+        """
+        _old(editor, result)
+        if not self._cfg.live_duplicate_check or not (note := editor.note) or not mw or not mw.col:
+            return
+        ords = self.duplicate_field_ords(mw.col, note, on_index_ready=lambda: self._recheck(editor, note))
+        if ords:
+            states = [""] * len(note.fields)
+            if result == NoteFieldsCheckResult.DUPLICATE:
+                states[0] = DUPE_STATE
+            for field_ord in ords:
+                states[field_ord] = DUPE_STATE
+            editor.web.eval(f'require("anki/ui").loaded.then(() => {{ setBackgrounds({json.dumps(states)}); }});')
+
+    def _recheck(self, editor: Editor, note: Note) -> None:
+        """Check the note again once an index is built, if the editor still shows it."""
+        if editor.note is note:
+            editor.checkValid()
+
+    def on_note_added(self, note: Note) -> None:
+        """Index a note added in the Add dialog, so the next note is compared with it right away."""
+        cfg = self._cfg.snapshot()
+        for field_name, index in self._indexes.items():
+            if field_name in note and index.fingerprint == cfg.normalizer.fingerprint:
+                index.set_value(note.id, cfg.normalized_values(note[field_name]))
+
+    def on_notes_deleted(self, _col: Collection, nids: Sequence[NoteId]) -> None:
+        """Remove deleted notes from the indexes."""
+        for index in self._indexes.values():
+            index.remove_notes(nids)
+
+    def on_operation_did_execute(self, changes: OpChanges, _handler: Optional[object]) -> None:
+        """Remember to read modified notes before the next check."""
+        if changes.note_text:
+            self._stale = True
+
+    def close(self) -> None:
+        """Drop the indexes of the profile that is being closed."""
+        self._indexes.clear()
+        self._updating.clear()
+        self._stale = False
+
+
+######################################################################
+# Entry point
+######################################################################
+
+
+def init() -> None:
+    """Install the editor hooks."""
+    check = LiveDuplicateCheck(get_global_config())
+    Editor._update_duplicate_display = wrap(  # type: ignore[method-assign]
+        Editor._update_duplicate_display,
+        check.on_duplicate_display_update,
+        pos="around",
+    )
+    gui_hooks.add_cards_did_add_note.append(check.on_note_added)
+    hooks.notes_will_be_deleted.append(check.on_notes_deleted)
+    gui_hooks.operation_did_execute.append(check.on_operation_did_execute)
+    gui_hooks.profile_will_close.append(check.close)
@@ -0,0 +1,319 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import itertools
+from collections.abc import Iterable, Iterator, Sequence
+from typing import Any, Optional, Union
+
+from anki import collection
+from anki.cards import Card
+from anki.collection import OpChanges
+from anki.notes import Note, NoteId
+
+from .bulk_reader import CardRow, card_ids_of_notes
+from .config_types import OriginalNotesAction
+from .config_view import ACTION_NAME, AnyConfig
+from .instrumentation import Profiler, new_profiler
+from .normalizer import NormalizedValueCache
+from .preview import MergePreview, snapshot_notes
+
+######################################################################
+# Utils
+######################################################################
+
+
+def is_filled(s: str) -> bool:
+    """Return whether a field value has anything but whitespace. Unlike strip(), doesn't copy the value."""
+    return bool(s) and not s.isspace()
+
+
+def tags_in_notes(notes: Sequence[Note]) -> Iterable[str]:
+    """Iterates over all tags present in notes."""
+    return itertools.chain(*(note.tags for note in notes))
+
+
+def fields_in_notes(notes: Sequence[Note]) -> Iterable[str]:
+    """Iterates over all field names present in notes."""
+    return itertools.chain(*(note.keys() for note in notes))
+
+
+def merge_tags(recipient: Note, from_notes: Sequence[Note]) -> None:
+    """Merge tags from source notes into the recipient note."""
+    for tag in tags_in_notes(from_notes):
+        if not (recipient.has_tag(tag) or tag == "leech"):
+            recipient.add_tag(tag)
+
+
+def pairs(lst: Sequence[Any]) -> Iterator[tuple[Any, Any]]:
+    """Yield adjacent pairs from a sequence."""
+    for i in range(len(lst) - 1):
+        yield lst[i], lst[i + 1]
+
+
+def reorder_by_common_fields(notes: Sequence[Note]) -> list[Note]:
+    """Sort notes so notes with more shared fields come later."""
+    all_fields = frozenset(fields_in_notes(notes))
+    return sorted(notes, key=lambda note: sum(int(field_name in all_fields) for field_name in note.keys()))
+
+
+# Stands in for field values when the separator is normalized, so that it isn't stripped as leading whitespace.
+SEPARATOR_MARKER = "\ue000"
+
+
+class MergedField:
+    """
+    Value of a field after a cascading merge step, carried to the next note.
+    A joined value is normalized part by part: the normalized parts are kept,
+    and only joined when a later value has the same length.
+    When merging by segments, the segments of the value and their normalized forms are kept instead.
+    """
+
+    __slots__ = ("value", "parts", "normalized_len", "segments")
+
+    def __init__(
+        self,
+        value: str,
+        parts: Optional[list[str]] = None,
+        normalized_len: int = 0,
+        segments: Optional[list[tuple[str, str]]] = None,
+    ) -> None:
+        """Store the value and, if known, the normalized forms of its parts and their joined length, or segments."""
+        self.value = value
+        self.parts = parts
+        self.normalized_len = normalized_len
+        self.segments = segments
+
+
+class MergeNotes:
+    """Merge selected notes according to the configured behavior."""
+
+    action_name = f"{ACTION_NAME} of selected cards".capitalize()
+
+    def __init__(self, col: collection.Collection, cfg: AnyConfig, profiler: Optional[Profiler] = None) -> None:
+        """Take a snapshot of the config and store the state of a merge operation."""
+        self._cfg = cfg.snapshot()
+        self._profiler = profiler or new_profiler(self._cfg, self.action_name)
+        self.col = col
+        self.notes_to_update: list[Note] = []
+        self.nids_to_remove: list[NoteId] = []
+        self.nids_to_suspend: list[NoteId] = []
+        self.separator = self._cfg.separator
+        # An empty separator can't split anything, so values are then compared as a whole.
+        self._by_segments = self._cfg.merge_by_segments and bool(self.separator)
+        self._normalize: NormalizedValueCache = self._cfg.normalized_values
+        self._normalized_separator = self._normalize.normalizer(SEPARATOR_MARKER + self.separator + SEPARATOR_MARKER)[
+            1:-1
+        ]
+
+    def op(self, notes: Sequence[Note]) -> OpChanges:
+        """Execute the merge operation: merge, update, and optionally suspend or delete original notes."""
+        try:
+            pos = self.col.add_custom_undo_entry(self.action_name)
+            with self._profiler.phase("merge"):
+                self._do_merge(notes)
+            with self._profiler.phase("update_notes"):
+                self.col.update_notes(self.notes_to_update)
+            with self._profiler.phase("remove_notes"):
+                self.col.remove_notes(self.nids_to_remove)
+            with self._profiler.phase("suspend_cards"):
+                self._suspend_cards_of_notes()
+            self._profiler.count("notes", len(notes))
+            return self.col.merge_undo_entries(pos)
+        finally:
+            self._profiler.finish()
+
+    def preview(self, notes: Sequence[Note], max_diffs: int = 0) -> MergePreview:
+        """Return what merging the notes would change, without writing anything."""
+        preview = MergePreview(max_diffs)
+        before = snapshot_notes(notes)
+        self._do_merge(notes)
+        preview.record(before, self.notes_to_update, self.nids_to_remove, self.nids_to_suspend)
+        return preview
+
+    def _suspend_cards_of_notes(self) -> None:
+        """Suspend all cards belonging to the collected note IDs."""
+        self.col.sched.suspend_cards(card_ids_of_notes(self.col, self.nids_to_suspend))
+
+    def _do_merge(self, notes: Sequence[Note]) -> None:
+        """Merge notes according to the configured original_notes_action."""
+        if self._cfg.avoid_content_loss:
+            # notes are already sorted,
+            # but additional sorting is required to avoid content loss if possible.
+            notes = reorder_by_common_fields(notes)
+
+        action = self._cfg.original_notes_action
+
+        if action in (OriginalNotesAction.delete, OriginalNotesAction.suspend):
+            # If the user wants to delete or suspend, dump all content into the last note.
+            self._merge_field_content(notes[-1], notes, self.separator)
+            other_ids = [note.id for note in notes][0:-1]
+            if action is OriginalNotesAction.delete:
+                self.nids_to_remove.extend(other_ids)
+            else:
+                self.nids_to_suspend.extend(other_ids)
+            self.notes_to_update.append(notes[-1])
+        else:
+            self._cascade_merge(notes)
+            self.notes_to_update.extend(notes)
+
+    def _cascade_merge(self, notes: Sequence[Note]) -> None:
+        """
+        Merge in pairs so that each note receives content of previous notes.
+        The merged value of each field is carried to the next note with the normalized forms of its parts,
+        so that each note's content is normalized once, and the work grows with the total content
+        rather than with its square.
+        """
+        carried = {field_name: MergedField(notes[0][field_name]) for field_name in notes[0].keys()}
+        for add_from, add_to in pairs(notes):
+            if self._cfg.merge_tags:
+                merge_tags(add_to, (add_from, add_to))
+            concerned = frozenset(self._concerned_field_names(add_to.keys()))
+            current = {}
+            for field_name in add_to.keys():
+                value = add_to[field_name]
+                if field_name in concerned and not (self._cfg.skip_if_not_empty and is_filled(value)):
+                    merged = self._merge_field_value(carried.get(field_name), value)
+                    add_to[field_name] = merged.value
+                else:
+                    merged = MergedField(value)
+                current[field_name] = merged
+            carried = current
+
+    def _merge_field_value(self, previous: Optional[MergedField], value: str) -> MergedField:
+        """
+        Return the result of merging a field of the previous note into the same field of the next note.
+        Like _merge_field_content, if the normalized value equals the normalized merged value,
+        it's kept once, as the later value.
+        The previous merged value must not be used afterwards: its list of parts is reused.
+        """
+        if previous is not None and not is_filled(previous.value):
+            previous = None
+        if not is_filled(value):
+            return previous or MergedField("")
+        if self._by_segments and previous is not None:
+            return self._merge_field_segments(previous, value)
+        normalized = self._normalize(value)
+        if previous is None or self._equals_merged(previous, normalized):
+            return MergedField(value, [normalized], len(normalized))
+        parts = self._normalized_parts(previous)
+        parts.append(normalized)
+        return MergedField(
+            previous.value + self.separator + value,
+            parts,
+            previous.normalized_len + len(self._normalized_separator) + len(normalized),
+        )
+
+    def _merge_field_segments(self, previous: MergedField, value: str) -> MergedField:
+        """
+        Return the previous merged value with the segments of the next value that it doesn't have yet appended.
+        Only the new value is split and normalized.
+        """
+        return self._append_segments(
+            previous.value,
+            self._segments(previous),
+            value,
+            self._split_segments(value, self.separator),
+            self.separator,
+        )
+
+    def _append_segments(
+        self,
+        earlier_value: str,
+        earlier: list[tuple[str, str]],
+        value: str,
+        own: list[tuple[str, str]],
+        separator: str,
+    ) -> MergedField:
+        """
+        Merge a value into an earlier value segment by segment, keeping the segments in source order.
+        The earlier value is kept as it is, empty and repeated segments too,
+        and the segments of the value that it doesn't have are appended.
+        If the value already has every segment of the earlier value, the value is kept as it is instead,
+        so merging a merged value with one of its sources changes nothing.
+        """
+        added = self._new_segments(earlier, [own])
+        if not added:
+            return MergedField(earlier_value, segments=earlier)
+        if not self._new_segments(own, [earlier]):
+            return MergedField(value, segments=own)
+        return MergedField(
+            separator.join((earlier_value, *(segment for _, segment in added))),
+            segments=earlier + added,
+        )
+
+    def _segments(self, merged: MergedField) -> list[tuple[str, str]]:
+        """Return the segments of a merged value, splitting a value carried as is on first use."""
+        if merged.segments is None:
+            merged.segments = self._split_segments(merged.value, self.separator)
+        return merged.segments
+
+    def _split_segments(self, value: str, separator: str) -> list[tuple[str, str]]:
+        """Return (normalized form, segment) pairs of all segments of a value, split on the separator."""
+        return [(self._normalize(segment), segment) for segment in value.split(separator)]
+
+    def _new_segments(
+        self, own: list[tuple[str, str]], others: Iterable[list[tuple[str, str]]]
+    ) -> list[tuple[str, str]]:
+        """
+        Return the segments of the other values that aren't in own, in order.
+        Segments that are empty once normalized are left out, and each normalized form is added once.
+        """
+        seen = {key for key, _ in own}
+        added = []
+        for segments in others:
+            for key, segment in segments:
+                if key and key not in seen:
+                    seen.add(key)
+                    added.append((key, segment))
+        return added
+
+    def _join_segments(self, values: Sequence[str], separator: str) -> str:
+        """
+        Merge values segment by segment, in order.
+        Each value only adds the segments that the values before it don't have.
+        """
+        merged = MergedField(values[0], segments=self._split_segments(values[0], separator))
+        for value in values[1:]:
+            merged = self._append_segments(
+                merged.value, merged.segments or [], value, self._split_segments(value, separator), separator
+            )
+        return merged.value
+
+    def _normalized_parts(self, merged: MergedField) -> list[str]:
+        """Return the normalized parts of a merged value, normalizing a value carried as is on first use."""
+        if merged.parts is None:
+            normalized = self._normalize(merged.value)
+            merged.parts, merged.normalized_len = [normalized], len(normalized)
+        return merged.parts
+
+    def _equals_merged(self, merged: MergedField, normalized: str) -> bool:
+        """Return whether a normalized value equals the normalized form of a merged value."""
+        parts = self._normalized_parts(merged)
+        return merged.normalized_len == len(normalized) and self._normalized_separator.join(parts) == normalized
+
+    def _merge_field_content(self, recipient: Note, from_notes: Sequence[Note], separator: str) -> None:
+        """Merge field content from source notes into the recipient note."""
+        if self._cfg.merge_tags:
+            merge_tags(recipient, from_notes)
+        for field_name in self._concerned_field_names(recipient.keys()):
+            if recipient[field_name].strip() and self._cfg.skip_if_not_empty:
+                continue
+            values = [note[field_name] for note in from_notes if field_name in note and note[field_name].strip()]
+            if self._cfg.merge_by_segments and separator and len(values) > 1:
+                recipient[field_name] = self._join_segments(values, separator)
+            else:
+                recipient[field_name] = separator.join({self._normalize(value): value for value in values}.values())
+
+    def _concerned_field_names(self, recipient_fields: list[str]) -> Iterable[str]:
+        """
+        If the user has limited fields to a certain set, apply the setting.
+        """
+        if self._cfg.limit_to_fields:
+            return self._cfg.limit_to_fields.intersection(recipient_fields)
+        else:
+            return recipient_fields
+
+
+def notes_by_cards(cards: Iterable[Union[Card, CardRow]]) -> list[Note]:
+    """Return unique notes for cards while preserving card iteration order."""
+    return list({(note := card.note()).id: note for card in cards}.values())
@@ -0,0 +1,113 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import random
+import zlib
+from collections.abc import Iterable, Sequence
+
+from anki.notes import NoteId
+
+# Permutations are computed as (a * x + b) mod p, truncated to 32 bits.
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+def shingles(s: str, size: int) -> frozenset[int]:
+    """Return hashes of all character n-grams of the string. Short strings are a single shingle."""
+    if len(s) <= size:
+        return frozenset((zlib.crc32(s.encode("utf-8")),))
+    return frozenset(zlib.crc32(s[i : i + size].encode("utf-8")) for i in range(len(s) - size + 1))
+
+
+def jaccard(a: frozenset[int], b: frozenset[int]) -> float:
+    """Return the Jaccard similarity of two shingle sets."""
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """Computes MinHash signatures. Signatures made by hashers with equal arguments are comparable."""
+
+    def __init__(self, num_perm: int, seed: int = 1) -> None:
+        """Pick num_perm random permutations."""
+        rng = random.Random(seed)
+        self._permutations = [
+            (rng.randint(1, MERSENNE_PRIME - 1), rng.randint(0, MERSENNE_PRIME - 1)) for _ in range(num_perm)
+        ]
+
+    def signature(self, hashes: frozenset[int]) -> tuple[int, ...]:
+        """Return the minimum of every permutation over the shingle hashes."""
+        return tuple(min([((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes]) for a, b in self._permutations)
+
+
+class DisjointSet:
+    """Union-find over note groups."""
+
+    def __init__(self) -> None:
+        """Start with every item in its own set."""
+        self._parent: dict[int, int] = {}
+
+    def find(self, x: int) -> int:
+        """Return the representative of the set that contains x."""
+        parent = self._parent.setdefault(x, x)
+        while parent != x:
+            grandparent = self._parent[parent]
+            self._parent[x] = grandparent
+            x, parent = parent, grandparent
+        return x
+
+    def union(self, x: int, y: int) -> None:
+        """Merge the sets of x and y. The smaller representative wins, so results don't depend on call order."""
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            self._parent[max(x, y)] = min(x, y)
+
+
+def find_near_duplicates(
+    pairs: Iterable[tuple[NoteId, str]],
+    threshold: float,
+    shingle_size: int = 3,
+    num_perm: int = 32,
+    bands: int = 8,
+) -> list[tuple[str, list[NoteId]]]:
+    """
+    Group notes whose normalized values are similar.
+    Values are compared by the Jaccard similarity of their character shingles.
+    Candidate pairs come from LSH buckets of MinHash signatures, so values aren't compared pairwise,
+    and every candidate is checked against the threshold before it's grouped.
+    Returns groups of at least two notes in the same shape as Anki's duplicate search.
+    """
+    # Identical values are grouped right away, and only distinct values are hashed.
+    by_value: dict[str, list[NoteId]] = {}
+    for nid, val in pairs:
+        by_value.setdefault(val, []).append(nid)
+    values: Sequence[str] = list(by_value)
+    shingle_sets = [shingles(val, shingle_size) for val in values]
+
+    hasher = MinHasher(num_perm)
+    rows = num_perm // bands
+    buckets: dict[tuple[int, tuple[int, ...]], list[int]] = {}
+    sets = DisjointSet()
+    for idx, shingle_set in enumerate(shingle_sets):
+        signature = hasher.signature(shingle_set)
+        # Values that share several bands with this one are verified only once.
+        checked: set[int] = set()
+        for band in range(bands):
+            members = buckets.setdefault((band, signature[band * rows : (band + 1) * rows]), [])
+            # The value is verified against every member of the bucket, so that a chain of similar values
+            # (A~B and B~C) ends up in one group even when A and C aren't similar enough.
+            for other in members:
+                if other in checked or sets.find(other) == sets.find(idx):
+                    continue
+                checked.add(other)
+                if jaccard(shingle_sets[other], shingle_set) >= threshold:
+                    sets.union(other, idx)
+            members.append(idx)
+
+    groups: dict[int, list[int]] = {}
+    for idx in range(len(values)):
+        groups.setdefault(sets.find(idx), []).append(idx)
+    return [
+        (values[root], [nid for idx in members for nid in by_value[values[idx]]])
+        for root, members in groups.items()
+        if sum(len(by_value[values[idx]]) for idx in members) >= 2
+    ]
@@ -0,0 +1,229 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import re
+import sys
+import threading
+import unicodedata
+from collections import OrderedDict
+from collections.abc import Hashable
+from typing import TYPE_CHECKING, Optional
+
+from anki.utils import strip_html_media
+
+from .anki_env import anki_mw
+
+if TYPE_CHECKING:
+    from .config_view import AnyConfig
+
+NUMBERS = str.maketrans("０１２３４５６７８９", "0123456789")
+RE_HTML_TAG = re.compile(r"<[^<>]+>")
+RE_FURIGANA = re.compile(r"\s*(\S+)\[[^\[\]]+]")
+MiB = 1024 * 1024
+# Rough per-entry cost of the cache's own bookkeeping (dict slot and linked-list node).
+CACHE_ENTRY_OVERHEAD = 100
+
+
+def strip_html_regex(s: str) -> str:
+    """Return text with HTML tags removed by a simple regex."""
+    return RE_HTML_TAG.sub("", s).strip()
+
+
+def strip_html_anki(s: str) -> str:
+    """Return text with HTML stripped by Anki, keeping media filenames."""
+    return strip_html_media(s).strip()
+
+
+def strip_html(s: str) -> str:
+    """Return text with HTML media stripped."""
+    if not anki_mw():
+        # Anki isn't running, so fall back to a simple regex.
+        return strip_html_regex(s)
+    return strip_html_anki(s)
+
+
+def strip_punctuation(s: str, config: "AnyConfig") -> str:
+    """Remove configured punctuation characters from text."""
+    for char in frozenset(config.punctuation_characters):
+        if char in s:
+            s = s.replace(char, "")
+    return s
+
+
+def full_width_to_half_width(s: str) -> str:
+    """Normalize full-width characters to half-width equivalents."""
+    return unicodedata.normalize("NFKC", s).translate(NUMBERS)
+
+
+def remove_furigana(s: str) -> str:
+    """Remove bracketed furigana from text."""
+    return RE_FURIGANA.sub(r"\g<1>", s)
+
+
+class Normalizer:
+    """
+    Compiled form of the field comparison settings.
+    Tables and patterns are built once, so that normalizing a string doesn't touch the config.
+    """
+
+    __slots__ = (
+        "_ignore_html_tags",
+        "_strip_html",
+        "_ignore_furigana",
+        "_full_width_as_half_width",
+        "_table",
+        "_fingerprint",
+    )
+
+    def __init__(
+        self,
+        *,
+        ignore_html_tags: bool,
+        ignore_furigana: bool,
+        ignore_punctuation: bool,
+        punctuation_characters: str,
+        full_width_as_half_width: bool,
+        anki_html: Optional[bool] = None,
+    ) -> None:
+        """
+        Build the translate table used to drop punctuation and convert full-width digits.
+        HTML is stripped by Anki if anki_html is true, or if it's None and Anki is running.
+        """
+        self._ignore_html_tags = ignore_html_tags
+        # Decided once, so that a normalizer sent to another process strips HTML the same way.
+        if anki_html is None:
+            anki_html = anki_mw() is not None
+        self._strip_html = strip_html_anki if anki_html else strip_html_regex
+        self._ignore_furigana = ignore_furigana
+        self._full_width_as_half_width = full_width_as_half_width
+        table: dict[int, Optional[int]] = {}
+        if full_width_as_half_width:
+            # Translating digits before NFKC gives the same result,
+            # because NFKC never produces full-width digits.
+            table.update(NUMBERS)
+        if ignore_punctuation:
+            # Deletion takes priority, the same way punctuation is stripped before width conversion.
+            table.update(dict.fromkeys(map(ord, punctuation_characters)))
+        self._table = table
+        self._fingerprint = (
+            ignore_html_tags and self._strip_html.__name__,
+            ignore_furigana,
+            "".join(sorted(set(punctuation_characters))) if ignore_punctuation else None,
+            full_width_as_half_width,
+        )
+
+    @classmethod
+    def from_config(cls, config: "AnyConfig", anki_html: Optional[bool] = None) -> "Normalizer":
+        """Return a normalizer built from the current comparison settings."""
+        return cls(
+            ignore_html_tags=config.ignore_html_tags,
+            ignore_furigana=config.ignore_furigana,
+            ignore_punctuation=config.ignore_punctuation,
+            punctuation_characters=config.punctuation_characters,
+            full_width_as_half_width=config.full_width_as_half_width,
+            anki_html=anki_html,
+        )
+
+    @property
+    def uses_anki_html_stripping(self) -> bool:
+        """Return whether HTML is stripped by Anki's backend rather than by a regex."""
+        return self._ignore_html_tags and self._strip_html is strip_html_anki
+
+    @property
+    def fingerprint(self) -> Hashable:
+        """Return a value that is equal for normalizers built from equal comparison settings."""
+        return self._fingerprint
+
+    def __call__(self, s: str) -> str:
+        """Removes/replaces various characters defined by the user. Called before string comparison."""
+        if self._ignore_html_tags:
+            # Text without tags or entities is returned unchanged by the HTML stripper.
+            s = self._strip_html(s) if ("<" in s or "&" in s) else s.strip()
+        if self._ignore_furigana and "[" in s:
+            s = RE_FURIGANA.sub(r"\g<1>", s)
+        if self._table:
+            s = s.translate(self._table)
+        if self._full_width_as_half_width and not s.isascii():
+            # NFKC leaves ASCII text unchanged.
+            s = unicodedata.normalize("NFKC", s)
+        return s.strip()
+
+
+class NormalizedValueCache:
+    """
+    Bounded LRU cache of normalized field values.
+    Entries are only valid for the normalizer they were computed with,
+    so the config replaces the cache with a new one when comparison settings change.
+    Snapshots taken before the change keep using the old cache.
+    Shared by operations that run in background threads and by editor checks on the main thread.
+    """
+
+    def __init__(self, normalizer: Normalizer, max_bytes: int) -> None:
+        """Create an empty cache that holds at most max_bytes worth of strings."""
+        self._normalizer = normalizer
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        """Return the number of cached values."""
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        """Return the estimated memory held by cached strings."""
+        return self._size_bytes
+
+    @property
+    def max_bytes(self) -> int:
+        """Return the memory budget of the cache."""
+        return self._max_bytes
+
+    @property
+    def normalizer(self) -> Normalizer:
+        """Return the normalizer used to compute missing values."""
+        return self._normalizer
+
+    def clear(self) -> None:
+        """Drop all cached values and reset the counters."""
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        """Drop all cached values and reset the counters. The caller holds the lock."""
+        self._entries.clear()
+        self._size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, s: str) -> str:
+        """Return the normalized value of s, computing and remembering it if necessary."""
+        with self._lock:
+            try:
+                value = self._entries[s]
+            except KeyError:
+                pass
+            else:
+                self.hits += 1
+                self._entries.move_to_end(s)
+                return value
+            self.misses += 1
+        # Other threads can use the cache while the value is normalized.
+        value = self._normalizer(s)
+        with self._lock:
+            if s in self._entries:
+                return value
+            self._entries[s] = value
+            self._size_bytes += sys.getsizeof(s) + sys.getsizeof(value) + CACHE_ENTRY_OVERHEAD
+            while self._size_bytes > self._max_bytes and self._entries:
+                old_s, old_value = self._entries.popitem(last=False)
+                self._size_bytes -= sys.getsizeof(old_s) + sys.getsizeof(old_value) + CACHE_ENTRY_OVERHEAD
+        return value
+
+
+def cfg_strip(s: str, config: "AnyConfig") -> str:
+    """Removes/replaces various characters defined by the user. Called before string comparison."""
+    return config.normalizer(s)
@@ -0,0 +1,70 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import operator
+from collections.abc import Callable, Iterable
+from typing import Any, Optional, TypeVar
+
+from anki.collection import Collection
+from anki.models import NotetypeId
+
+from .bulk_reader import CardRow, notetype_of
+from .config_types import OrderingChoice, SortOrder
+from .config_view import AnyConfig, due_key, generic_numeric_key
+
+C = TypeVar("C", bound=CardRow)
+
+
+class CardOrdering:
+    """
+    Orders cards read in bulk by the configured ordering.
+    Does the same as MergeNotesConfig.ord_key, but looks up each note type only once.
+    """
+
+    def __init__(self, col: Collection, cfg: AnyConfig) -> None:
+        """Pick the key function of the configured ordering."""
+        self._col = col
+        self._reverse = cfg.sort_order is SortOrder.descending
+        self._custom_sort_field = cfg.custom_sort_field
+        # (sort field index, custom field index or None) by note type.
+        self._field_indexes: dict[NotetypeId, tuple[int, Optional[int]]] = {}
+        keys: dict[OrderingChoice, Callable[[CardRow], Any]] = {
+            OrderingChoice.due: due_key,
+            OrderingChoice.interval_length: operator.attrgetter("ivl"),
+            OrderingChoice.card_id: operator.attrgetter("id"),
+            OrderingChoice.deck_id: operator.attrgetter("did"),
+            OrderingChoice.sort_field: self._sort_field,
+            OrderingChoice.sort_field_numeric: generic_numeric_key(self._sort_field),
+            OrderingChoice.custom_field: self._custom_field,
+            OrderingChoice.custom_field_numeric: generic_numeric_key(self._custom_field),
+        }
+        self.key = keys[cfg.ordering]
+
+    def _indexes(self, mid: NotetypeId) -> tuple[int, Optional[int]]:
+        """Return indexes of the sort field and of the custom sort field of a note type."""
+        try:
+            return self._field_indexes[mid]
+        except KeyError:
+            pass
+        notetype = notetype_of(self._col, mid)
+        custom_idx = next(
+            (idx for idx, field in enumerate(notetype["flds"]) if field["name"] == self._custom_sort_field),
+            None,
+        )
+        indexes = self._field_indexes[mid] = (notetype["sortf"], custom_idx)
+        return indexes
+
+    def _sort_field(self, card: CardRow) -> str:
+        """Return the value of the note type's sort field for a card."""
+        note = card.note()
+        return note.values()[self._indexes(note.mid)[0]]
+
+    def _custom_field(self, card: CardRow) -> str:
+        """Return the configured custom sort field, falling back to the sort field."""
+        note = card.note()
+        sort_idx, custom_idx = self._indexes(note.mid)
+        return note.values()[sort_idx if custom_idx is None else custom_idx]
+
+    def sorted(self, cards: Iterable[C]) -> list[C]:
+        """Return the cards in merge order. The key of each card is computed once."""
+        return sorted(cards, key=self.key, reverse=self._reverse)
@@ -0,0 +1,87 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import collections
+import multiprocessing
+import os
+from collections.abc import Iterable, Sequence
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+from .normalizer import Normalizer
+from .progress import ProgressReporter
+
+if TYPE_CHECKING:
+    # Worker processes import this module first, and importing anki.notes before anki.collection fails.
+    from anki.notes import NoteId
+
+GroupMap = dict[str, list["NoteId"]]
+
+
+def default_worker_count() -> int:
+    """Return the number of worker processes to use, leaving one core to Anki."""
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def init_worker(uses_anki_html_stripping: bool) -> None:
+    """Prepare a worker process. Anki's HTML stripping needs an i18n backend, which Anki sets up on startup."""
+    if uses_anki_html_stripping:
+        import anki.lang
+
+        if anki.lang.current_i18n is None:
+            anki.lang.set_lang("en")
+
+
+def normalize_chunk(normalizer: Normalizer, pairs: Sequence[tuple["NoteId", str]]) -> GroupMap:
+    """Normalize field values and group note IDs by the result. Runs in a worker process."""
+    groups: GroupMap = {}
+    for nid, value in pairs:
+        if val := normalizer(value):
+            groups.setdefault(val, []).append(nid)
+    return groups
+
+
+def merge_group_maps(groups: GroupMap, partial: GroupMap) -> None:
+    """
+    Add a partial group map to the accumulated one.
+    Merging partial maps in the order their chunks were read gives the same groups, in the same order,
+    as normalizing all chunks in one process.
+    """
+    for val, nids in partial.items():
+        if val in groups:
+            groups[val].extend(nids)
+        else:
+            groups[val] = nids
+
+
+def group_in_parallel(
+    batches: Iterable[Sequence[tuple["NoteId", str]]],
+    normalizer: Normalizer,
+    progress: ProgressReporter,
+    workers: int = 0,
+) -> GroupMap:
+    """
+    Normalize batches of (note id, field value) pairs in a process pool and return the merged group map.
+    Only a few batches are in flight at a time, so memory stays bounded when batches are read lazily.
+    """
+    workers = workers or default_worker_count()
+    groups: GroupMap = {}
+    pending: collections.deque[Future] = collections.deque()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        # Forking a process that runs Qt is unsafe.
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(normalizer.uses_anki_html_stripping,),
+    ) as executor:
+        try:
+            for batch in batches:
+                pending.append(executor.submit(normalize_chunk, normalizer, batch))
+                if len(pending) >= 2 * workers:
+                    merge_group_maps(groups, pending.popleft().result())
+            while pending and not progress.want_cancel():
+                merge_group_maps(groups, pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+    return groups
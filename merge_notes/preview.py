@@ -0,0 +1,113 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+from collections.abc import Iterable, Sequence
+
+from anki.notes import Note, NoteId
+
+# Field values longer than this are shortened in diffs.
+MAX_DIFF_VALUE_LEN = 200
+
+NoteSnapshot = tuple[list[str], list[str]]
+
+
+def snapshot_notes(notes: Iterable[Note]) -> dict[NoteId, NoteSnapshot]:
+    """Return copies of the field values and tags of notes, taken before they are merged."""
+    return {note.id: (list(note.values()), list(note.tags)) for note in notes}
+
+
+def byte_size(values: Iterable[str]) -> int:
+    """Return the size of field values encoded as UTF-8."""
+    return sum(len(value.encode("utf-8")) for value in values)
+
+
+def shorten(value: str) -> str:
+    """Return the value, shortened if it's too long to read in a diff."""
+    return value if len(value) <= MAX_DIFF_VALUE_LEN else f"{value[:MAX_DIFF_VALUE_LEN]}…"
+
+
+class NoteDiff:
+    """Changes a merge would make to one note."""
+
+    def __init__(self, nid: NoteId, fields: list[tuple[str, str, str]], added_tags: list[str]) -> None:
+        """Store (field name, old value, new value) triples and tags that would be added."""
+        self.nid = nid
+        self.fields = fields
+        self.added_tags = added_tags
+
+    def __str__(self) -> str:
+        """Return the diff as readable text."""
+        lines = [f"Note {self.nid}"]
+        lines.extend(f"  {name}: {shorten(old)!r} → {shorten(new)!r}" for name, old, new in self.fields)
+        if self.added_tags:
+            lines.append(f"  Tags: + {' '.join(self.added_tags)}")
+        return "\n".join(lines)
+
+
+class MergePreview:
+    """
+    What a merge would do, computed without writing anything.
+    Counts cover all notes. Per-note diffs are kept for the first max_diffs changed notes.
+    """
+
+    def __init__(self, max_diffs: int = 0) -> None:
+        """Start with an empty preview."""
+        self.max_diffs = max_diffs
+        self.diffs: list[NoteDiff] = []
+        self.n_groups = 0
+        self.n_notes_changed = 0
+        self.n_fields_changed = 0
+        self.n_tags_added = 0
+        self.n_notes_removed = 0
+        self.n_notes_suspended = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.bytes_removed = 0
+
+    def record(
+        self,
+        before: dict[NoteId, NoteSnapshot],
+        updated: Sequence[Note],
+        removed: Sequence[NoteId],
+        suspended: Sequence[NoteId],
+    ) -> None:
+        """Compare merged notes with their snapshots and add the differences to the preview."""
+        for note in updated:
+            old_values, old_tags = before[note.id]
+            fields = [(name, old, new) for name, old, new in zip(note.keys(), old_values, note.values()) if old != new]
+            added_tags = [tag for tag in note.tags if tag not in old_tags]
+            if not (fields or added_tags):
+                continue
+            self.n_notes_changed += 1
+            self.n_fields_changed += len(fields)
+            self.n_tags_added += len(added_tags)
+            self.bytes_before += byte_size(old_values)
+            self.bytes_after += byte_size(note.values())
+            if len(self.diffs) < self.max_diffs:
+                self.diffs.append(NoteDiff(note.id, fields, added_tags))
+        self.n_notes_removed += len(removed)
+        self.bytes_removed += sum(byte_size(before[nid][0]) for nid in removed)
+        self.n_notes_suspended += len(suspended)
+
+    def summary(self) -> str:
+        """Return the counts as readable text."""
+        lines = []
+        if self.n_groups:
+            lines.append(f"Groups of notes: {self.n_groups}")
+        lines.extend((
+            f"Notes changed: {self.n_notes_changed}",
+            f"Fields changed: {self.n_fields_changed}",
+            f"Tags added: {self.n_tags_added}",
+            f"Notes deleted: {self.n_notes_removed}",
+            f"Notes suspended: {self.n_notes_suspended}",
+            f"Size of changed notes: {self.bytes_before} → {self.bytes_after} bytes",
+            f"Size of deleted notes: {self.bytes_removed} bytes",
+        ))
+        return "\n".join(lines)
+
+    def report(self) -> str:
+        """Return the counts followed by the kept diffs."""
+        parts = [self.summary(), *(str(diff) for diff in self.diffs)]
+        if self.n_notes_changed > len(self.diffs) and self.diffs:
+            parts.append(f"… and {self.n_notes_changed - len(self.diffs)} more changed notes.")
+        return "\n\n".join(parts)
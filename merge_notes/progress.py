@@ -0,0 +1,91 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import time
+
+from .anki_env import anki_mw
+
+
+def format_eta(elapsed: float, done: int, total: int) -> str:
+    """Return an estimate of the time left, assuming the remaining items take as long as the done ones."""
+    if done <= 0 or done >= total:
+        return ""
+    seconds = round(elapsed / done * (total - done))
+    if seconds < 60:
+        return f"About {seconds}s left."
+    return f"About {seconds // 60}m {seconds % 60:02d}s left."
+
+
+class ProgressReporter:
+    """Receives progress of a long operation. This base class shows nothing and is never cancelled."""
+
+    cancelled: bool = False
+
+    def start(self, label: str, total: int) -> None:
+        """Begin reporting an operation that processes total items."""
+
+    def update(self, label: str, done: int) -> None:
+        """Report that done items out of total have been processed."""
+
+    def want_cancel(self) -> bool:
+        """Return whether the user asked to stop the operation."""
+        return False
+
+    def notify(self, message: str) -> None:
+        """Tell the user about something that changed how the operation runs."""
+
+    def finish(self) -> None:
+        """Stop reporting."""
+
+
+class AnkiProgress(ProgressReporter):
+    """
+    Reports progress through Anki's progress manager.
+    Meant to be used from background operations, so all UI calls are sent to the main thread.
+    """
+
+    def __init__(self, min_interval: float = 0.1) -> None:
+        """Limit updates to one per min_interval seconds."""
+        mw = anki_mw()
+        assert mw, "Anki should be open."
+        self._mw = mw
+        self._min_interval = min_interval
+        self._last_update = 0.0
+        self._total = 0
+
+    def start(self, label: str, total: int) -> None:
+        """Open (or reuse) Anki's progress window."""
+        self._total = total
+
+        def start() -> None:
+            self._mw.progress.start(label=label, max=total, immediate=True)
+
+        self._mw.taskman.run_on_main(start)
+
+    def update(self, label: str, done: int) -> None:
+        """Update the progress window, skipping updates that come too often."""
+        if (now := time.monotonic()) - self._last_update < self._min_interval and done < self._total:
+            return
+        self._last_update = now
+        self._mw.taskman.run_on_main(lambda: self._mw.progress.update(label=label, value=done, max=self._total))
+
+    def want_cancel(self) -> bool:
+        """Return whether the user has closed the progress window."""
+        if self._mw.progress.want_cancel():
+            self.cancelled = True
+        return self.cancelled
+
+    def notify(self, message: str) -> None:
+        """Show the message in a tooltip."""
+        from aqt.utils import tooltip
+
+        self._mw.taskman.run_on_main(lambda: tooltip(message, parent=self._mw))
+
+    def finish(self) -> None:
+        """Close the progress window unless an outer operation still uses it."""
+        self._mw.taskman.run_on_main(self._mw.progress.finish)
+
+
+def new_progress() -> ProgressReporter:
+    """Return a reporter that shows progress in Anki, or a silent one if Anki isn't running."""
+    return AnkiProgress() if anki_mw() else ProgressReporter()
@@ -17,8 +17,11 @@ from .ajt_common.monospace_line_edit import MonoSpaceLineEdit
 from .ajt_common.multiple_choice_selector import MultipleChoiceSelector
 from .ajt_common.restore_geom_dialog import AnkiSaveAndRestoreGeomDialog
 from .ajt_common.widget_placement import place_widgets_in_grid
-from .config import ACTION_NAME, MergeNotesConfig, get_global_config
+from .config import MergeNotesConfig, get_global_config
 from .config_types import OriginalNotesAction, SortOrder
+from .config_view import ACTION_NAME
+from .fingerprints import numpy_available
+from .instrumentation import summary_text
 from .widgets.ordering_widget import OrderingWidget
 
 ######################################################################
@@ -45,6 +48,7 @@ class DialogUI(QDialog):
         "full-width_as_half-width",
         "apply_when_searching_duplicates",
         "ignore_furigana",
+        "near_duplicate_search",
     )
 
     _reset_button: QPushButton
@@ -67,6 +71,7 @@ class DialogUI(QDialog):
         self._checkboxes = dict(self._create_checkboxes())
         self._original_notes_action_combo = EnumSelectCombo(enum_type=OriginalNotesAction)
         self._limit_to_fields = MultipleChoiceSelector()
+        self._instrumentation_summary = QPlainTextEdit()
         self._bottom_box = QDialogButtonBox(QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
         self._reset_button = self._bottom_box.addButton("Restore defaults", QDialogButtonBox.ButtonRole.ResetRole)
         self._setup_ui()
@@ -85,6 +90,7 @@ class DialogUI(QDialog):
         vbox.addWidget(self._limit_to_fields)
         vbox.addWidget(self.create_comparison_group())
         vbox.addWidget(self.create_behavior_group())
+        vbox.addWidget(self.create_instrumentation_group())
         vbox.addStretch(1)
         vbox.addWidget(self._bottom_box)
         return vbox
@@ -119,6 +125,18 @@ class DialogUI(QDialog):
         )
         return group
 
+    def create_instrumentation_group(self) -> QGroupBox:
+        """Create the group that shows measurements of recent operations."""
+        group = QGroupBox("Recent operations")
+        group.setCheckable(False)
+        self._instrumentation_summary.setReadOnly(True)
+        self._instrumentation_summary.setMaximumHeight(150)
+        layout = QVBoxLayout()
+        layout.addWidget(self._instrumentation_summary)
+        group.setLayout(layout)
+        group.setVisible(self._cfg.instrumentation)
+        return group
+
     def add_tooltips(self) -> None:
         """Attach explanatory tooltips to all user-facing widgets."""
         self._field_separator_edit.setToolTip(
@@ -145,6 +163,12 @@ class DialogUI(QDialog):
             "Copy only from non-empty fields to empty fields.\n"
             "If a field is already filled, no new text will be added to it."
         )
+        self._checkboxes["merge_by_segments"].setToolTip(
+            "Split the fields of the notes on the field separator\n"
+            "and append only the parts that the earlier notes don't have yet.\n"
+            "Parts keep the order of the notes, earlier notes first.\n"
+            "Merging a note again with one of its sources doesn't repeat its content."
+        )
         self._checkboxes["ignore_html_tags"].setToolTip(
             "Strip HTML tags from a pair of fields before performing a comparison.\n"
             "Treat two fields equal if their text content matches, disregard HTML tags."
@@ -164,6 +188,33 @@ class DialogUI(QDialog):
             "if each option is enabled respectfully."
             "This should yield more results."
         )
+        self._checkboxes["near_duplicate_search"].setToolTip(
+            "When searching for duplicates, also group fields that are similar but not equal.\n"
+            'Set how similar they must be with "near_duplicate_threshold" in the config.'
+        )
+        self._checkboxes["persistent_duplicate_index"].setToolTip(
+            "Remember normalized field values between duplicate searches.\n"
+            "Only notes changed since the last search are processed again."
+        )
+        self._checkboxes["parallel_duplicate_search"].setToolTip(
+            "Normalize fields in several processes when searching for duplicates\n"
+            "in large collections. Uses more memory and CPU cores."
+        )
+        self._checkboxes["fingerprint_duplicate_search"].setToolTip(
+            "Keep only a short fingerprint of each field while searching for duplicates.\n"
+            "Uses much less memory in large collections. Requires NumPy."
+        )
+        self._checkboxes["live_duplicate_check"].setToolTip(
+            "Mark fields that duplicate fields of other notes while you type in the editor.\n"
+            'Checks the first field, or the fields set in "live_duplicate_fields" in the config.'
+        )
+        self._checkboxes["instrumentation"].setToolTip(
+            "Measure how long each phase of merging, duplicating and searching for duplicates takes.\n"
+            "Measurements are saved to user_files/instrumentation.jsonl in the add-on's folder."
+        )
+        self._checkboxes["instrumentation_trace_memory"].setToolTip(
+            "Also measure peak Python memory use of each phase. Makes operations slower."
+        )
         self._checkboxes["show_duplicate_notes_button"].setToolTip(
             'Add "Duplicate notes" button to context menu of the Anki Browser.'
         )
@@ -195,6 +246,7 @@ class MergeFieldsSettingsWindow(DialogUI, AnkiSaveAndRestoreGeomDialog):
         self.populate_widgets()
         self.load_config_values(self._cfg)
         self.connect_ui_elements()
+        self._set_fingerprint_search_active_status()
         tweak_window(self)
 
     def populate_widgets(self) -> None:
@@ -210,6 +262,7 @@ class MergeFieldsSettingsWindow(DialogUI, AnkiSaveAndRestoreGeomDialog):
         self._ordering_widget.set_sort_order(cfg.sort_order)
         self._custom_sort_field_edit.setCurrentText(cfg.custom_sort_field)
         self._limit_to_fields.set_checked_texts(cfg.limit_to_fields)
+        self._instrumentation_summary.setPlainText(summary_text())
         for key, widget in self._shortcut_edits.items():
             widget.setValue(cfg[key])
         for key, widget in self._checkboxes.items():
@@ -229,6 +282,13 @@ class MergeFieldsSettingsWindow(DialogUI, AnkiSaveAndRestoreGeomDialog):
             self._ordering_widget.current_ordering_choice().lower().startswith("custom_field")
         )
 
+    def _set_fingerprint_search_active_status(self) -> None:
+        """Disable fingerprint search if NumPy isn't installed. Anki doesn't bundle it."""
+        if not numpy_available():
+            checkbox = self._checkboxes["fingerprint_duplicate_search"]
+            checkbox.setEnabled(False)
+            checkbox.setToolTip(f"{checkbox.toolTip()}\nNumPy isn't installed, so this option is unavailable.")
+
     def accept(self) -> None:
         """Save settings to config and close the dialog."""
         self._cfg["field_separator"] = self._field_separator_edit.text()
@@ -1,36 +1,66 @@
 # Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
-from collections.abc import Iterable
+import sqlite3
+from collections.abc import Iterable, Sequence
+from typing import TYPE_CHECKING, Any, Optional, Union
 
 import anki.errors
-
-
-class FakeCard:
+from anki.cards import Card, CardId
+from anki.collection import OpChanges, OpChangesWithCount, SearchNode
+from anki.consts import CardType
+from anki.decks import DeckId
+from anki.models import NotetypeDict, NotetypeId
+from anki.notes import NoteId
+
+from merge_notes.progress import ProgressReporter
+
+if TYPE_CHECKING:
+    # Type checkers see the doubles as the Anki classes they stand in for.
+    from anki.cards import Card as CardBase
+    from anki.collection import Collection as CollectionBase
+    from anki.dbproxy import DBProxy as DBBase
+    from anki.models import ModelManager as ModelsBase
+    from anki.notes import Note as NoteBase
+    from anki.scheduler.v3 import Scheduler as SchedulerBase
+    from anki.tags import TagManager as TagsBase
+else:
+    CardBase = CollectionBase = DBBase = ModelsBase = NoteBase = SchedulerBase = TagsBase = object
+
+
+class FakeCard(CardBase):
     """Small card double exposing only the fields used by merge tests."""
 
-    def __init__(self, card_id: int, note: "FakeNote", card_type: int = 0, due: int = 0) -> None:
-        """Store the card ID, owning note, and sort-relevant attributes."""
-        self.id = card_id
-        self._note = note
-        self.type = card_type
+    def __init__(
+        self, card_id: int, note: "FakeNote", card_type: int = 0, due: int = 0, did: int = 1, odid: int = 0
+    ) -> None:
+        """Store the card ID, owning note, sort-relevant attributes, and the deck and home deck IDs."""
+        self.id = CardId(card_id)
+        self._owner = note
+        self.type = CardType(card_type)
         self.due = due
+        self.did = DeckId(did)
+        self.odid = DeckId(odid)
 
-    def note(self) -> "FakeNote":
+    def note(self, reload: bool = False) -> "FakeNote":
         """Return the note that owns this card."""
-        return self._note
+        return self._owner
 
 
-class FakeNote:
+class FakeNote(NoteBase):
     """Small note double supporting field and tag operations."""
 
-    def __init__(self, note_id: int, fields: dict[str, str], tags: Iterable[str] = ()) -> None:
-        """Store field data and tags for tests."""
-        self.id = note_id
+    def __init__(
+        self, note_id: int, fields: dict[str, str], tags: Iterable[str] = (), mid: Optional[int] = None
+    ) -> None:
+        """Store field data and tags for tests. Without a mid, the note type is assigned by FakeCollection."""
+        self.id = NoteId(note_id)
+        self.mid = NotetypeId(mid or 0)
+        self.mod = 0
         self._fields = dict(fields)
         self.tags = list(tags)
         # Each note owns one card. Card ID is note_id * 10 to avoid collisions.
-        self._cards = [FakeCard(note_id * 10, self)]
+        self._cards: list[Card] = [FakeCard(note_id * 10, self)]
 
     def __contains__(self, field_name: str) -> bool:
         """Return whether the note has a field."""
@@ -48,6 +78,10 @@ class FakeNote:
         """Return field names."""
         return list(self._fields.keys())
 
+    def values(self) -> list[str]:
+        """Return field values."""
+        return list(self._fields.values())
+
     def has_tag(self, tag: str) -> bool:
         """Return whether the note already has a tag."""
         return tag in self.tags
@@ -56,63 +90,211 @@ class FakeNote:
         """Add a tag to the note."""
         self.tags.append(tag)
 
-    def cards(self) -> list[FakeCard]:
+    def cards(self) -> list[Card]:
         """Return cards belonging to the note."""
         return self._cards
 
+    def model(self) -> dict[str, Any]:
+        """Return a note type whose sort field is the first field."""
+        return {"id": self.mid, "sortf": 0}
+
 
-class FakeScheduler:
+class FakeScheduler(SchedulerBase):
     """Scheduler double that records suspended card IDs."""
 
     def __init__(self) -> None:
         """Initialize the recorded suspended card IDs."""
         self.suspended_card_ids: list[int] = []
 
-    def suspend_cards(self, card_ids: list[int]) -> None:
+    def suspend_cards(self, ids: Sequence[CardId]) -> OpChangesWithCount:
         """Record card IDs requested for suspension."""
-        self.suspended_card_ids.extend(card_ids)
+        self.suspended_card_ids.extend(ids)
+        return OpChangesWithCount(count=len(ids))
+
+
+class FakeDB(DBBase):
+    """In-memory SQLite database with the part of Anki's schema read by bulk queries."""
+
+    def __init__(self) -> None:
+        """Create empty notes and cards tables."""
+        self._conn = sqlite3.connect(":memory:")
+        self._conn.executescript("""
+            CREATE TABLE notes (
+                id INTEGER PRIMARY KEY, guid TEXT NOT NULL, mid INTEGER NOT NULL, mod INTEGER NOT NULL,
+                usn INTEGER NOT NULL, tags TEXT NOT NULL, flds TEXT NOT NULL
+            );
+            CREATE TABLE cards (
+                id INTEGER PRIMARY KEY, nid INTEGER NOT NULL, did INTEGER NOT NULL, odid INTEGER NOT NULL,
+                ord INTEGER NOT NULL, type INTEGER NOT NULL, due INTEGER NOT NULL, ivl INTEGER NOT NULL
+            );
+            """)
+
+    def add_note(self, note: FakeNote) -> None:
+        """Store a note and its cards, replacing previously stored versions."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO notes VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (note.id, f"guid{note.id}", note.mid, note.mod, -1, f" {' '.join(note.tags)} ", "\x1f".join(note.values())),
+        )
+        for card in note.cards():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cards VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (card.id, note.id, card.did, card.odid, 0, card.type, card.due, 0),
+            )
+
+    def all(self, sql: str, *args: Any, **kwargs: Any) -> list[Sequence[Any]]:
+        """Return all rows of a query."""
+        return [list(row) for row in self._conn.execute(sql, args)]
+
+    def list(self, sql: str, *args: Any, **kwargs: Any) -> list[Any]:
+        """Return the first column of all rows of a query."""
+        return [row[0] for row in self._conn.execute(sql, args)]
+
+    def scalar(self, sql: str, *args: Any, **kwargs: Any) -> Any:
+        """Return the first column of the first row of a query."""
+        row = self._conn.execute(sql, args).fetchone()
+        return row[0] if row else None
+
+
+class FakeModels(ModelsBase):
+    """Model manager double. Note types are derived from the field names of notes."""
 
+    def __init__(self) -> None:
+        """Start without note types."""
+        self._by_mid: dict[NotetypeId, NotetypeDict] = {}
+        self._mid_by_fields: dict[tuple[str, ...], NotetypeId] = {}
+
+    def register(self, note: FakeNote) -> None:
+        """Assign a note type to a note, creating it from the note's field names if needed."""
+        field_names = tuple(note.keys())
+        if not note.mid:
+            note.mid = self._mid_by_fields.setdefault(field_names, NotetypeId(len(self._mid_by_fields) + 1))
+        self._by_mid.setdefault(
+            note.mid,
+            {
+                "id": note.mid,
+                "sortf": 0,
+                "flds": [{"name": name, "ord": idx} for idx, name in enumerate(field_names)],
+            },
+        )
+
+    def get(self, id: NotetypeId) -> NotetypeDict:
+        """Return a note type dict."""
+        return self._by_mid[id]
+
+    def field_map(self, notetype: NotetypeDict) -> dict[str, tuple[int, dict[str, Any]]]:
+        """Return a mapping of field name to (ord, field), like Anki does."""
+        return {field["name"]: (field["ord"], field) for field in notetype["flds"]}
+
+
+class FakeTags(TagsBase):
+    """Tag manager double with Anki's tag parsing rules."""
+
+    def __init__(self) -> None:
+        """Tags are parsed without a collection."""
+
+    def split(self, tags: str) -> list[str]:
+        """Parse a space-separated tag string."""
+        return [tag for tag in tags.replace("\u3000", " ").split(" ") if tag]
 
-class FakeCollection:
+    def in_list(self, tag: str, tags: list[str]) -> bool:
+        """Return whether the tag is in the list, ignoring case."""
+        return tag.lower() in [t.lower() for t in tags]
+
+
+class FakeCollection(CollectionBase):
     """Collection double for MergeNotes tests."""
 
+    sched: FakeScheduler
+    models: FakeModels
+    tags: FakeTags
+    db: FakeDB
+
     def __init__(self, notes: Iterable[FakeNote] = ()) -> None:
         """Store notes and collection operation calls."""
-        self.notes = {note.id: note for note in notes}
+        self.notes: dict[NoteId, FakeNote] = {note.id: note for note in notes}
         self.sched = FakeScheduler()
-        self.updated_notes: list[FakeNote] = []
-        self.removed_note_ids: list[int] = []
-
-    def add_custom_undo_entry(self, _action_name: str) -> int:
+        self.models = FakeModels()
+        self.tags = FakeTags()
+        self.db = FakeDB()
+        for note in self.notes.values():
+            self.models.register(note)
+            self.db.add_note(note)
+        self.updated_notes: list[NoteBase] = []
+        self.removed_note_ids: list[NoteId] = []
+        self.changes = OpChanges(note_text=True)
+
+    def weakref(self) -> "FakeCollection":
+        """Return the collection itself. Notes built from database rows keep a reference to it."""
+        return self
+
+    def add_custom_undo_entry(self, name: str) -> int:
         """Return a fake undo position."""
         return 1
 
-    def update_notes(self, notes: list[FakeNote]) -> None:
+    def update_notes(self, notes: Sequence[NoteBase], skip_undo_entry: bool = False) -> OpChanges:
         """Record notes requested for update."""
         self.updated_notes.extend(notes)
+        return OpChanges()
 
-    def remove_notes(self, note_ids: list[int]) -> None:
+    def remove_notes(self, note_ids: Sequence[NoteId]) -> OpChangesWithCount:
         """Record note IDs requested for removal."""
         self.removed_note_ids.extend(note_ids)
+        return OpChangesWithCount(count=len(note_ids))
 
-    def merge_undo_entries(self, _position: int) -> str:
+    def merge_undo_entries(self, target: int) -> OpChanges:
         """Return a fake operation result."""
-        return "changes"
+        return self.changes
 
-    def get_note(self, note_id: int) -> FakeNote:
+    def get_note(self, id: NoteId) -> FakeNote:
         """Return a note by ID, raising NotFoundError for missing notes."""
-        if note_id not in self.notes:
-            raise anki.errors.NotFoundError(message="", help_page="", context="", backtrace="")
-        return self.notes[note_id]
+        if id not in self.notes:
+            raise anki.errors.NotFoundError(message="", help_page=None, context="", backtrace="")
+        return self.notes[id]
 
 
 class FakeSearchCollection(FakeCollection):
     """Collection double that supports duplicate-search operations."""
 
-    def build_search_string(self, search: str, _node: object) -> str:
-        """Return the search string unchanged."""
-        return search
+    def build_search_string(self, *nodes: Union[str, SearchNode], joiner: str = "AND") -> str:
+        """Return the search string unchanged, ignoring search nodes."""
+        return next((node for node in nodes if isinstance(node, str)), "")
 
-    def find_notes(self, query: str) -> list[int]:
+    def find_notes(self, query: str, order: Any = False, reverse: bool = False) -> Sequence[NoteId]:
         """Return all fake note IDs for any query."""
-        return list(self.notes.keys())
+        return [NoteId(nid) for nid in self.notes]
+
+
+class RecordingProgress(ProgressReporter):
+    """Progress reporter that records updates and cancels after a number of checks."""
+
+    def __init__(self, cancel_after: Optional[int] = None) -> None:
+        """Set how many cancellation checks pass before the operation is cancelled."""
+        self.updates: list[int] = []
+        self.messages: list[str] = []
+        self.total: Optional[int] = None
+        self.finished = False
+        self._checks_left = cancel_after
+
+    def start(self, label: str, total: int) -> None:
+        """Record the total."""
+        self.total = total
+
+    def update(self, label: str, done: int) -> None:
+        """Record progress."""
+        self.updates.append(done)
+
+    def want_cancel(self) -> bool:
+        """Cancel once the allowed number of checks is used up."""
+        if self._checks_left is not None:
+            if self._checks_left <= 0:
+                self.cancelled = True
+            self._checks_left -= 1
+        return self.cancelled
+
+    def notify(self, message: str) -> None:
+        """Record the message."""
+        self.messages.append(message)
+
+    def finish(self) -> None:
+        """Record that reporting has stopped."""
+        self.finished = True
@@ -0,0 +1,104 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import io
+import json
+import pathlib
+import subprocess
+import sys
+
+import anki.lang
+import pytest
+from anki.collection import Collection
+
+from merge_notes.bulk_reader import database
+from merge_notes.cli import FileConfig, StderrProgress, main
+
+
+def make_collection(path: pathlib.Path, fronts: list[str]) -> None:
+    """Create a collection with one Basic note per front."""
+    col = Collection(str(path))
+    try:
+        basic, deck_id = col.models.by_name("Basic"), col.decks.id("Default")
+        assert basic and deck_id
+        for front in fronts:
+            note = col.new_note(basic)
+            note["Front"] = front
+            note["Back"] = f"back of {front}"
+            col.add_note(note, deck_id)
+    finally:
+        col.close()
+
+
+def read_fronts(path: pathlib.Path) -> list[str]:
+    """Return the fields of all notes."""
+    anki.lang.set_lang("en")
+    col = Collection(str(path))
+    try:
+        return database(col).list("SELECT flds FROM notes")
+    finally:
+        col.close()
+
+
+def test_cli_does_not_import_aqt() -> None:
+    """The command-line tool runs on machines without Qt, so neither it nor the search and merge code import aqt."""
+    code = "import sys, merge_notes.cli; sys.exit('aqt' in sys.modules)"
+    root = pathlib.Path(__file__).parent.parent
+    assert subprocess.run([sys.executable, "-c", code], cwd=root).returncode == 0
+
+
+def test_file_config_overrides_defaults(tmp_path: pathlib.Path) -> None:
+    """Settings in the file override the defaults, other settings keep their default values."""
+    (path := tmp_path / "config.json").write_text(json.dumps({"original_notes_action": "delete"}))
+    cfg = FileConfig(str(path))
+    assert cfg["original_notes_action"] == "delete"
+    assert cfg["field_separator"] == FileConfig()["field_separator"]
+    assert cfg.persistent_duplicate_index is False
+
+
+def test_file_config_rejects_unknown_keys(tmp_path: pathlib.Path) -> None:
+    """A misspelled key is an error rather than a silently ignored setting."""
+    (path := tmp_path / "config.json").write_text(json.dumps({"orignal_notes_action": "delete"}))
+    with pytest.raises(ValueError, match="orignal_notes_action"):
+        FileConfig(str(path))
+
+
+@pytest.mark.parametrize(
+    "updates,expected_lines",
+    [
+        ([(1, 10)], ["start"]),
+        ([(1, 10), (10, 10)], ["start", "done"]),
+    ],
+)
+def test_stderr_progress_skips_frequent_updates(updates: list[tuple[int, int]], expected_lines: list[str]) -> None:
+    """Updates are printed at most once per interval, but the final one is always printed."""
+    stream = io.StringIO()
+    progress = StderrProgress(stream, min_interval=3600)
+    progress.start("start", 10)
+    for done, total in updates:
+        progress.update("done" if done == total else "working", done)
+    assert stream.getvalue().splitlines() == expected_lines
+
+
+@pytest.mark.parametrize(
+    "extra_args,expected_fronts",
+    [
+        ([], ["a", "b"]),
+        (["--dry-run"], ["a", "a", "b"]),
+    ],
+)
+def test_main_merges_duplicates(tmp_path: pathlib.Path, extra_args: list[str], expected_fronts: list[str]) -> None:
+    """Duplicates are merged into one note and the rest are deleted, unless it's a dry run."""
+    (config_path := tmp_path / "config.json").write_text(json.dumps({"original_notes_action": "delete"}))
+    make_collection(collection_path := tmp_path / "collection.anki2", ["a", "b", "a"])
+
+    status = main([str(collection_path), "--field", "Front", "--config", str(config_path), "--quiet", *extra_args])
+
+    assert status == 0
+    assert sorted(flds.split("\x1f")[0] for flds in read_fronts(collection_path)) == expected_fronts
+
+
+def test_main_reports_bad_config(tmp_path: pathlib.Path) -> None:
+    """A config that can't be read stops the tool before the collection is opened."""
+    (config_path := tmp_path / "config.json").write_text("{")
+    assert main([str(tmp_path / "missing.anki2"), "--field", "Front", "--config", str(config_path)]) == 2
@@ -2,11 +2,14 @@
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
 import sys
+from collections.abc import Callable
+from typing import Any
 
 import pytest
 
-from merge_notes.config import due_key, generic_numeric_key
+from merge_notes import config
 from merge_notes.config_types import OrderingChoice, OriginalNotesAction, SortOrder
+from merge_notes.config_view import ConfigSnapshot, due_key, generic_numeric_key
 from playground.no_anki_config import NoAnkiConfigView
 from tests.helpers import FakeCard
 
@@ -139,3 +142,59 @@ def test_generic_numeric_key(cmp_str: str, expected_first: int) -> None:
     result = key_fn(None)
     assert result[0] == expected_first
     assert result[1] == cmp_str
+
+
+def test_snapshot_resolves_settings(no_anki_config: NoAnkiConfigView) -> None:
+    """The snapshot holds settings converted the same way as the config properties."""
+    no_anki_config["original_notes_action"] = "bogus"
+    no_anki_config["field_separator"] = r"\n"
+    no_anki_config["limit_to_fields"] = ["A", "B", "A"]
+    no_anki_config["duplicate_key_fields"] = ["Reading"]
+    cfg = no_anki_config.snapshot()
+    assert cfg.original_notes_action is OriginalNotesAction.do_nothing
+    assert (cfg.field_separator, cfg.separator) == (r"\n", "\n")
+    assert cfg.limit_to_fields == frozenset(("A", "B"))
+    assert cfg.duplicate_key_fields == ("Reading",)
+    assert cfg.normalizer is no_anki_config.normalizer
+    assert cfg.snapshot() is cfg
+    assert all(hasattr(cfg, name) for name in ConfigSnapshot.__slots__)
+
+
+def test_snapshot_is_read_only(no_anki_config: NoAnkiConfigView) -> None:
+    """Changing the config doesn't change a snapshot, and the snapshot itself can't be changed."""
+    cfg = no_anki_config.snapshot()
+    no_anki_config["sort_order"] = SortOrder.descending.name
+    no_anki_config["ignore_punctuation"] = not cfg.ignore_punctuation
+    assert cfg.sort_order is SortOrder.ascending
+    assert cfg.normalizer is not no_anki_config.normalizer
+    with pytest.raises(AttributeError):
+        cfg.merge_tags = False  # type: ignore[misc]
+    with pytest.raises(AttributeError):
+        del cfg.merge_tags
+    with pytest.raises(AttributeError):
+        cfg.unknown_setting = True  # type: ignore[attr-defined]
+
+
+def test_snapshot_keeps_its_normalized_values(no_anki_config: NoAnkiConfigView) -> None:
+    """Values seen through a snapshot stay normalized with its settings after the config changes."""
+    no_anki_config["ignore_punctuation"] = True
+    cfg = no_anki_config.snapshot()
+    assert cfg.normalized_values("a！") == "a"
+    no_anki_config["ignore_punctuation"] = False
+    assert no_anki_config.normalized_values("a！") != "a"
+    assert cfg.normalized_values("a！") == cfg.normalizer("a！") == "a"
+    assert cfg.normalized_values.normalizer is cfg.normalizer
+
+
+def test_global_config_is_shared(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Every module gets the same config object, so that changed settings reach all hooks."""
+    update_actions: list[Callable[[dict[str, Any]], None]] = []
+    monkeypatch.setattr(config, "mw", object())
+    monkeypatch.setattr(config, "MergeNotesConfig", NoAnkiConfigView)
+    monkeypatch.setattr(config, "set_config_update_action", update_actions.append)
+    config.get_global_config.cache_clear()
+    try:
+        assert config.get_global_config() is config.get_global_config()
+        assert len(update_actions) == 1
+    finally:
+        config.get_global_config.cache_clear()
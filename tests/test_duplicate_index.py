@@ -0,0 +1,120 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import pathlib
+from collections.abc import Iterator
+
+import pytest
+from anki.notes import NoteId
+
+from merge_notes.duplicate_index import DuplicateIndex, ProfileIndex
+from merge_notes.duplicate_search import DuplicateSearch, PartialDuplicateGroups
+from merge_notes.progress import ProgressReporter
+from playground.no_anki_config import NoAnkiConfigView
+from tests.helpers import FakeNote, FakeSearchCollection, RecordingProgress
+
+
+@pytest.fixture()
+def index(tmp_path: pathlib.Path) -> Iterator[DuplicateIndex]:
+    """Return an empty index stored in a temporary file."""
+    index = DuplicateIndex(str(tmp_path / "index.sqlite"))
+    index.ensure_fingerprint("fingerprint")
+    yield index
+    index.close()
+
+
+def make_collection() -> FakeSearchCollection:
+    """Return a collection with two groups of duplicates and a note without the searched field."""
+    return FakeSearchCollection([
+        FakeNote(1, {"Front": "<b>a</b>"}),
+        FakeNote(2, {"Front": "a"}),
+        FakeNote(3, {"Front": "b"}),
+        FakeNote(4, {"Front": "b！"}),
+        FakeNote(5, {"Front": "c"}),
+        FakeNote(6, {"Other": "a"}),
+    ])
+
+
+def test_refresh_normalizes_only_changed_notes(no_anki_config: NoAnkiConfigView, index: DuplicateIndex) -> None:
+    """A second refresh only processes notes whose modification time changed."""
+    col = make_collection()
+    nids = list(col.notes)
+    normalize = no_anki_config.normalizer
+
+    assert index.refresh(col, nids, "Front", normalize, ProgressReporter(), batch_size=2) == (6, 6)
+    assert index.duplicates(nids, "Front") == [("a", [1, 2]), ("b", [3, 4])]
+    assert index.refresh(col, nids, "Front", normalize, ProgressReporter()) == (6, 0)
+
+    note = col.notes[NoteId(5)]
+    note["Front"] = "a"
+    note.mod = 1
+    col.db.add_note(note)
+
+    assert index.refresh(col, nids, "Front", normalize, ProgressReporter()) == (6, 1)
+    assert index.duplicates(nids, "Front") == [("a", [1, 2, 5]), ("b", [3, 4])]
+
+
+def test_duplicates_limited_to_search_scope(no_anki_config: NoAnkiConfigView, index: DuplicateIndex) -> None:
+    """Only notes matched by the current search are grouped."""
+    col = make_collection()
+    index.refresh(col, list(col.notes), "Front", no_anki_config.normalizer, ProgressReporter())
+    assert index.duplicates([NoteId(nid) for nid in (1, 3, 4)], "Front") == [("b", [3, 4])]
+
+
+def test_fingerprint_change_drops_entries(no_anki_config: NoAnkiConfigView, index: DuplicateIndex) -> None:
+    """Entries computed with other comparison settings are discarded."""
+    col = make_collection()
+    nids = list(col.notes)
+    index.refresh(col, nids, "Front", no_anki_config.normalizer, ProgressReporter())
+    index.ensure_fingerprint("fingerprint")
+    assert index.refresh(col, nids, "Front", no_anki_config.normalizer, ProgressReporter()) == (6, 0)
+    index.ensure_fingerprint("other fingerprint")
+    assert index.refresh(col, nids, "Front", no_anki_config.normalizer, ProgressReporter()) == (6, 6)
+
+
+def test_removed_notes_are_forgotten(no_anki_config: NoAnkiConfigView, index: DuplicateIndex) -> None:
+    """Deleted notes no longer appear in groups."""
+    col = make_collection()
+    index.refresh(col, list(col.notes), "Front", no_anki_config.normalizer, ProgressReporter())
+    index.remove_notes([NoteId(2)])
+    assert index.duplicates(list(col.notes), "Front") == [("b", [3, 4])]
+
+
+def test_duplicates_keep_scan_order(no_anki_config: NoAnkiConfigView, tmp_path: pathlib.Path) -> None:
+    """Groups come in the order their first note is scanned, not sorted by value."""
+    col = FakeSearchCollection(FakeNote(nid, {"Front": value}) for nid, value in enumerate("baba", start=1))
+    search = DuplicateSearch(no_anki_config, ProfileIndex(lambda: str(tmp_path / "index.sqlite")))
+    expected = search.find(col, "Front", "", ProgressReporter())
+    assert expected == [("b", [1, 3]), ("a", [2, 4])]
+    no_anki_config["persistent_duplicate_index"] = True
+    assert search.find(col, "Front", "", ProgressReporter()) == expected
+    search.close_index()
+
+
+def test_deep_search_answers_from_index(no_anki_config: NoAnkiConfigView, tmp_path: pathlib.Path) -> None:
+    """With the persistent index enabled, the search gives the same groups as a full scan."""
+    col = make_collection()
+    search = DuplicateSearch(no_anki_config, ProfileIndex(lambda: str(tmp_path / "index.sqlite")))
+    expected = search.find(col, "Front", "", ProgressReporter())
+    no_anki_config["persistent_duplicate_index"] = True
+    assert search.find(col, "Front", "", ProgressReporter()) == expected
+    assert search.find(col, "Front", "", ProgressReporter()) == expected
+    search.close_index()
+
+
+def test_cancelled_refresh_skips_stale_entries(no_anki_config: NoAnkiConfigView, tmp_path: pathlib.Path) -> None:
+    """If the user cancels while the index is updated, notes whose entries are out of date aren't grouped."""
+    col = make_collection()
+    search = DuplicateSearch(no_anki_config, ProfileIndex(lambda: str(tmp_path / "index.sqlite")))
+    no_anki_config["persistent_duplicate_index"] = True
+    assert search.find(col, "Front", "", ProgressReporter()) == [("a", [1, 2]), ("b", [3, 4])]
+
+    note = col.notes[NoteId(3)]
+    note["Front"] = "x"
+    note.mod = 1
+    col.db.add_note(note)
+
+    result = search.find(col, "Front", "", RecordingProgress(cancel_after=0))
+    assert isinstance(result, PartialDuplicateGroups)
+    assert result == []
+    search.close_index()
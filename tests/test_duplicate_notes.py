@@ -0,0 +1,96 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import pathlib
+from collections.abc import Iterator, Sequence
+
+import pytest
+from anki.cards import CardId
+from anki.collection import Collection
+from anki.notes import NoteId
+
+from merge_notes.bulk_reader import database, note_ids_of_cards
+from merge_notes.duplicate_notes import NoteDuplicator, n_gettext_duplicate
+from merge_notes.progress import ProgressReporter
+from playground.no_anki_config import NoAnkiConfigView
+
+
+class CancelAfter(ProgressReporter):
+    """Progress reporter that asks to cancel after a number of batches."""
+
+    def __init__(self, n_batches: int) -> None:
+        """Cancel after n_batches batches."""
+        self._n_batches = n_batches
+
+    def want_cancel(self) -> bool:
+        """Count the batch and return whether the limit is reached."""
+        self.cancelled = self._n_batches <= 0
+        self._n_batches -= 1
+        return self.cancelled
+
+
+@pytest.fixture
+def col(tmp_path: pathlib.Path) -> Iterator[Collection]:
+    """Return a collection with Basic notes a, b and c. Note b is in the Other deck and tagged leech."""
+    col = Collection(str(tmp_path / "collection.anki2"))
+    try:
+        basic, default_id, other_id = col.models.by_name("Basic"), col.decks.id("Default"), col.decks.id("Other")
+        assert basic and default_id and other_id
+        for front in "abc":
+            note = col.new_note(basic)
+            note["Front"] = front
+            note.tags = ["leech", "vocab"] if front == "b" else ["vocab"]
+            col.add_note(note, other_id if front == "b" else default_id)
+        yield col
+    finally:
+        col.close()
+
+
+def added_notes(col: Collection, old_nids: Sequence[NoteId]) -> list[tuple[str, list[str], str]]:
+    """Return (front, tags, deck name) of notes that aren't in old_nids, in the order they were added."""
+    result = []
+    for nid in database(col).list("SELECT id FROM notes ORDER BY id"):
+        if nid not in old_nids:
+            note = col.get_note(nid)
+            result.append((note["Front"], note.tags, col.decks.name(note.cards()[0].did)))
+    return result
+
+
+@pytest.mark.parametrize("copies", [1, 3])
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_duplicate_notes(col: Collection, no_anki_config: NoAnkiConfigView, copies: int, batch_size: int) -> None:
+    """Each round of copies follows the given order, copies go to the home deck, and leech tags aren't copied."""
+    no_anki_config["duplicate_notes_batch_size"] = batch_size
+    old_nids = col.find_notes("")
+    nids = [old_nids[2], old_nids[1], old_nids[0]]
+
+    report = NoteDuplicator(col, no_anki_config).op(nids, copies)
+
+    assert report.summary() == n_gettext_duplicate(3, is_done=True, copies=copies)
+    assert report.n_added == 3 * copies
+    assert added_notes(col, old_nids) == copies * [
+        ("c", ["vocab"], "Default"),
+        ("b", ["vocab"], "Other"),
+        ("a", ["vocab"], "Default"),
+    ]
+    col.undo()
+    assert col.find_notes("") == old_nids
+
+
+def test_duplicate_notes_cancelled(col: Collection, no_anki_config: NoAnkiConfigView) -> None:
+    """Batches added before the user cancels are kept."""
+    no_anki_config["duplicate_notes_batch_size"] = 2
+    old_nids = col.find_notes("")
+
+    report = NoteDuplicator(col, no_anki_config).op(old_nids, copies=2, progress=CancelAfter(2))
+
+    assert report.cancelled
+    assert report.summary() == "Cancelled. Added 4 of 6 notes."
+    assert [front for front, _, _ in added_notes(col, old_nids)] == ["a", "b", "c", "a"]
+
+
+def test_note_ids_of_cards(col: Collection) -> None:
+    """Notes are listed once, in the order of their first selected card. Nonexistent cards are skipped."""
+    cids = col.find_cards("")
+    nids = [col.get_card(cid).nid for cid in cids]
+    assert note_ids_of_cards(col, [cids[1], CardId(999), cids[0], cids[1]], batch_size=1) == [nids[1], nids[0]]
@@ -0,0 +1,139 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import pytest
+from anki.notes import NoteId
+
+from merge_notes import duplicate_search
+from merge_notes.bulk_reader import batched, field_values, multi_field_value_batches
+from merge_notes.duplicate_search import (
+    DuplicateSearch,
+    PartialDuplicateGroups,
+    group_by_key,
+)
+from playground.no_anki_config import NoAnkiConfigView
+from tests.helpers import FakeNote, FakeSearchCollection, RecordingProgress
+
+
+@pytest.mark.parametrize(
+    "items,size,expected",
+    [
+        ([1, 2, 3, 4, 5], 2, [[1, 2], [3, 4], [5]]),
+        ([1, 2], 5, [[1, 2]]),
+        ([], 3, []),
+    ],
+)
+def test_batched(items: list[int], size: int, expected: list[list[int]]) -> None:
+    """Items are split into consecutive batches."""
+    assert [list(batch) for batch in batched(items, size)] == expected
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 100])
+def test_field_values_reads_field_by_note_type(batch_size: int) -> None:
+    """Field values are read for every note type that has the field, skipping the rest."""
+    col = FakeSearchCollection([
+        FakeNote(1, {"Front": "a", "Back": "b"}),
+        FakeNote(2, {"Back": "c", "Front": "d"}),
+        FakeNote(3, {"Other": "e"}),
+        FakeNote(4, {"Front": "f", "Back": "g"}),
+    ])
+    result = sorted(field_values(col, [NoteId(nid) for nid in (1, 2, 3, 4, 999)], "Front", batch_size=batch_size))
+    assert result == [(1, "a"), (2, "d"), (4, "f")]
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_multi_field_values_keep_field_order(batch_size: int) -> None:
+    """All key fields are read in one pass, in the requested order, skipping notes that lack any of them."""
+    col = FakeSearchCollection([
+        FakeNote(1, {"Front": "a", "Audio": "x"}),
+        FakeNote(2, {"Audio": "y", "Front": "b"}),
+        FakeNote(3, {"Front": "c"}),
+    ])
+    batches = multi_field_value_batches(
+        col, [NoteId(nid) for nid in (1, 2, 3)], ["Front", "Audio"], batch_size=batch_size
+    )
+    assert sorted(row for batch in batches for row in batch) == [(1, ("a", "x")), (2, ("b", "y"))]
+
+
+def test_group_by_key_keeps_keys_with_equal_labels() -> None:
+    """Keys that are shown the same way are still separate groups."""
+    keys = [("a | b", "c"), ("a", "b | c"), ("a | b", "c"), ("a", "b | c")]
+    assert group_by_key((NoteId(nid), key) for nid, key in enumerate(keys, start=1)) == [
+        ("a | b | c", [1, 3]),
+        ("a | b | c", [2, 4]),
+    ]
+
+
+@pytest.mark.parametrize(
+    "notes,key_fields,expected",
+    [
+        # Both fields must match. Punctuation is ignored as usual.
+        (
+            [("word", "a.ogg"), ("<b>word</b>", "a.ogg"), ("word", "b.ogg")],
+            ["Audio"],
+            [("word | aogg", [1, 2])],
+        ),
+        # The searched field is not compared twice.
+        ([("word", "a.ogg"), ("word", "b.ogg")], ["Front"], [("word", [1, 2])]),
+        # Extra fields may be empty, but they still have to be equal.
+        ([("word", ""), ("word", ""), ("word", "a.ogg")], ["Audio"], [("word | ", [1, 2])]),
+        ([("", "a.ogg"), ("", "a.ogg")], ["Audio"], []),
+    ],
+)
+def test_deep_search_duplicates_with_key_fields(
+    no_anki_config: NoAnkiConfigView,
+    notes: list[tuple[str, str]],
+    key_fields: list[str],
+    expected: list,
+) -> None:
+    """Notes are grouped only when all key fields match after normalization."""
+    no_anki_config["duplicate_key_fields"] = key_fields
+    col = FakeSearchCollection(
+        FakeNote(nid, {"Front": front, "Audio": audio}) for nid, (front, audio) in enumerate(notes, start=1)
+    )
+    assert DuplicateSearch(no_anki_config).find(col, "Front", "") == expected
+
+
+@pytest.mark.parametrize(
+    "values,expected",
+    [
+        (["<b>word</b>", "word", "other"], [("word", [1, 2])]),
+        (["a", "b", "c"], []),
+        (["", "", "x"], []),
+        (["１２", "12", "12！"], [("12", [1, 2, 3])]),
+    ],
+)
+def test_deep_search_duplicates(no_anki_config: NoAnkiConfigView, values: list[str], expected: list) -> None:
+    """Notes are grouped by their normalized field value, ignoring empty values."""
+    col = FakeSearchCollection(FakeNote(nid, {"Front": value}) for nid, value in enumerate(values, start=1))
+    search = DuplicateSearch(no_anki_config)
+    assert search.find(col, "Front", "") == expected
+
+
+@pytest.mark.parametrize(
+    "cancel_after,expected_groups,expected_updates",
+    [
+        (None, [("a", [1, 3, 5]), ("b", [2, 4, 6])], [2, 4, 6]),
+        (2, [("a", [1, 3]), ("b", [2, 4])], [2, 4]),
+        (0, [], []),
+    ],
+)
+def test_deep_search_duplicates_reports_progress_and_cancels(
+    monkeypatch: pytest.MonkeyPatch,
+    no_anki_config: NoAnkiConfigView,
+    cancel_after: int,
+    expected_groups: list,
+    expected_updates: list[int],
+) -> None:
+    """The search reports progress after every batch, stops when cancelled and marks the result as partial."""
+    monkeypatch.setattr(duplicate_search, "SEARCH_BATCH_SIZE", 2)
+    col = FakeSearchCollection(FakeNote(nid, {"Front": "ab"[(nid - 1) % 2]}) for nid in range(1, 7))
+    progress = RecordingProgress(cancel_after=cancel_after)
+
+    result = DuplicateSearch(no_anki_config).find(col, "Front", "", progress)
+
+    assert result == expected_groups
+    assert isinstance(result, PartialDuplicateGroups) == (cancel_after is not None)
+    assert progress.total == 6
+    assert progress.updates == expected_updates
+    assert progress.finished
@@ -0,0 +1,69 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import random
+
+import pytest
+from anki.notes import NoteId
+
+from merge_notes import duplicate_search, fingerprints
+from merge_notes.duplicate_search import DuplicateSearch
+from merge_notes.fingerprints import repeated_fingerprints
+from playground.no_anki_config import NoAnkiConfigView
+from tests.helpers import FakeNote, FakeSearchCollection
+
+needs_numpy = pytest.mark.skipif(not fingerprints.numpy_available(), reason="NumPy isn't installed")
+
+
+def make_collection(values: list[str]) -> FakeSearchCollection:
+    """Return a collection with one note per value."""
+    return FakeSearchCollection(FakeNote(nid, {"Front": value}) for nid, value in enumerate(values, start=1))
+
+
+def random_values(seed: int) -> list[str]:
+    """Return field values with many duplicates, some of them differing only in ignored characters."""
+    rng = random.Random(seed)
+    return [rng.choice(["", "a", "b", "<b>a</b>", "ab", "a!", "ｂ", "ba", "abc"]) for _ in range(200)]
+
+
+@needs_numpy
+@pytest.mark.parametrize(
+    "pairs,expected",
+    [
+        ([(1, "a"), (2, "b"), (3, "a"), (4, "c"), (5, "b")], [1, 2, 3, 5]),
+        ([(1, "a"), (2, "b")], []),
+        ([(1, "a")], []),
+        ([], []),
+    ],
+)
+def test_repeated_fingerprints(pairs: list[tuple[NoteId, str]], expected: list[NoteId]) -> None:
+    """Only notes whose fingerprint occurs more than once are kept, in scan order."""
+    assert repeated_fingerprints(pairs) == expected
+
+
+@needs_numpy
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("colliding", [False, True])
+def test_fingerprint_search_matches_default_search(
+    monkeypatch: pytest.MonkeyPatch, no_anki_config: NoAnkiConfigView, seed: int, colliding: bool
+) -> None:
+    """Groups and their order are the same as without fingerprints, even if different values collide."""
+    monkeypatch.setattr(duplicate_search, "SEARCH_BATCH_SIZE", 7)
+    if colliding:
+        monkeypatch.setattr(fingerprints, "fingerprint", len)
+    col = make_collection(random_values(seed))
+    expected = DuplicateSearch(no_anki_config).find(col, "Front", "")
+
+    no_anki_config["fingerprint_duplicate_search"] = True
+    result = DuplicateSearch(no_anki_config).find(col, "Front", "")
+
+    assert result == expected
+    assert len(result) > 1
+
+
+def test_fingerprint_search_without_numpy(monkeypatch: pytest.MonkeyPatch, no_anki_config: NoAnkiConfigView) -> None:
+    """Without NumPy, the search runs as usual."""
+    monkeypatch.setattr(fingerprints, "HAS_NUMPY", False)
+    no_anki_config["fingerprint_duplicate_search"] = True
+    col = make_collection(["a", "b", "a!"])
+    assert DuplicateSearch(no_anki_config).find(col, "Front", "") == [("a", [1, 3])]
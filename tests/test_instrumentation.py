@@ -0,0 +1,105 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import pytest
+
+from merge_notes import instrumentation
+from merge_notes.config_types import OriginalNotesAction
+from merge_notes.duplicate_search import DuplicateSearch
+from merge_notes.instrumentation import (
+    NullProfiler,
+    Profiler,
+    new_profiler,
+    recent_operations,
+    summary_text,
+)
+from merge_notes.merging import MergeNotes
+from playground.no_anki_config import NoAnkiConfigView
+from tests.helpers import FakeCollection, FakeNote, FakeSearchCollection
+
+
+@pytest.fixture(autouse=True)
+def clear_recent_operations() -> None:
+    """Start every test without recorded operations."""
+    instrumentation._recent_operations.clear()
+
+
+@pytest.mark.parametrize(
+    "enabled,trace_memory,expected_type",
+    [
+        (False, False, NullProfiler),
+        (False, True, NullProfiler),
+        (True, False, Profiler),
+    ],
+)
+def test_new_profiler(no_anki_config: NoAnkiConfigView, enabled: bool, trace_memory: bool, expected_type: type) -> None:
+    """Instrumentation is off unless enabled in the config."""
+    no_anki_config["instrumentation"] = enabled
+    no_anki_config["instrumentation_trace_memory"] = trace_memory
+    assert type(new_profiler(no_anki_config, "test")) is expected_type
+
+
+@pytest.mark.parametrize("trace_memory", [False, True])
+def test_profiler_records_phases(trace_memory: bool) -> None:
+    """Repeated phases add up, iterated phases count every produced item, and the operation is recorded."""
+    profiler = Profiler("test", trace_memory=trace_memory)
+    for _ in range(3):
+        with profiler.phase("a"):
+            _ = [0] * 1000
+    assert list(profiler.iterate("b", range(2))) == [0, 1]
+    profiler.count("notes", 5)
+
+    record = profiler.finish()
+
+    assert record is not None
+    assert record["phases"]["a"]["calls"] == 3
+    assert record["phases"]["b"]["calls"] == 3  # two items and the end of the iteration
+    assert ("peak_kib" in record["phases"]["a"]) is trace_memory
+    assert record["counters"] == {"notes": 5}
+    assert recent_operations() == [record]
+    assert "test" in summary_text()
+
+
+def test_null_profiler_records_nothing() -> None:
+    """A disabled profiler measures and records nothing."""
+    profiler = NullProfiler("test")
+    with profiler.phase("a"):
+        pass
+    assert list(profiler.iterate("b", [1, 2])) == [1, 2]
+    assert profiler.finish() is None
+    assert recent_operations() == []
+    assert summary_text() == "No Merge Notes operations have been measured yet."
+
+
+@pytest.mark.parametrize(
+    "action,expected_phases",
+    [
+        (OriginalNotesAction.do_nothing, {"merge", "update_notes", "remove_notes", "suspend_cards"}),
+        (OriginalNotesAction.delete, {"merge", "update_notes", "remove_notes", "suspend_cards"}),
+    ],
+)
+def test_merge_notes_op_is_instrumented(
+    no_anki_config: NoAnkiConfigView, action: OriginalNotesAction, expected_phases: set[str]
+) -> None:
+    """Every phase of a merge is measured when instrumentation is on."""
+    no_anki_config["instrumentation"] = True
+    no_anki_config["original_notes_action"] = action.name
+    notes = [FakeNote(1, {"A": "one"}), FakeNote(2, {"A": "two"})]
+
+    MergeNotes(FakeCollection(notes), no_anki_config).op(notes)
+
+    (record,) = recent_operations()
+    assert set(record["phases"]) == expected_phases
+    assert record["counters"] == {"notes": 2}
+
+
+def test_deep_search_is_instrumented(no_anki_config: NoAnkiConfigView) -> None:
+    """The duplicate search measures the search, reading and grouping phases."""
+    no_anki_config["instrumentation"] = True
+    col = FakeSearchCollection(FakeNote(nid, {"Front": "same"}) for nid in range(1, 4))
+
+    DuplicateSearch(no_anki_config).find(col, "Front", "")
+
+    (record,) = recent_operations()
+    assert set(record["phases"]) == {"search_notes", "group", "read_fields"}
+    assert record["counters"] == {"notes": 3}
@@ -0,0 +1,139 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import pathlib
+from collections.abc import Callable, Iterator
+
+import pytest
+from anki.collection import Collection
+from anki.notes import Note, NoteId
+
+from merge_notes.bulk_reader import database
+from merge_notes.config_view import ConfigSnapshot
+from merge_notes.live_duplicates import (
+    LiveDuplicateCheck,
+    LiveIndex,
+    find_live_duplicates,
+)
+from playground.no_anki_config import NoAnkiConfigView
+
+
+@pytest.fixture
+def col(tmp_path: pathlib.Path) -> Iterator[Collection]:
+    """Return a collection with Basic notes whose fronts are a, <b>a</b>, b and an empty field."""
+    col = Collection(str(tmp_path / "collection.anki2"))
+    try:
+        basic, deck_id = col.models.by_name("Basic"), col.decks.id("Default")
+        assert basic and deck_id
+        for front in ("a", "<b>a</b>", "b", ""):
+            note = col.new_note(basic)
+            note["Front"] = front
+            note["Back"] = "back"
+            col.add_note(note, deck_id)
+        yield col
+    finally:
+        col.close()
+
+
+def built_index(col: Collection, cfg: ConfigSnapshot, field_name: str = "Front") -> LiveIndex:
+    """Return an index of the field of all notes."""
+    index = LiveIndex(field_name, cfg.normalizer.fingerprint)
+    index.update(col, cfg.normalized_values)
+    return index
+
+
+def test_index_candidates(col: Collection, no_anki_config: NoAnkiConfigView) -> None:
+    """Notes are indexed by normalized value. Empty values and the excluded note aren't returned."""
+    cfg = no_anki_config.snapshot()
+    nids = col.find_notes("")
+    index = built_index(col, cfg)
+
+    assert index.is_built
+    assert len(index) == 3
+    assert index.candidates("a") == [nids[0], nids[1]]
+    assert index.candidates("a", exclude=nids[0]) == [nids[1]]
+    assert index.candidates("") == []
+
+
+def test_index_reads_only_modified_notes(col: Collection, no_anki_config: NoAnkiConfigView) -> None:
+    """After the first update, only notes modified since the last update are read again."""
+    cfg = no_anki_config.snapshot()
+    nids = col.find_notes("")
+    database(col).execute("UPDATE notes SET mod = 100")
+    index = built_index(col, cfg)
+    database(col).execute("UPDATE notes SET mod = 50")
+    note = col.get_note(nids[2])
+    note["Front"] = "a"
+    col.update_note(note)
+
+    assert index.update(col, cfg.normalized_values) == 1
+    assert index.candidates("a") == [nids[0], nids[1], nids[2]]
+    assert index.candidates("b") == []
+
+
+def test_set_value_and_remove_notes(no_anki_config: NoAnkiConfigView) -> None:
+    """Setting a value moves the note to it, an empty value removes the note, and so does removing the note."""
+    index = LiveIndex("Front", no_anki_config.normalizer.fingerprint)
+    index.set_value(NoteId(1), "a")
+    index.set_value(NoteId(2), "a")
+    index.set_value(NoteId(1), "b")
+    assert (index.candidates("a"), index.candidates("b")) == ([2], [1])
+    index.set_value(NoteId(1), "")
+    index.remove_notes([NoteId(2)])
+    assert (len(index), index.candidates("a"), index.candidates("b")) == (0, [], [])
+
+
+def test_changed_and_deleted_notes_arent_reported(col: Collection, no_anki_config: NoAnkiConfigView) -> None:
+    """Candidates are read again, so notes changed or deleted after the update don't count as duplicates."""
+    cfg = no_anki_config.snapshot()
+    nids = col.find_notes("")
+    index = built_index(col, cfg)
+    assert find_live_duplicates(col, index, "a", cfg.normalized_values) == [nids[0], nids[1]]
+
+    note = col.get_note(nids[0])
+    note["Front"] = "c"
+    col.update_note(note)
+    col.remove_notes([nids[1]])
+
+    assert find_live_duplicates(col, index, "a", cfg.normalized_values) == []
+
+
+@pytest.mark.parametrize(
+    "fields,front,back,expected",
+    [
+        ([], "<b>a</b>", "back", [0]),
+        ([], "c", "back", []),
+        (["Back"], "a", "back", [1]),
+        (["Front", "Back"], "b", "back", [0, 1]),
+        (["Missing", "Front"], "a", "", [0]),
+    ],
+)
+def test_duplicate_field_ords(
+    monkeypatch: pytest.MonkeyPatch,
+    col: Collection,
+    no_anki_config: NoAnkiConfigView,
+    fields: list[str],
+    front: str,
+    back: str,
+    expected: list[int],
+) -> None:
+    """Only configured fields, or the first field, are checked once their index is built."""
+    no_anki_config["live_duplicate_fields"] = fields
+    check = LiveDuplicateCheck(no_anki_config)
+    ready = []
+
+    def update_now(cfg: ConfigSnapshot, index: LiveIndex, on_done: Callable[[], None]) -> None:
+        """Update the index right away instead of in a background operation."""
+        index.update(col, cfg.normalized_values)
+        on_done()
+
+    monkeypatch.setattr(check, "_update_in_background", update_now)
+    basic = col.models.by_name("Basic")
+    assert basic
+    note: Note = col.new_note(basic)
+    note["Front"] = front
+    note["Back"] = back
+
+    assert check.duplicate_field_ords(col, note, on_index_ready=lambda: ready.append(True)) == []
+    assert len(ready) == len(check.fields_to_check(no_anki_config.snapshot(), note))
+    assert check.duplicate_field_ords(col, note, on_index_ready=lambda: ready.append(True)) == expected
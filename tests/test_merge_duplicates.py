@@ -0,0 +1,184 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import pytest
+from anki.notes import NoteId
+
+from merge_notes.bulk_reader import NoteBuilder, load_cards, load_notes
+from merge_notes.config_types import OrderingChoice, OriginalNotesAction, SortOrder
+from merge_notes.duplicate_merging import MergeDupes, carefully_get_notes
+from merge_notes.merging import MergeNotes
+from merge_notes.progress import format_eta
+from playground.no_anki_config import NoAnkiConfigView
+from tests.helpers import FakeCollection, FakeNote, RecordingProgress
+
+
+def make_collection() -> FakeCollection:
+    """Return a collection with duplicate groups of different note types and mixed due numbers."""
+    notes = [
+        FakeNote(1, {"Front": "word", "Back": "a"}, tags=["x"]),
+        FakeNote(2, {"Front": "word", "Back": "b"}, tags=["y"]),
+        FakeNote(3, {"Front": "word", "Back": "c"}),
+        FakeNote(4, {"Front": "other", "Back": "d"}),
+        FakeNote(5, {"Front": "other", "Back": "e", "Extra": "f"}),
+        FakeNote(6, {"Front": "single", "Back": "g"}),
+    ]
+    for note, due in zip(notes, [30, 10, 20, 5, 5, 1]):
+        note.cards()[0].due = due
+    return FakeCollection(notes)
+
+
+DUPES = [
+    (key, [NoteId(nid) for nid in nids]) for key, nids in [("word", [1, 2, 3]), ("other", [4, 5, 999]), ("single", [6])]
+]
+
+
+@pytest.mark.parametrize("supported", [True, False])
+def test_load_notes_and_cards(monkeypatch: pytest.MonkeyPatch, supported: bool) -> None:
+    """Notes and card attributes are built from database rows, skipping nonexistent notes."""
+    monkeypatch.setattr(NoteBuilder, "supported", supported)
+    col = make_collection()
+    first, fifth = NoteId(1), NoteId(5)
+    notes = load_notes(col, [first, fifth, NoteId(999)], batch_size=1)
+    assert sorted(notes) == [1, 5]
+    assert notes[fifth].keys() == ["Front", "Back", "Extra"]
+    assert notes[fifth]["Extra"] == "f"
+    assert notes[first].tags == ["x"]
+    cards = load_cards(col, notes)
+    assert [(card.id, card.due, card.note().id) for card in cards[first]] == [(10, 30, 1)]
+
+
+def test_notes_of_a_type_share_the_field_map() -> None:
+    """The field map is computed once per note type, not once per note."""
+    nids = [NoteId(1), NoteId(2), NoteId(5)]
+    notes = load_notes(make_collection(), nids)
+    first, second, fifth = (notes[nid] for nid in nids)
+    assert first._fmap is second._fmap
+    assert first._fmap is not fifth._fmap
+
+
+def reference_merge(col: FakeCollection, cfg: NoAnkiConfigView) -> MergeNotes:
+    """Merge duplicate groups one note at a time, the way it was done before notes were prefetched."""
+    merger = MergeNotes(col, cfg)
+    for _, dupe_nids in DUPES:
+        if len(chunk := carefully_get_notes(col, dupe_nids)) > 1:
+            chunk.sort(
+                key=lambda note: min(cfg.ord_key(card) for card in note.cards()),
+                reverse=cfg.sort_order is SortOrder.descending,
+            )
+            merger._do_merge(chunk)
+    return merger
+
+
+@pytest.mark.parametrize("action", list(OriginalNotesAction))
+@pytest.mark.parametrize("sort_order", list(SortOrder))
+@pytest.mark.parametrize("ordering", [OrderingChoice.due, OrderingChoice.card_id, OrderingChoice.sort_field])
+def test_op_matches_per_note_merge(
+    no_anki_config: NoAnkiConfigView,
+    action: OriginalNotesAction,
+    sort_order: SortOrder,
+    ordering: OrderingChoice,
+) -> None:
+    """Merging from prefetched notes gives the same result as fetching every note separately."""
+    no_anki_config["original_notes_action"] = action.name
+    no_anki_config["sort_order"] = sort_order.name
+    no_anki_config["ordering"] = ordering.name
+    expected = reference_merge(make_collection(), no_anki_config)
+
+    col = make_collection()
+    MergeDupes(col, no_anki_config).merge_groups(DUPES)
+
+    assert [(note.id, note.values(), note.tags) for note in col.updated_notes] == [
+        (note.id, note.values(), note.tags) for note in expected.notes_to_update
+    ]
+    assert col.removed_note_ids == expected.nids_to_remove
+    assert sorted(col.sched.suspended_card_ids) == sorted(nid * 10 for nid in expected.nids_to_suspend)
+
+
+@pytest.mark.parametrize(
+    "batch_size,cancel_after,expected_updated,expected_removed,expected_updates",
+    [
+        (1, None, [1, 5], [2, 3, 4], [1, 2, 3]),
+        (2, None, [1, 5], [2, 3, 4], [2, 3]),
+        (1, 1, [1], [2, 3], [1]),
+        (1, 0, [], [], []),
+    ],
+)
+def test_op_writes_batches_and_cancels(
+    no_anki_config: NoAnkiConfigView,
+    batch_size: int,
+    cancel_after: int,
+    expected_updated: list[int],
+    expected_removed: list[int],
+    expected_updates: list[int],
+) -> None:
+    """Every batch is written before the next one, and cancelling keeps what was written."""
+    no_anki_config["original_notes_action"] = OriginalNotesAction.delete.name
+    no_anki_config["avoid_content_loss"] = False
+    no_anki_config["merge_duplicates_batch_size"] = batch_size
+    col = make_collection()
+    progress = RecordingProgress(cancel_after=cancel_after)
+
+    report = MergeDupes(col, no_anki_config).merge_groups(DUPES, progress)
+
+    assert [note.id for note in col.updated_notes] == expected_updated
+    assert col.removed_note_ids == expected_removed
+    assert progress.updates == expected_updates
+    assert progress.finished
+    assert report.changes is col.changes
+    assert report.cancelled is (cancel_after is not None)
+    assert (report.n_groups_done, report.n_notes_updated, report.n_notes_removed) == (
+        expected_updates[-1] if expected_updates else 0,
+        len(expected_updated),
+        len(expected_removed),
+    )
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 100])
+def test_op_suspends_every_batch(no_anki_config: NoAnkiConfigView, batch_size: int) -> None:
+    """In suspend mode, cards of the other notes are suspended batch by batch, and nothing is kept between batches."""
+    no_anki_config["original_notes_action"] = OriginalNotesAction.suspend.name
+    no_anki_config["avoid_content_loss"] = False
+    no_anki_config["merge_duplicates_batch_size"] = batch_size
+    col = make_collection()
+    merger = MergeDupes(col, no_anki_config)
+
+    report = merger.merge_groups(DUPES, RecordingProgress())
+
+    assert sorted(col.sched.suspended_card_ids) == [20, 30, 40]
+    assert report.n_notes_suspended == 3
+    assert col.removed_note_ids == []
+    assert (merger.notes_to_update, merger.nids_to_remove, merger.nids_to_suspend) == ([], [], [])
+
+
+@pytest.mark.parametrize(
+    "elapsed,done,total,expected",
+    [
+        (10.0, 1, 4, "About 30s left."),
+        (50.0, 1, 3, "About 1m 40s left."),
+        (1.0, 0, 4, ""),
+        (1.0, 4, 4, ""),
+    ],
+)
+def test_format_eta(elapsed: float, done: int, total: int, expected: str) -> None:
+    """The time left is extrapolated from the time taken so far."""
+    assert format_eta(elapsed, done, total) == expected
+
+
+@pytest.mark.parametrize("action", list(OriginalNotesAction))
+def test_preview_matches_merge(no_anki_config: NoAnkiConfigView, action: OriginalNotesAction) -> None:
+    """A preview reports the notes the merge would change, and writes nothing."""
+    no_anki_config["original_notes_action"] = action.name
+    no_anki_config["merge_duplicates_batch_size"] = 1
+    col = make_collection()
+    preview = MergeDupes(col, no_anki_config).preview_groups(DUPES, max_diffs=10)
+    assert (col.updated_notes, col.removed_note_ids) == ([], [])
+
+    merged = make_collection()
+    report = MergeDupes(merged, no_anki_config).merge_groups(DUPES)
+    changed = {diff.nid for diff in preview.diffs}
+    assert changed <= {note.id for note in merged.updated_notes}
+    assert preview.n_notes_changed == len(changed)
+    assert preview.n_notes_removed == report.n_notes_removed
+    assert preview.n_notes_suspended == report.n_notes_suspended
+    assert preview.n_groups == len(DUPES)
@@ -1,13 +1,17 @@
 # Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+import random
 import typing
 
 import pytest
+from anki.cards import CardId
 
 from merge_notes.config_types import OriginalNotesAction, SortOrder
-from merge_notes.merge_notes import (
+from merge_notes.config_view import interpret_special_chars
+from merge_notes.instrumentation import NullProfiler
+from merge_notes.merge_notes import BrowserMenus
+from merge_notes.merging import (
     MergeNotes,
-    interpret_special_chars,
     merge_tags,
     notes_by_cards,
     pairs,
@@ -185,6 +189,119 @@ def test_do_merge_original_notes_actions(
     assert [note.id for note in merger.notes_to_update] == updated_ids
 
 
+def random_notes(rng: random.Random, count: int) -> list[FakeNote]:
+    """Return notes with a mix of empty, equal, equal-after-normalization and distinct field values."""
+    values = ["", " ", "a", "a.", "<b>a</b>", "b", "ab", "a<br>b", "abab", "b a b"]
+    notes = []
+    for nid in range(1, count + 1):
+        fields = {name: rng.choice(values) for name in ("A", "B", "C") if name == "A" or rng.random() < 0.7}
+        notes.append(FakeNote(nid, fields, tags=rng.sample(["x", "y", "leech"], k=rng.randint(0, 2))))
+    return notes
+
+
+def reference_cascade_merge(merger: MergeNotes, notes: list[FakeNote]) -> None:
+    """Merge adjacent pairs of notes the way it was done before merged values were carried between notes."""
+    for add_from, add_to in pairs(notes):
+        merger._merge_field_content(recipient=add_to, from_notes=(add_from, add_to), separator=merger.separator)
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("merge_by_segments", [False, True])
+@pytest.mark.parametrize("separator", ["", "<br>", " "])
+@pytest.mark.parametrize("skip_if_not_empty", [False, True])
+@pytest.mark.parametrize("limit_to_fields", [[], ["A", "C"]])
+def test_cascade_merge_matches_pairwise_merge(
+    no_anki_config: NoAnkiConfigView,
+    seed: int,
+    merge_by_segments: bool,
+    separator: str,
+    skip_if_not_empty: bool,
+    limit_to_fields: list[str],
+) -> None:
+    """Carrying merged values between notes gives the same fields and tags as merging every pair from scratch."""
+    no_anki_config["merge_by_segments"] = merge_by_segments
+    no_anki_config["field_separator"] = separator
+    no_anki_config["skip_if_not_empty"] = skip_if_not_empty
+    no_anki_config["limit_to_fields"] = limit_to_fields
+    no_anki_config["ignore_punctuation"] = True
+    expected = random_notes(random.Random(seed), 8)
+    reference_cascade_merge(MergeNotes(FakeCollection(), no_anki_config), expected)
+
+    notes = random_notes(random.Random(seed), 8)
+    MergeNotes(FakeCollection(), no_anki_config)._cascade_merge(notes)
+
+    assert [(note._fields, note.tags) for note in notes] == [(note._fields, note.tags) for note in expected]
+
+
+@pytest.mark.parametrize(
+    "separator,values,expected",
+    [
+        ("", ["a", "b", "ab"], ["a", "ab", "ab"]),
+        ("<br>", ["a", "b", "a<br>b"], ["a", "a<br>b", "a<br>b"]),
+        ("<br>", ["a", "b", "c"], ["a", "a<br>b", "a<br>b<br>c"]),
+        ("<br>", ["a", " ", "a."], ["a", "a", "a."]),
+        (" ", ["a", "b", "a b"], ["a", "a b", "a b"]),
+        (" ", ["a", "b", "c"], ["a", "a b", "a b c"]),
+    ],
+)
+def test_cascade_merge_compares_with_joined_value(
+    no_anki_config: NoAnkiConfigView, separator: str, values: list[str], expected: list[str]
+) -> None:
+    """A note whose field equals the merged value of the previous notes, once normalized, keeps its own value."""
+    no_anki_config["field_separator"] = separator
+    no_anki_config["ignore_punctuation"] = True
+    notes = [FakeNote(nid, {"A": value}) for nid, value in enumerate(values, start=1)]
+
+    MergeNotes(FakeCollection(), no_anki_config)._cascade_merge(notes)
+
+    assert [note["A"] for note in notes] == expected
+
+
+@pytest.mark.parametrize(
+    "merge_by_segments,separator,values,expected",
+    [
+        (True, "<br>", ["a<br>b", "b"], "a<br>b"),
+        (True, "<br>", ["a", "a<br>b"], "a<br>b"),
+        (True, "<br>", ["a<br>b", "c<br>a。"], "a<br>b<br>c"),
+        (True, "<br>", ["c", "a<br><br>b"], "c<br>a<br>b"),
+        (True, "<br>", ["a", "b", "a<br>c"], "a<br>b<br>c"),
+        (True, "<br>", ["c<br><br>c", "a"], "c<br><br>c<br>a"),
+        (True, " ", ["the dog sat on the rug", "the cat sat on the mat"], "the dog sat on the rug cat mat"),
+        (True, "", ["ab", "b"], "abb"),
+        (False, "<br>", ["a<br>b", "b"], "a<br>b<br>b"),
+    ],
+)
+def test_merge_field_content_by_segments(
+    no_anki_config: NoAnkiConfigView, merge_by_segments: bool, separator: str, values: list[str], expected: str
+) -> None:
+    """Segments are kept in the order of the notes, and only segments that earlier values don't have are added."""
+    no_anki_config["merge_by_segments"] = merge_by_segments
+    no_anki_config["field_separator"] = separator
+    notes = [FakeNote(nid, {"A": value}) for nid, value in enumerate(values, start=1)]
+
+    MergeNotes(FakeCollection(), no_anki_config)._merge_field_content(notes[-1], notes, separator)
+
+    assert notes[-1]["A"] == expected
+
+
+@pytest.mark.parametrize("action", list(OriginalNotesAction))
+def test_merging_again_is_idempotent(no_anki_config: NoAnkiConfigView, action: OriginalNotesAction) -> None:
+    """Merging a merged note again with one of the notes it was merged from changes nothing."""
+    no_anki_config["original_notes_action"] = action.name
+    no_anki_config["avoid_content_loss"] = False
+    no_anki_config["merge_by_segments"] = True
+    sources = {"A": ["a", "b", "c"], "B": ["x", "", "x"]}
+    notes = [FakeNote(idx + 1, {name: values[idx] for name, values in sources.items()}) for idx in range(3)]
+    MergeNotes(FakeCollection(), no_anki_config)._do_merge(notes)
+    merged = dict(notes[-1]._fields)
+
+    again = [FakeNote(4, {name: values[1] for name, values in sources.items()}), notes[-1]]
+    MergeNotes(FakeCollection(), no_anki_config)._do_merge(again)
+
+    assert merged == {"A": "a<br>b<br>c", "B": "x"}
+    assert notes[-1]._fields == merged
+
+
 @pytest.mark.parametrize(
     "sort_order,expect_updated_id",
     [
@@ -261,3 +378,96 @@ def test_suspend_cards_of_notes(
     merger._suspend_cards_of_notes()
 
     assert col.sched.suspended_card_ids == expected_card_ids
+
+
+@pytest.mark.parametrize(
+    "action,changed,removed,suspended,first_diff",
+    [
+        (OriginalNotesAction.do_nothing, 2, 0, 0, "Note 2\n  A: 'two' → 'one two'\n  Tags: + x"),
+        (OriginalNotesAction.delete, 1, 2, 0, "Note 3\n  A: 'three' → 'one two three'\n  Tags: + x"),
+        (OriginalNotesAction.suspend, 1, 0, 2, "Note 3\n  A: 'three' → 'one two three'\n  Tags: + x"),
+    ],
+)
+def test_preview_writes_nothing(
+    no_anki_config: NoAnkiConfigView,
+    action: OriginalNotesAction,
+    changed: int,
+    removed: int,
+    suspended: int,
+    first_diff: str,
+) -> None:
+    """A preview counts the changes of a merge without touching the collection."""
+    no_anki_config["original_notes_action"] = action.name
+    no_anki_config["avoid_content_loss"] = False
+    no_anki_config["field_separator"] = " "
+    notes = [FakeNote(1, {"A": "one"}, tags=["x"]), FakeNote(2, {"A": "two"}), FakeNote(3, {"A": "three"})]
+    col = FakeCollection(notes)
+
+    preview = MergeNotes(col, no_anki_config).preview(notes, max_diffs=1)
+
+    assert (col.updated_notes, col.removed_note_ids, col.sched.suspended_card_ids) == ([], [], [])
+    assert (preview.n_notes_changed, preview.n_notes_removed, preview.n_notes_suspended) == (
+        changed,
+        removed,
+        suspended,
+    )
+    assert preview.n_tags_added == changed
+    assert preview.bytes_removed == (len("one") + len("two") if removed else 0)
+    assert [str(diff) for diff in preview.diffs] == [first_diff]
+    assert "Notes changed" in preview.report()
+
+
+@pytest.mark.parametrize(
+    "cids,expected_n_notes,expected_updated",
+    [
+        ([10, 20, 30], 3, [2, 3, 1]),
+        ([30, 10, 999], 2, [3, 1]),
+        ([10, 999], 0, []),
+    ],
+)
+def test_merge_selected_reads_notes_in_background(
+    no_anki_config: NoAnkiConfigView, cids: list[CardId], expected_n_notes: int, expected_updated: list[int]
+) -> None:
+    """Selected cards are read, ordered by due and merged by the operation itself, given only their IDs."""
+    notes = [FakeNote(nid, {"Front": f"front {nid}"}) for nid in (1, 2, 3)]
+    for note, due in zip(notes, [3, 1, 2]):
+        note.cards()[0].due = due
+    col = FakeCollection(notes)
+
+    result = BrowserMenus(no_anki_config)._merge_selected(col, cids, NullProfiler())
+
+    assert result.n_notes == expected_n_notes
+    assert [note.id for note in col.updated_notes] == expected_updated
+
+
+@pytest.mark.parametrize(
+    "action,cids,expected_nids,expected_cids,expected_selected",
+    [
+        (OriginalNotesAction.delete, [10, 20, 30], {1}, {10}, 10),
+        (OriginalNotesAction.delete, [30, 999, 20, 10], {1}, {10}, 10),
+        (OriginalNotesAction.suspend, [30, 10, 20], {1, 2, 3}, {10, 20, 30}, None),
+        (OriginalNotesAction.do_nothing, [999, 20, 10], {1, 2}, {10, 20}, None),
+    ],
+)
+def test_merge_selected_returns_surviving_ids(
+    no_anki_config: NoAnkiConfigView,
+    action: OriginalNotesAction,
+    cids: list[CardId],
+    expected_nids: set[int],
+    expected_cids: set[int],
+    expected_selected: typing.Optional[int],
+) -> None:
+    """
+    The result lists selected notes and cards that weren't deleted.
+    If other notes were deleted, the first remaining card in selection order is selected.
+    """
+    no_anki_config["original_notes_action"] = action.name
+    notes = [FakeNote(nid, {"Front": f"front {nid}"}) for nid in (1, 2, 3)]
+    for note, due in zip(notes, [3, 1, 2]):
+        note.cards()[0].due = due
+    col = FakeCollection(notes)
+
+    result = BrowserMenus(no_anki_config)._merge_selected(col, cids, NullProfiler())
+
+    assert (result.surviving_nids, result.surviving_cids) == (expected_nids, expected_cids)
+    assert result.card_to_select == expected_selected
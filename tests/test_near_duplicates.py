@@ -0,0 +1,86 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import pytest
+from anki.notes import NoteId
+
+from merge_notes import near_duplicates
+from merge_notes.near_duplicates import (
+    DisjointSet,
+    MinHasher,
+    find_near_duplicates,
+    jaccard,
+    shingles,
+)
+
+
+def note_values(values: list[str]) -> list[tuple[NoteId, str]]:
+    """Return the values paired with note IDs counted from 1."""
+    return [(NoteId(nid), value) for nid, value in enumerate(values, start=1)]
+
+
+@pytest.mark.parametrize(
+    "text,size,expected_count",
+    [
+        ("abcd", 3, 2),
+        ("ab", 3, 1),
+        ("aaaa", 2, 1),
+    ],
+)
+def test_shingles(text: str, size: int, expected_count: int) -> None:
+    """Strings are split into distinct n-grams."""
+    assert len(shingles(text, size)) == expected_count
+
+
+def test_minhash_estimates_similarity() -> None:
+    """Equal sets get equal signatures, and disjoint sets almost never share signature values."""
+    hasher = MinHasher(num_perm=64)
+    a = shingles("毎日日本語を勉強します", 3)
+    b = shingles("昨日映画を見に行きました", 3)
+    assert hasher.signature(a) == MinHasher(num_perm=64).signature(a)
+    assert sum(x == y for x, y in zip(hasher.signature(a), hasher.signature(b))) < 8
+    assert jaccard(a, a) == 1.0
+
+
+def test_disjoint_set() -> None:
+    """Unions are transitive and the smallest item represents its set."""
+    sets = DisjointSet()
+    sets.union(3, 2)
+    sets.union(2, 5)
+    assert sets.find(5) == sets.find(3) == 2
+    assert sets.find(4) == 4
+
+
+@pytest.mark.parametrize(
+    "values,threshold,expected",
+    [
+        # One particle differs.
+        (
+            ["毎日日本語を勉強しています", "毎日日本語も勉強しています", "昨日映画を見に行きました"],
+            0.5,
+            [("毎日日本語を勉強しています", [1, 2])],
+        ),
+        # A trailing fragment is missing.
+        (
+            ["今日はとても天気がいいですね", "昨日映画を見に行きました", "今日はとても天気がいいです"],
+            0.7,
+            [("今日はとても天気がいいですね", [1, 3])],
+        ),
+        # Exact duplicates are always grouped.
+        (["同じ文", "同じ文", "違う文です"], 1.0, [("同じ文", [1, 2])]),
+        # Similar, but below the threshold.
+        (["毎日日本語を勉強しています", "毎日日本語も勉強しています"], 0.9, []),
+        ([], 0.8, []),
+    ],
+)
+def test_find_near_duplicates(values: list[str], threshold: float, expected: list) -> None:
+    """Similar values are grouped when their similarity reaches the threshold."""
+    assert find_near_duplicates(note_values(values), threshold) == expected
+
+
+def test_find_near_duplicates_follows_chains(monkeypatch: pytest.MonkeyPatch) -> None:
+    """A value similar to the second member of a bucket joins the group even if it isn't similar to the first one."""
+    monkeypatch.setattr(near_duplicates.MinHasher, "signature", lambda self, hashes: (0,) * 32)
+    values = ["abcdef", "abcdefgh", "cdefgh"]
+    assert jaccard(shingles(values[0], 3), shingles(values[2], 3)) < 0.6
+    assert find_near_duplicates(note_values(values), 0.6) == [("abcdef", [1, 2, 3])]
@@ -0,0 +1,106 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import pytest
+from anki.cards import CardId
+from anki.decks import DeckId
+from anki.models import NotetypeDict, NotetypeId
+from anki.notes import NoteId
+
+from merge_notes.bulk_reader import card_ids_of_notes, home_deck_ids, load_cards_by_id
+from merge_notes.config_types import OrderingChoice, SortOrder
+from merge_notes.ordering import CardOrdering
+from playground.no_anki_config import NoAnkiConfigView
+from tests.helpers import FakeCollection, FakeModels, FakeNote
+
+
+class CountingModels(FakeModels):
+    """Model manager double that counts note type lookups."""
+
+    def __init__(self) -> None:
+        """Start counting."""
+        super().__init__()
+        self.lookups = 0
+
+    def get(self, id: NotetypeId) -> NotetypeDict:
+        """Count the lookup and return the note type."""
+        self.lookups += 1
+        return super().get(id)
+
+
+class CountingCollection(FakeCollection):
+    """Collection double whose model manager counts note type lookups."""
+
+    models: CountingModels
+
+
+def make_collection() -> CountingCollection:
+    """Return a collection with two note types, numeric and text sort fields, and mixed due numbers."""
+    notes = [
+        FakeNote(1, {"Number": "10", "Meaning": "b"}),
+        FakeNote(2, {"Number": "9", "Meaning": "a"}),
+        FakeNote(3, {"Number": "x", "Meaning": "c"}),
+        FakeNote(4, {"Sentence": "2", "Meaning": "e", "Extra": "z"}),
+        FakeNote(5, {"Sentence": "1", "Meaning": "d", "Extra": "y"}),
+    ]
+    for note, due in zip(notes, [3, 1, 3, 2, 0]):
+        note.cards()[0].due = due
+    col = CountingCollection()
+    col.models = CountingModels()
+    for note in notes:
+        col.notes[note.id] = note
+        col.models.register(note)
+        col.db.add_note(note)
+    return col
+
+
+CIDS = [CardId(cid) for cid in (50, 10, 30, 20, 40)]
+
+
+def test_load_cards_by_id() -> None:
+    """Cards are returned in the order of the given IDs, with their notes, skipping nonexistent cards."""
+    cards = load_cards_by_id(make_collection(), [CardId(cid) for cid in (30, 999, 10, 20)], batch_size=2)
+    assert [(card.id, card.nid, card.due, card.note()["Meaning"]) for card in cards] == [
+        (30, 3, 3, "c"),
+        (10, 1, 3, "b"),
+        (20, 2, 1, "a"),
+    ]
+
+
+def test_card_ids_of_notes() -> None:
+    """Card IDs of all the notes are read in batches, skipping nonexistent notes."""
+    assert card_ids_of_notes(make_collection(), [NoteId(nid) for nid in (3, 999, 1, 5)], batch_size=2) == [30, 10, 50]
+
+
+def test_home_deck_ids() -> None:
+    """A card in a filtered deck reports its home deck."""
+    col = make_collection()
+    note = col.notes[NoteId(2)]
+    filtered_card = note.cards()[0]
+    filtered_card.did, filtered_card.odid = DeckId(7), DeckId(5)
+    col.db.add_note(note)
+    assert home_deck_ids(col, [NoteId(nid) for nid in (1, 2, 999)], batch_size=1) == {1: 1, 2: 5}
+
+
+@pytest.mark.parametrize("ordering", list(OrderingChoice))
+@pytest.mark.parametrize("sort_order", list(SortOrder))
+@pytest.mark.parametrize("custom_sort_field", ["Meaning", "Extra"])
+def test_ordering_matches_config_key(
+    no_anki_config: NoAnkiConfigView, ordering: OrderingChoice, sort_order: SortOrder, custom_sort_field: str
+) -> None:
+    """Cards are ordered exactly like by the config's key, which looks up the note type for every card."""
+    no_anki_config["ordering"] = ordering.name
+    no_anki_config["sort_order"] = sort_order.name
+    no_anki_config["custom_sort_field"] = custom_sort_field
+    col = make_collection()
+    cards = load_cards_by_id(col, CIDS)
+    # The config's key takes a Card, which CardRow stands in for.
+    expected = sorted(
+        cards, key=no_anki_config.ord_key, reverse=sort_order is SortOrder.descending  # type: ignore[arg-type]
+    )
+
+    col.models.lookups = 0
+    result = CardOrdering(col, no_anki_config).sorted(cards)
+
+    assert [card.id for card in result] == [card.id for card in expected]
+    assert col.models.lookups <= 2  # at most once per note type
@@ -0,0 +1,95 @@
+# Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
+# License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
+
+import pathlib
+import subprocess
+import sys
+from typing import Any
+
+import pytest
+from anki.notes import NoteId
+
+from merge_notes import duplicate_search
+from merge_notes.bulk_reader import batched
+from merge_notes.duplicate_search import (
+    DuplicateSearch,
+    group_by_value,
+    normalize_values,
+)
+from merge_notes.parallel import group_in_parallel, merge_group_maps, normalize_chunk
+from merge_notes.progress import ProgressReporter
+from playground.no_anki_config import NoAnkiConfigView
+from tests.helpers import FakeNote, FakeSearchCollection, RecordingProgress
+
+
+@pytest.mark.parametrize(
+    "partials,expected",
+    [
+        ([{"a": [1]}, {"b": [2], "a": [3]}], {"a": [1, 3], "b": [2]}),
+        ([{}, {"a": [1, 2]}], {"a": [1, 2]}),
+        ([], {}),
+    ],
+)
+def test_merge_group_maps(partials: list[dict[str, list[NoteId]]], expected: dict[str, list[NoteId]]) -> None:
+    """Partial group maps are merged in order."""
+    groups: dict[str, list[NoteId]] = {}
+    for partial in partials:
+        merge_group_maps(groups, partial)
+    assert groups == expected
+    assert list(groups) == list(expected)
+
+
+def test_chunked_grouping_matches_serial(no_anki_config: NoAnkiConfigView) -> None:
+    """Merging per-chunk results gives exactly the serial result, including order."""
+    pairs = [(NoteId(nid), value) for nid, value in enumerate(["<b>a</b>", "b", "a！", "", "c", "b", "a"] * 3)]
+    groups: dict[str, list[NoteId]] = {}
+    for chunk in batched(pairs, 4):
+        merge_group_maps(groups, normalize_chunk(no_anki_config.normalizer, chunk))
+    serial = group_by_value(normalize_values(pairs, no_anki_config.normalizer))
+    assert list(groups.items()) == list(serial.items())
+
+
+def test_group_in_parallel_matches_serial(no_anki_config: NoAnkiConfigView) -> None:
+    """The process pool returns the same groups as a serial search."""
+    pairs = [(NoteId(nid), value) for nid, value in enumerate(["<b>a</b>", "b", "a！", "", "c", "b", "a"] * 10)]
+    result = group_in_parallel(batched(pairs, 8), no_anki_config.normalizer, ProgressReporter(), workers=2)
+    serial = group_by_value(normalize_values(pairs, no_anki_config.normalizer))
+    assert list(result.items()) == list(serial.items())
+
+
+def test_workers_import_parallel_without_aqt() -> None:
+    """Worker processes can load normalize_chunk without importing aqt, which needs Qt."""
+    code = "import sys, merge_notes.parallel; sys.exit('aqt' in sys.modules)"
+    root = pathlib.Path(__file__).parent.parent
+    assert subprocess.run([sys.executable, "-c", code], cwd=root).returncode == 0
+
+
+def test_failed_parallel_search_falls_back(monkeypatch: pytest.MonkeyPatch, no_anki_config: NoAnkiConfigView) -> None:
+    """If the process pool can't be used, the search runs in one process, gives the same groups and tells the user."""
+
+    def broken_pool(*_args: Any, **_kwargs: Any) -> Any:
+        raise ImportError("No module named 'merge_notes'")
+
+    monkeypatch.setattr(duplicate_search, "group_in_parallel", broken_pool)
+    no_anki_config["parallel_duplicate_search"] = True
+    no_anki_config["parallel_min_notes"] = 1
+    col = FakeSearchCollection(FakeNote(nid, {"Front": value}) for nid, value in enumerate(["a", "b", "a！"], start=1))
+    progress = RecordingProgress()
+    assert DuplicateSearch(no_anki_config).find(col, "Front", "", progress) == [("a", [1, 3])]
+    assert len(progress.messages) == 1
+
+
+def test_unexpected_parallel_search_error_is_raised(
+    monkeypatch: pytest.MonkeyPatch, no_anki_config: NoAnkiConfigView
+) -> None:
+    """Only failures to use worker processes fall back. Other errors aren't hidden."""
+
+    def broken_search(*_args: Any, **_kwargs: Any) -> Any:
+        raise ValueError("bug")
+
+    monkeypatch.setattr(duplicate_search, "group_in_parallel", broken_search)
+    no_anki_config["parallel_duplicate_search"] = True
+    no_anki_config["parallel_min_notes"] = 1
+    col = FakeSearchCollection(FakeNote(nid, {"Front": value}) for nid, value in enumerate(["a", "a"], start=1))
+    with pytest.raises(ValueError):
+        DuplicateSearch(no_anki_config).find(col, "Front", "")
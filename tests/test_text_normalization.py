@@ -1,9 +1,13 @@
 # Copyright: Ajatt-Tools and contributors; https://github.com/Ajatt-Tools
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 
+import threading
+
 import pytest
 
-from merge_notes.merge_notes import (
+from merge_notes.normalizer import (
+    NormalizedValueCache,
+    Normalizer,
     cfg_strip,
     full_width_to_half_width,
     remove_furigana,
@@ -89,3 +93,111 @@ def test_cfg_strip_disabled_flags(no_anki_config: NoAnkiConfigView, key: str, te
     no_anki_config[key] = False
     no_anki_config["punctuation_characters"] = "！"
     assert cfg_strip(text, no_anki_config) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "plain ascii",
+        "<b>漢字[かんじ]！１２３</b>",
+        "  Hello！ ",
+        "ｶﾀｶﾅ、ＡＢＣ。",
+        "x &amp; y",
+        "<div>日本語[にほんご]</div><br>テスト",
+        "",
+    ],
+)
+def test_normalizer_matches_step_by_step_stripping(no_anki_config: NoAnkiConfigView, text: str) -> None:
+    """The compiled normalizer gives the same result as applying each step in turn."""
+    no_anki_config["ignore_furigana"] = True
+    expected = text
+    expected = strip_html(expected)
+    expected = remove_furigana(expected)
+    expected = strip_punctuation(expected, no_anki_config)
+    expected = full_width_to_half_width(expected).strip()
+    assert Normalizer.from_config(no_anki_config)(text) == expected
+
+
+def test_normalizer_rebuilt_on_config_change(no_anki_config: NoAnkiConfigView) -> None:
+    """Changing comparison settings replaces the cached normalizer."""
+    normalizer = no_anki_config.normalizer
+    assert no_anki_config.normalizer is normalizer
+    no_anki_config["merge_tags"] = False
+    assert no_anki_config.normalizer is normalizer
+    no_anki_config["ignore_punctuation"] = False
+    assert no_anki_config.normalizer is not normalizer
+    normalizer = no_anki_config.normalizer
+    no_anki_config.update_from_addon_manager({"ignore_punctuation": True})
+    assert no_anki_config.normalizer is not normalizer
+
+
+def test_unchanged_settings_from_addon_manager_keep_normalizer(no_anki_config: NoAnkiConfigView) -> None:
+    """Saving the config in the add-on manager keeps the normalizer and cached values if comparison is the same."""
+    normalizer = no_anki_config.normalizer
+    no_anki_config.normalized_values("x！")
+    no_anki_config.update_from_addon_manager({"merge_tags": False})
+    assert no_anki_config.normalizer is normalizer
+    assert len(no_anki_config.normalized_values) == 1
+    no_anki_config.update_from_addon_manager({"normalization_cache_mb": no_anki_config.normalization_cache_mb + 1})
+    assert no_anki_config.normalizer is normalizer
+    assert len(no_anki_config.normalized_values) == 0
+
+
+def test_normalized_value_cache_counts_hits_and_misses(no_anki_config: NoAnkiConfigView) -> None:
+    """Repeated values are served from the cache."""
+    cache = NormalizedValueCache(no_anki_config.normalizer, max_bytes=1024 * 1024)
+    assert [cache(text) for text in ("<b>a</b>", "b", "<b>a</b>")] == ["a", "b", "a"]
+    assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+
+
+def test_normalized_value_cache_evicts_least_recently_used(no_anki_config: NoAnkiConfigView) -> None:
+    """The oldest entries are dropped once the memory budget is exceeded."""
+    cache = NormalizedValueCache(no_anki_config.normalizer, max_bytes=1024)
+    for i in range(100):
+        cache(f"value {i}")
+    assert 0 < len(cache) < 100
+    assert cache.size_bytes <= 1024
+    cache("value 99")
+    assert cache.hits == 1
+
+
+def test_normalized_value_cache_is_thread_safe(no_anki_config: NoAnkiConfigView) -> None:
+    """Threads that look up and evict values at the same time don't break the cache or its size."""
+    cache = NormalizedValueCache(no_anki_config.normalizer, max_bytes=2048)
+    errors = []
+
+    def look_up(offset: int) -> None:
+        """Look up overlapping values, so that threads hit and evict each other's entries."""
+        try:
+            for i in range(2000):
+                assert cache(f"<b>value{(i + offset) % 50}</b>") == f"value{(i + offset) % 50}"
+        except Exception as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=look_up, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert 0 < cache.size_bytes <= 2048
+    cache.clear()
+    assert cache.size_bytes == 0
+
+
+@pytest.mark.parametrize(
+    "key,value,expect_cleared",
+    [
+        ("ignore_punctuation", True, False),
+        ("ignore_punctuation", False, True),
+        ("merge_tags", False, False),
+    ],
+)
+def test_normalized_value_cache_invalidated_by_settings(
+    no_anki_config: NoAnkiConfigView, key: str, value: object, expect_cleared: bool
+) -> None:
+    """Cached values survive config writes unless comparison settings actually change."""
+    no_anki_config.normalized_values("x！")
+    no_anki_config[key] = value
+    assert (len(no_anki_config.normalized_values) == 0) is expect_cleared